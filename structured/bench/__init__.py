@@ -0,0 +1,3 @@
+"""
+Offline benchmarks of the query and ingestion paths, run with python -m bench.run
+"""
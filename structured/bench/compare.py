@@ -0,0 +1,49 @@
+"""
+Compare two benchmark result files of bench.run run by run
+
+Usage: python -m bench.compare baseline.json candidate.json
+"""
+
+import argparse
+import json
+from typing import Iterator, Tuple
+
+
+def metrics(run: dict) -> Iterator[Tuple[str, float]]:
+    """
+    Flat (name, value) pairs of the comparable metrics of a run
+    """
+    yield "requests_per_second", run["requests_per_second"]
+    for p in ("p50", "p95", "p99"):
+        yield f"latency_ms.{p}", run["latency_ms"].get(p, 0.0)
+    for stage, summary in run["stages_ms"].items():
+        yield f"stages_ms.{stage}.p95", summary.get("p95", 0.0)
+    yield "prompt_tokens_per_request.mean", run["prompt_tokens_per_request"]["mean"]
+    yield "cached_tokens_per_request", run.get("cached_tokens_per_request", 0.0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two bench.run result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = {r["concurrency"]: r for r in json.load(f)["runs"]}
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = {r["concurrency"]: r for r in json.load(f)["runs"]}
+
+    for concurrency in sorted(set(baseline) & set(candidate)):
+        print(f"concurrency {concurrency}")
+        old = dict(metrics(baseline[concurrency]))
+        for name, new_value in metrics(candidate[concurrency]):
+            old_value = old.get(name)
+            if old_value is None:
+                print(f"  {name:<50} {'-':>10} {new_value:>10}")
+                continue
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            print(f"  {name:<50} {old_value:>10} {new_value:>10} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+This is config file from where we manage all the variables to be used in the bench folder
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "llm", "prompts")
+
+STUB_HOST = os.getenv("BENCH_STUB_HOST", "127.0.0.1")
+STUB_PORT = int(os.getenv("BENCH_STUB_PORT", "8765"))
+
+# Latency distributions of the stubbed completions, see openai_stub.parse_distribution for the format.
+# The first content token of a completion waits for the method latency, every next token for the token latency.
+STUB_LATENCY = {
+    "revise_query": os.getenv("BENCH_LATENCY_REVISE_QUERY", "lognormal:600,0.3"),
+    "extract_relevant_ids": os.getenv(
+        "BENCH_LATENCY_EXTRACT_RELEVANT_IDS", "lognormal:900,0.3"
+    ),
+    "query_with_context": os.getenv(
+        "BENCH_LATENCY_QUERY_WITH_CONTEXT", "lognormal:500,0.3"
+    ),
+    "default": os.getenv("BENCH_LATENCY_DEFAULT", "lognormal:1500,0.3"),
+}
+STUB_TOKEN_LATENCY = os.getenv("BENCH_TOKEN_LATENCY", "fixed:8")
+# Latency of a stubbed batch before its requests are answered
+STUB_BATCH_LATENCY = os.getenv("BENCH_BATCH_LATENCY", "fixed:1000")
+# Words of the stubbed answers
+STUB_ANSWER_WORDS = int(os.getenv("BENCH_ANSWER_WORDS", "150"))
+
+# Latency of one node lookup of the in-memory Neo4j stand-in
+MEMORY_GRAPH_LATENCY = os.getenv("BENCH_MEMORY_GRAPH_LATENCY", "lognormal:4,0.3")
@@ -0,0 +1,149 @@
+"""
+In-memory stand-in for Neo4j built from the extraction files, used by the benchmarks when no Neo4j is running
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from database.corpus import bump_corpus_version
+from database.graphdb import format_neighbors
+from .openai_stub import parse_distribution
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class _Entity:
+    """
+    Node or relationship exposing the attributes of the neo4j driver objects read by format_neighbors
+    """
+
+    def __init__(self, properties: dict, type: Optional[str] = None) -> None:
+        self._properties = properties
+        self.type = type
+
+
+class MemoryNeo4j:
+    """
+    Graph of the extractions, relationships and papers kept in dictionaries.
+    Every node lookup waits for a latency drawn from a distribution to stand for the round trip to Neo4j.
+    """
+
+    def __init__(self, latency: str = config.MEMORY_GRAPH_LATENCY) -> None:
+        """
+        Args:
+            latency(str): latency distribution of a node lookup, see openai_stub.parse_distribution
+        """
+        self.latency = parse_distribution(latency)
+        self.nodes: Dict[str, _Entity] = {}
+        # node id -> (relationship, neighbor) pairs in both directions
+        self.edges: Dict[str, List[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, source: str, target: str, relationship: _Entity) -> None:
+        if source in self.nodes and target in self.nodes:
+            self.edges.setdefault(source, []).append((relationship, self.nodes[target]))
+            self.edges.setdefault(target, []).append((relationship, self.nodes[source]))
+
+    def create_knowledge_graph(self, file_path: str) -> None:
+        """
+        Load the extractions, relationships and paper of an extraction file, see Neo4j.create_knowledge_graph
+
+        Args:
+            file_path(str): full file path(.json) from where to extract the entities and relationships
+        """
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            paper_id = data["paper_id"]
+            with self._lock:
+                for node in data["extractions"]:
+                    self.nodes[node["extraction_id"]] = _Entity(
+                        {
+                            "id": node["extraction_id"],
+                            "content": node["extracted_content"],
+                            "evidence": node["supporting_evidence"],
+                            "keywords": node["keywords"],
+                        }
+                    )
+                for edge in data["relationships"]:
+                    self._connect(
+                        edge["source_extraction_id"],
+                        edge["target_extraction_id"],
+                        _Entity(
+                            {
+                                "id": edge["relationship_id"],
+                                "type": edge["relationship_type"],
+                                "description": edge["relationship_description"],
+                                "evidence": edge["supporting_evidence"],
+                            },
+                            type=edge["relationship_type"],
+                        ),
+                    )
+                self.nodes[paper_id] = _Entity(
+                    {"id": paper_id, **data["paper_summary"]}
+                )
+                for node in data["extractions"]:
+                    self._connect(
+                        node["extraction_id"], paper_id, _Entity({}, type="belongs_to")
+                    )
+            bump_corpus_version()
+        except Exception as e:
+            logger.error(f"Failed to create knowledge graph {e}")
+
+    def _neighbors(self, node: str) -> dict:
+        node_records = [{"node": self.nodes[node]}] if node in self.nodes else []
+        neighbor_records = [
+            {"relationship": relationship, "neighbor": neighbor}
+            for relationship, neighbor in self.edges.get(node, [])
+        ]
+        return format_neighbors(node_records, neighbor_records)
+
+    def retrieve_neighbors(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ) -> List[dict]:
+        """
+        Given nodes return all of this neighbors with their relationships, see Neo4j.retrieve_neighbors
+        """
+        output = []
+        for node in nodes:
+            time.sleep(self.latency())
+            output.append(self._neighbors(node))
+        return output
+
+    def retrieve_neighbors_batch(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ) -> Dict[str, dict]:
+        """
+        Neighbors of all the nodes in a single round trip, see Neo4j.retrieve_neighbors_batch
+        """
+        time.sleep(self.latency())
+        return {node: self._neighbors(node) for node in dict.fromkeys(nodes) if node}
+
+
+class AsyncMemoryNeo4j(MemoryNeo4j):
+    """
+    Async variant of MemoryNeo4j with the interface of AsyncNeo4j
+    """
+
+    async def retrieve_node(self, node: str, timeout: Optional[float] = None) -> dict:
+        await asyncio.sleep(self.latency())
+        return self._neighbors(node)
+
+    async def retrieve_neighbors(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ) -> List[dict]:
+        return list(await asyncio.gather(*(self.retrieve_node(n) for n in nodes)))
+
+    async def retrieve_neighbors_batch(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ) -> Dict[str, dict]:
+        await asyncio.sleep(self.latency())
+        return {node: self._neighbors(node) for node in dict.fromkeys(nodes) if node}
+
+    async def close(self) -> None:
+        return None
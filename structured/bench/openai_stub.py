@@ -0,0 +1,358 @@
+"""
+OpenAI compatible chat completions server with configurable latency distributions, used by the benchmarks
+instead of api.openai.com. The kind of call is recognized from the prompts of llm/prompts.
+The files and batches endpoints emulate the Batch API for the batch mode of the ontology generation.
+
+Run on its own with: python -m bench.openai_stub
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from utils import count_tokens
+from . import config
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_ID_PATTERN = re.compile(r"\bP\d{3}_EXT_\d+\b")
+# every ontology prompt describes the extraction_id of its output schema
+ONTOLOGY_SIGNATURE = "extraction_id"
+# OpenAI caches prompts from 1024 tokens on, by increments of 128 tokens
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+ANSWER_WORDS = (
+    "The context indicates that coastal flood thresholds depend on tidal datums, "
+    "storm surge and sea level rise projections measured at the nearest gauge."
+).split()
+
+
+def parse_distribution(spec: str) -> Callable[[], float]:
+    """
+    Sampler of a latency distribution given in milliseconds
+
+    Args:
+        spec(str): "fixed:ms", "uniform:low_ms,high_ms", "normal:mean_ms,std_ms" or "lognormal:median_ms,sigma"
+
+    Returns:
+        sample(Callable[[], float]): returns a latency in seconds
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(0, values[1]) * values[0] / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def load_prompt_signatures(prompts_dir: str = config.PROMPTS_DIR) -> Dict[str, str]:
+    """
+    Opening line of each prompt, used to recognize the method that made a call
+
+    Args:
+        prompts_dir(str): folder of the LLM prompts
+
+    Returns:
+        signatures(Dict[str, str]): method name to the first non empty line of its prompt
+    """
+    signatures = {}
+    for file_name in os.listdir(prompts_dir):
+        with open(os.path.join(prompts_dir, file_name), "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        if lines:
+            method = file_name.rsplit(".", 1)[0]
+            signatures[
+                "query_with_context" if method == "general_context" else method
+            ] = lines[0]
+    return signatures
+
+
+def fixture_ontology() -> dict:
+    """
+    Ontology answered to the extraction calls, the first paper of the fixtures
+    """
+    papers_dir = os.path.join(config.FIXTURES_DIR, "papers")
+    with open(
+        os.path.join(papers_dir, sorted(os.listdir(papers_dir))[0]), encoding="utf-8"
+    ) as f:
+        return json.load(f)
+
+
+class OpenAIStub:
+    """
+    Produces the completions of the stub server
+    """
+
+    def __init__(
+        self,
+        latency: Dict[str, str] = config.STUB_LATENCY,
+        token_latency: str = config.STUB_TOKEN_LATENCY,
+        answer_words: int = config.STUB_ANSWER_WORDS,
+        batch_latency: str = config.STUB_BATCH_LATENCY,
+    ) -> None:
+        """
+        Args:
+            latency(Dict[str, str]): latency distribution of the first token per method, "default" for the others
+            token_latency(str): latency distribution of every next streamed token
+            batch_latency(str): latency distribution of a batch before its requests are answered
+            answer_words(int): words of the answers
+        """
+        self.latency = {m: parse_distribution(s) for m, s in latency.items()}
+        self.token_latency = parse_distribution(token_latency)
+        self.batch_latency = parse_distribution(batch_latency)
+        self.answer_words = answer_words
+        self.signatures = load_prompt_signatures()
+        # system messages already sent, the prefixes the prompt cache would hold
+        self._prefixes: set = set()
+        # uploaded files by id, with their content, and batches by id
+        self.files: Dict[str, dict] = {}
+        self.batches: Dict[str, dict] = {}
+
+    def method(self, messages: List[dict]) -> str:
+        """
+        Method that sent the messages, recognized from its prompt
+        """
+        text = "\n".join(str(m.get("content", "")) for m in messages)
+        for method, signature in self.signatures.items():
+            if signature in text:
+                return method
+        system = messages[0].get("content", "") if messages else ""
+        if ONTOLOGY_SIGNATURE in str(system):
+            return "llm_ontology"
+        return "default"
+
+    def completion(self, method: str, messages: List[dict]) -> str:
+        """
+        Content of the completion, shaped like the answers the LLM methods parse
+        """
+        user = next(
+            (m["content"] for m in reversed(messages) if m.get("role") == "user"), ""
+        )
+        if method == "revise_query":
+            return json.dumps([user, f"{user} in coastal watersheds"])
+        if method == "extract_relevant_ids":
+            text = "\n".join(str(m.get("content", "")) for m in messages)
+            ids = list(dict.fromkeys(EXTRACTION_ID_PATTERN.findall(text)))[:3]
+            return json.dumps(ids)
+        if method == "llm_ontology":
+            return f"```json\n{json.dumps(fixture_ontology(), indent=2)}\n```"
+        words = [ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(self.answer_words)]
+        return " ".join(words)
+
+    def usage(self, messages: List[dict], content: str) -> dict:
+        prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = count_tokens(content)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "prompt_tokens_details": {
+                "cached_tokens": self.cached_tokens(messages, prompt_tokens)
+            },
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def cached_tokens(self, messages: List[dict], prompt_tokens: int) -> int:
+        """
+        Prompt tokens the OpenAI prompt cache would serve: the leading system message once it was
+        seen before, for prompts of at least 1024 tokens, in increments of 128 tokens
+        """
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        seen = prefix in self._prefixes
+        self._prefixes.add(prefix)
+        if not seen or prompt_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return count_tokens(prefix) // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+
+    async def create(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        method = self.method(messages)
+        content = self.completion(method, messages)
+        await asyncio.sleep(self.latency.get(method, self.latency["default"])())
+        # the full completion is generated before it is returned
+        await asyncio.sleep(
+            sum(self.token_latency() for _ in range(len(content.split()) - 1))
+        )
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": self.usage(messages, content),
+        }
+
+    def store_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        """
+        Keep an uploaded file
+
+        Returns:
+            file(dict): file object of the OpenAI files endpoint
+        """
+        file = {
+            "id": f"file-{uuid.uuid4().hex}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        self.files[file["id"]] = {**file, "content": content}
+        return file
+
+    def create_batch(self, body: dict) -> dict:
+        """
+        Start a batch on an uploaded JSONL file, its completions run in the background
+
+        Returns:
+            batch(dict): batch object of the OpenAI batches endpoint
+        """
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.batches[batch["id"]] = batch
+        asyncio.get_running_loop().create_task(self.run_batch(batch))
+        return batch
+
+    async def run_batch(self, batch: dict) -> None:
+        """
+        Answer every request of the batch after the batch latency, all of them concurrently
+        """
+        lines = self.files[batch["input_file_id"]]["content"].decode().splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        batch["status"] = "in_progress"
+        batch["request_counts"]["total"] = len(requests)
+        await asyncio.sleep(self.batch_latency())
+
+        async def answer(request: dict) -> str:
+            response = await self.create(request["body"])
+            batch["request_counts"]["completed"] += 1
+            result = {
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": response,
+                },
+                "error": None,
+            }
+            return json.dumps(result)
+
+        results = await asyncio.gather(*(answer(request) for request in requests))
+        output = self.store_file(
+            "\n".join(results).encode(), f"{batch['id']}_output.jsonl", "batch_output"
+        )
+        batch["output_file_id"] = output["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    async def stream(self, body: dict) -> AsyncIterator[str]:
+        messages = body.get("messages", [])
+        method = self.method(messages)
+        content = self.completion(method, messages)
+        chunk = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+        }
+        await asyncio.sleep(self.latency.get(method, self.latency["default"])())
+        for i, word in enumerate(content.split(" ")):
+            if i:
+                await asyncio.sleep(self.token_latency())
+            delta = {"content": word if i == 0 else " " + word}
+            choice = {"index": 0, "delta": delta, "finish_reason": None}
+            yield f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\n"
+        choice = {"index": 0, "delta": {}, "finish_reason": "stop"}
+        yield f"data: {json.dumps({**chunk, 'choices': [choice]})}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = self.usage(messages, content)
+            yield f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+
+def create_app(stub: Optional[OpenAIStub] = None) -> FastAPI:
+    """
+    FastAPI app serving the chat completions endpoint of the stub
+
+    Args:
+        stub(Optional[OpenAIStub]): stub producing the completions, a default one is created if not provided
+
+    Returns:
+        app(FastAPI): app to serve with uvicorn, the OpenAI base url is http://host:port/v1
+    """
+    stub = stub or OpenAIStub()
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            return StreamingResponse(stub.stream(body), media_type="text/event-stream")
+        return await stub.create(body)
+
+    @app.post("/v1/files")
+    async def upload_file(request: Request):
+        form = await request.form()
+        upload = form["file"]
+        content = await upload.read()
+        return stub.store_file(content, upload.filename, form.get("purpose", ""))
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        if file_id not in stub.files:
+            raise HTTPException(status_code=404, detail="No such file")
+        return PlainTextResponse(stub.files[file_id]["content"])
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        if body.get("input_file_id") not in stub.files:
+            raise HTTPException(status_code=400, detail="No such input file")
+        return stub.create_batch(body)
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        if batch_id not in stub.batches:
+            raise HTTPException(status_code=404, detail="No such batch")
+        return stub.batches[batch_id]
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(create_app(), host=config.STUB_HOST, port=config.STUB_PORT)
@@ -0,0 +1,346 @@
+"""
+Offline end-to-end benchmark. Ingests the fixture corpus into a real Chroma persistent client and a Neo4j
+(in-memory stand-in or local server), then replays a question file through Query.query with N concurrent
+clients against the OpenAI stub. Reports ingestion time, per-stage p50/p95/p99 latency, requests per second
+and prompt tokens per request as JSON so that successive runs can be compared with bench.compare.
+
+Usage: python -m bench.run --concurrency 1,4,8 --rounds 2 --output bench_results.json
+"""
+
+import argparse
+import contextvars
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def summarize(values: List[float], scale: float = 1000.0) -> dict:
+    """
+    Count, mean and percentiles of the values
+
+    Args:
+        values(List[float]): observed values
+        scale(float): multiplier applied to the values, 1000 reports seconds in milliseconds
+
+    Returns:
+        summary(dict): count, mean, p50, p95 and p99
+    """
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values, dtype=np.float64) * scale
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean": round(float(array.mean()), 3),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+    }
+
+
+class Collector:
+    """
+    Observer of the stage and LLM call events. Prompt tokens are attributed to the request through a
+    context variable, Query submits its stages to the executor in a copy of the context so the calls
+    made from worker threads count for the request that started them.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, List[float]] = {}
+        self.llm_calls: Dict[str, List[float]] = {}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        # one-element list shared by the copies of the request context
+        self._request_tokens: contextvars.ContextVar[Optional[List[int]]] = (
+            contextvars.ContextVar("request_tokens", default=None)
+        )
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict) -> None:
+        with self._lock:
+            if event["type"] == "stage":
+                self.stages.setdefault(event["stage"], []).append(event["seconds"])
+                return
+            self.llm_calls.setdefault(event["method"], []).append(event["seconds"])
+            self.prompt_tokens += event["prompt_tokens"]
+            self.cached_tokens += event["cached_tokens"]
+            self.completion_tokens += event["completion_tokens"]
+            tokens = self._request_tokens.get()
+            if tokens is not None:
+                tokens[0] += event["prompt_tokens"]
+
+    def begin_request(self) -> None:
+        self._request_tokens.set([0])
+
+    def end_request(self) -> int:
+        tokens = self._request_tokens.get()
+        self._request_tokens.set(None)
+        return tokens[0] if tokens else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--questions", default=os.path.join(config.FIXTURES_DIR, "questions.txt")
+    )
+    parser.add_argument(
+        "--concurrency", default="1,4", help="comma separated client counts"
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=1, help="times the question file is replayed"
+    )
+    parser.add_argument(
+        "--collection", default="auto", help="collection_name of Query.query"
+    )
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument(
+        "--graph",
+        choices=["memory", "neo4j"],
+        default="memory",
+        help="in-memory stand-in or the Neo4j of the NEO4J_* variables, which the corpus is written to",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="keep the semantic and persistent caches enabled, by default every request runs the full pipeline",
+    )
+    parser.add_argument(
+        "--workdir",
+        default="",
+        help="folder of the Chroma data, a temporary one by default",
+    )
+    parser.add_argument("--port", type=int, default=config.STUB_PORT)
+    parser.add_argument(
+        "--output", default="", help="JSON file of the results, stdout by default"
+    )
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace, workdir: str) -> None:
+    """
+    Point the project configuration at the stub and the benchmark folder.
+    Must run before the project packages are imported since their config is read on import.
+    """
+    os.environ["OPENAI_BASE_URL"] = f"http://{config.STUB_HOST}:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "vectordb")
+    os.environ["CORPUS_VERSION_FILE"] = os.path.join(workdir, "corpus_version")
+    os.environ["PERSISTENT_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite3")
+    if not args.cache:
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["PERSISTENT_CACHE_ENABLED"] = "false"
+
+
+def start_stub(port: int):
+    """
+    Serve the OpenAI stub from a daemon thread
+
+    Args:
+        port(int): port of the stub
+
+    Returns:
+        server(uvicorn.Server): running server, stop it with server.should_exit = True
+    """
+    import uvicorn
+
+    from .openai_stub import create_app
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            create_app(), host=config.STUB_HOST, port=port, log_level="warning"
+        )
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def ingest(chromadb, graph) -> dict:
+    """
+    Store the fixture corpus and time each part of the ingestion
+
+    Args:
+        chromadb: Chromadb the Vector and Graph collections are stored in
+        graph: Neo4j or MemoryNeo4j the knowledge graph is created in
+
+    Returns:
+        timings(dict): seconds spent per ingestion step
+    """
+    papers_dir = os.path.join(config.FIXTURES_DIR, "papers")
+    texts_dir = os.path.join(config.FIXTURES_DIR, "texts")
+    timings = {}
+
+    start = time.perf_counter()
+    for file_name in sorted(os.listdir(texts_dir)):
+        chromadb.store_text_to_db(
+            collection_name="Vector", input_file=os.path.join(texts_dir, file_name)
+        )
+    timings["vector_collection_seconds"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    for file_name in sorted(os.listdir(papers_dir)):
+        chromadb.store_json_to_db(
+            collection_name="Graph", input_file=os.path.join(papers_dir, file_name)
+        )
+    timings["graph_collection_seconds"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    for file_name in sorted(os.listdir(papers_dir)):
+        graph.create_knowledge_graph(os.path.join(papers_dir, file_name))
+    timings["knowledge_graph_seconds"] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+def run_level(
+    query,
+    questions: List[str],
+    concurrency: int,
+    collector: Collector,
+    collection: str,
+    speculative: bool,
+) -> dict:
+    """
+    Run every question once with concurrency clients sharing the Query
+
+    Args:
+        query: Query the questions are asked to
+        questions(List[str]): questions to ask
+        concurrency(int): concurrent clients
+        collector(Collector): observer registered on the metrics, reset by the caller
+        collection(str): collection_name passed to Query.query
+        speculative(bool): speculative retrieval
+
+    Returns:
+        results(dict): throughput, latencies and prompt tokens of the level
+    """
+    latencies, tokens, errors = [], [], []
+
+    def ask(question: str) -> None:
+        collector.begin_request()
+        start = time.perf_counter()
+        try:
+            query.query(
+                user_query=question,
+                collection_name=collection,
+                speculative=speculative,
+            )
+        except Exception as e:
+            errors.append(str(e))
+        latencies.append(time.perf_counter() - start)
+        tokens.append(collector.end_request())
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(ask, questions))
+    wall = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(questions),
+        "errors": len(errors),
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(questions) / wall, 3),
+        "latency_ms": summarize(latencies),
+        "stages_ms": {s: summarize(v) for s, v in sorted(collector.stages.items())},
+        "llm_calls_ms": {
+            m: summarize(v) for m, v in sorted(collector.llm_calls.items())
+        },
+        "prompt_tokens_per_request": {
+            "mean": round(collector.prompt_tokens / max(len(questions), 1), 1),
+            **{k: v for k, v in summarize(tokens, scale=1).items() if k != "count"},
+        },
+        "cached_tokens_per_request": round(
+            collector.cached_tokens / max(len(questions), 1), 1
+        ),
+        "completion_tokens_per_request": round(
+            collector.completion_tokens / max(len(questions), 1), 1
+        ),
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="graphrag_bench_")
+    configure_environment(args, workdir)
+
+    # the project packages read their config on import, after configure_environment
+    from database import Chromadb, Neo4j
+    from query import Query
+    from utils import add_observer, remove_observer
+    from .memory_graph import MemoryNeo4j
+
+    with open(args.questions, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    server = start_stub(args.port)
+    try:
+        chromadb = Chromadb()
+        graph = MemoryNeo4j() if args.graph == "memory" else Neo4j()
+        ingestion = ingest(chromadb, graph)
+        query = Query(chromadb=chromadb, neo4j=graph)
+        # load the models and open the connections outside of the measurements
+        query.query(user_query=questions[0], collection_name=args.collection)
+
+        runs = []
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            collector = Collector()
+            add_observer(collector)
+            try:
+                runs.append(
+                    run_level(
+                        query,
+                        questions * args.rounds,
+                        concurrency,
+                        collector,
+                        args.collection,
+                        args.speculative,
+                    )
+                )
+            finally:
+                remove_observer(collector)
+            logger.info(
+                f"concurrency {concurrency}: {runs[-1]['requests_per_second']} requests/s"
+            )
+    finally:
+        server.should_exit = True
+
+    results = {
+        "config": {
+            "questions": os.path.basename(args.questions),
+            "rounds": args.rounds,
+            "collection": args.collection,
+            "speculative": args.speculative,
+            "graph": args.graph,
+            "cache": args.cache,
+            "stub_latency": config.STUB_LATENCY,
+            "stub_token_latency": config.STUB_TOKEN_LATENCY,
+            "memory_graph_latency": config.MEMORY_GRAPH_LATENCY,
+            "python": platform.python_version(),
+        },
+        "ingestion": ingestion,
+        "runs": runs,
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
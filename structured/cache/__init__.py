@@ -0,0 +1,19 @@
+"""
+Entry point for cache package. SemanticCache is imported on first use so that the LLM can use
+SQLiteCache without loading numpy and the database package.
+"""
+
+from importlib import import_module
+
+from .sqlite_cache import SQLiteCache
+
+# name -> submodule defining it, imported by __getattr__ on first access
+LAZY_IMPORTS = {"SemanticCache": "semantic_cache"}
+
+
+def __getattr__(name: str):
+    if name not in LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{LAZY_IMPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,27 @@
+"""
+This is config file from where we manage all the variables to be used in the cache folder
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Off by default: a close question is not always the same question, opt in once the threshold
+# is tuned on the corpus
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Minimum cosine similarity between two queries for them to share an answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024"))
+
+# SQLite file shared by all the server workers and batch jobs, survives restarts
+PERSISTENT_CACHE_ENABLED = (
+    os.getenv("PERSISTENT_CACHE_ENABLED", "true").lower() == "true"
+)
+PERSISTENT_CACHE_PATH = os.getenv(
+    "PERSISTENT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache", "cache.sqlite3"),
+)
+REVISE_CACHE_TTL_SECONDS = float(os.getenv("REVISE_CACHE_TTL_SECONDS", "604800"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
@@ -0,0 +1,187 @@
+"""
+Semantic cache that reuses answers of previous queries whose embeddings are close enough to the new query
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, List, Optional
+
+import numpy as np
+
+from database import corpus_version
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def salient_terms(query: str) -> FrozenSet[str]:
+    """
+    Numbers and identifiers of the query, such as years, quantities or extraction ids. Two queries
+    can be close in the embedding space and still ask about different years, so they only share an
+    answer when they agree on these terms.
+
+    Args:
+        query(str): question asked by the user
+
+    Returns:
+        terms(FrozenSet[str]): lower cased words of the query containing a digit
+    """
+    return frozenset(re.findall(r"\b\w*\d\w*\b", query.lower()))
+
+
+class SemanticCache:
+    """
+    In-memory LRU cache of answers keyed on the query embedding.
+    Entries expire after a TTL and are ignored once the corpus has changed.
+    The embeddings live in a matrix allocated once for max_entries rows, a lookup is a single
+    product with it.
+    """
+
+    def __init__(
+        self,
+        embedding_model,
+        threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: float = config.SEMANTIC_CACHE_TTL_SECONDS,
+        max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES,
+    ) -> None:
+        """
+        Args:
+            embedding_model: already loaded SentenceTransformer used to embed the queries
+            threshold(float): minimum cosine similarity for a hit
+            ttl_seconds(float): seconds after which an entry expires
+            max_entries(int): maximum number of entries before the least recently used is evicted
+        """
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._next_key = 0
+        # row of every entry in the matrix, allocated on the first put once the dimension is known
+        self.matrix: Optional[np.ndarray] = None
+        self.slot_keys: List[Optional[int]] = [None] * max_entries
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+
+    def embed(self, query: str) -> np.ndarray:
+        """
+        Embed the query and normalize it so that a dot product is the cosine similarity
+
+        Args:
+            query(str): query to embed
+
+        Returns:
+            embedding(np.ndarray): unit length embedding of the query
+        """
+        embedding = np.asarray(self.embedding_model.encode(query), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def get(
+        self, embedding: np.ndarray, collection_name: str, user_query: str
+    ) -> Optional[str]:
+        """
+        Look up the answer of the most similar previous query that mentions the same numbers and ids
+
+        Args:
+            embedding(np.ndarray): normalized embedding of the query
+            collection_name(str): collection the query is asked against
+            user_query(str): question asked by the user
+
+        Returns:
+            answer(Optional[str]): cached answer, None on a miss
+        """
+        now = time.time()
+        version = corpus_version()
+        terms = salient_terms(user_query)
+        with self.lock:
+            self._evict_stale(now=now, version=version)
+            if self.entries:
+                scores = self.matrix @ embedding
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for slot in candidates[np.argsort(-scores[candidates])]:
+                    key = self.slot_keys[slot]
+                    if key is None:
+                        continue
+                    entry = self.entries[key]
+                    if (
+                        entry["collection"] != collection_name
+                        or entry["terms"] != terms
+                    ):
+                        continue
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    logger.info(
+                        f"Semantic cache hit with similarity {scores[slot]:.3f}"
+                    )
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def put(
+        self, embedding: np.ndarray, collection_name: str, answer: str, user_query: str
+    ) -> None:
+        """
+        Store the answer for the query embedding
+
+        Args:
+            embedding(np.ndarray): normalized embedding of the query
+            collection_name(str): collection the query was asked against
+            answer(str): answer to cache
+            user_query(str): question asked by the user
+        """
+        if not answer or self.max_entries <= 0:
+            return
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros(
+                    (self.max_entries, len(embedding)), dtype=np.float32
+                )
+            while len(self.entries) >= self.max_entries:
+                self._remove(next(iter(self.entries)))
+            slot = self.free_slots.pop()
+            self.matrix[slot] = embedding
+            self.slot_keys[slot] = self._next_key
+            self.entries[self._next_key] = {
+                "slot": slot,
+                "collection": collection_name,
+                "terms": salient_terms(user_query),
+                "answer": answer,
+                "created_at": time.time(),
+                "version": corpus_version(),
+            }
+            self._next_key += 1
+
+    def clear(self) -> None:
+        """
+        Remove all the entries
+        """
+        with self.lock:
+            for key in list(self.entries):
+                self._remove(key)
+
+    def _remove(self, key: int) -> None:
+        """
+        Remove the entry and free its row of the matrix, called with the lock held
+        """
+        slot = self.entries.pop(key)["slot"]
+        self.matrix[slot] = 0
+        self.slot_keys[slot] = None
+        self.free_slots.append(slot)
+
+    def _evict_stale(self, now: float, version: int) -> None:
+        """
+        Remove the entries that expired or were answered from an older corpus
+        """
+        stale = [
+            k
+            for k, e in self.entries.items()
+            if now - e["created_at"] > self.ttl_seconds or e["version"] != version
+        ]
+        for k in stale:
+            self._remove(k)
@@ -0,0 +1,189 @@
+"""
+Persistent key value cache stored in SQLite, shared between processes
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from utils import record_cache
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# eviction of the expired and least recently used entries runs once every this many writes
+EVICT_EVERY = 100
+
+
+class SQLiteCache:
+    """
+    Namespaced JSON key value cache in a SQLite file with optional TTL and maximum size.
+    WAL mode lets several workers read and write the same file concurrently.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        path: str = config.PERSISTENT_CACHE_PATH,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            namespace(str): name of the cache, entries of different namespaces never collide
+            path(str): path of the SQLite file
+            ttl_seconds(Optional[float]): seconds after which an entry expires, None to never expire
+            max_entries(Optional[int]): maximum entries of the namespace, least recently used are evicted first
+        """
+        self.namespace = namespace
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread, sqlite3 connections cannot be shared between threads
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (namespace, accessed_at)"
+            )
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """
+        Hash the parts of a key into a fixed size key
+
+        Args:
+            parts(str): parts identifying the entry
+
+        Returns:
+            key(str): sha256 of the parts
+        """
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Value stored for the key
+
+        Args:
+            key(str): key of the entry
+
+        Returns:
+            value(Optional[Any]): stored value, None on a miss or if the entry expired
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            now = time.time()
+            if row and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                connection.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                )
+                row = None
+            if row is None:
+                self.misses += 1
+                record_cache(self.namespace, hit=False)
+                return None
+            connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            self.hits += 1
+            record_cache(self.namespace, hit=True)
+            return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Failed to read {self.namespace} cache: {e}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store the value for the key
+
+        Args:
+            key(str): key of the entry
+            value(Any): JSON serializable value
+        """
+        try:
+            now = time.time()
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self.evict()
+        except Exception as e:
+            logger.error(f"Failed to write {self.namespace} cache: {e}")
+
+    def evict(self) -> None:
+        """
+        Remove the expired entries and the least recently used ones above the maximum size
+        """
+        connection = self._connection()
+        if self.ttl_seconds is not None:
+            connection.execute(
+                "DELETE FROM entries WHERE namespace = ? AND created_at < ?",
+                (self.namespace, time.time() - self.ttl_seconds),
+            )
+        if self.max_entries is not None:
+            connection.execute(
+                """
+                DELETE FROM entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM entries WHERE namespace = ?
+                    ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.namespace, self.namespace, self.max_entries),
+            )
+
+    def clear(self) -> None:
+        """
+        Remove all the entries of the namespace
+        """
+        self._connection().execute(
+            "DELETE FROM entries WHERE namespace = ?", (self.namespace,)
+        )
+
+    def stats(self) -> dict:
+        """
+        Hits and misses of this process and the number of entries of the namespace
+        """
+        size = (
+            self._connection()
+            .execute(
+                "SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)
+            )
+            .fetchone()[0]
+        )
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
@@ -2,5 +2,8 @@
 Entry point for database package
 """
 
+from .corpus import corpus_version, bump_corpus_version
+from .embedding import get_embedding_model
 from .graphdb import Neo4j
+from .async_graphdb import AsyncNeo4j
 from .chromadb import Chromadb
@@ -0,0 +1,145 @@
+"""
+Async Neo4j module built on the async Neo4j driver, used by the server for the query path
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from neo4j import AsyncGraphDatabase, Query
+
+from .graphdb import (
+    CYPHER_NODE,
+    CYPHER_NEIGHBORS,
+    CYPHER_NODES_BATCH,
+    CYPHER_NEIGHBORS_BATCH,
+    cypher_timeout,
+    format_neighbors,
+    group_neighbors,
+)
+from . import config
+
+logger = logging.getLogger(__name__)
+
+CYPHER_PING = "RETURN 1"
+
+
+class AsyncNeo4j:
+    """
+    Async Neo4j class containing the read functions needed while answering a query
+    """
+
+    def __init__(self) -> None:
+        uri = config.NEO4J_URI or ""
+        username = config.NEO4J_USERNAME or ""
+        password = config.NEO4J_PASSWORD or ""
+        self.driver = AsyncGraphDatabase.driver(uri=uri, auth=(username, password))
+
+    async def close(self) -> None:
+        """
+        Close the driver and its connection pool
+        """
+        await self.driver.close()
+
+    async def warm_up(self, connections: int = 1) -> None:
+        """
+        Check that Neo4j is reachable and open connections of the pool ahead of the first query
+        Args:
+            connections(int): connections to open concurrently
+        """
+        await self.driver.verify_connectivity()
+
+        async def ping() -> None:
+            async with self.driver.session() as session:
+                result = await session.run(CYPHER_PING)
+                await result.consume()
+
+        await asyncio.gather(*(ping() for _ in range(connections)))
+
+    async def retrieve_node(self, node: str, timeout: Optional[float] = None) -> dict:
+        """
+        Retrieve a single node with its neighbors and relationships
+        Args:
+            node(str): Pid_EXT_id of the node
+            timeout(Optional[float]): seconds each of the two transactions may take
+
+        Returns:
+            output(dict): Node, Paper and the Record of relationships and neighbors
+        """
+        if timeout is not None and timeout <= 0:
+            logger.warning(f"Out of time, skipped node {node}")
+            return format_neighbors([], [])
+        # a session is not safe to share between concurrent tasks so every node gets its own
+        async with self.driver.session() as session:
+            result = await session.run(
+                Query(CYPHER_NODE, timeout=cypher_timeout(timeout)), node_id=node
+            )
+            node_records = [record async for record in result]
+            result = await session.run(
+                Query(CYPHER_NEIGHBORS, timeout=cypher_timeout(timeout)), node_id=node
+            )
+            neighbor_records = [record async for record in result]
+        return format_neighbors(node_records, neighbor_records)
+
+    async def retrieve_neighbors(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ):
+        """
+        Given nodes return all of this neighbors with their relationships, the nodes are fetched concurrently
+        Args:
+            nodes(List[str]): Pid_EXT_id of the nodes to extract the neighbors an relationships of
+            timeout(Optional[float]): seconds each transaction may take
+
+        Returns:
+            List of all the nodes, papers and relationships
+        """
+        try:
+            if timeout is not None and timeout <= 0:
+                logger.warning(f"Out of time, skipped {len(nodes)} nodes")
+                return []
+            logger.info("Retrieving Neighbors")
+            final_output = await asyncio.gather(
+                *(self.retrieve_node(node, timeout=timeout) for node in nodes)
+            )
+            logger.info(f"Successfully extracted {len(final_output)} neighbors")
+            return list(final_output)
+        except Exception as e:
+            logger.error(f"Failed to retrieve nodes {e}")
+            return []
+
+    async def retrieve_neighbors_batch(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ) -> Dict[str, dict]:
+        """
+        Given nodes return all of their neighbors with their relationships in two round trips,
+        whatever the number of nodes
+        Args:
+            nodes(List[str]): Pid_EXT_id of the nodes to extract the neighbors an relationships of
+            timeout(Optional[float]): seconds each of the two transactions may take
+
+        Returns:
+            output(Dict[str, dict]): Node, Paper and the Record of relationships and neighbors per node id
+        """
+        try:
+            node_ids = list(dict.fromkeys(n for n in nodes if n))
+            if not node_ids:
+                return {}
+            if timeout is not None and timeout <= 0:
+                logger.warning(f"Out of time, skipped {len(node_ids)} nodes")
+                return {}
+            logger.info(f"Retrieving Neighbors of {len(node_ids)} nodes")
+            async with self.driver.session() as session:
+                result = await session.run(
+                    Query(CYPHER_NODES_BATCH, timeout=cypher_timeout(timeout)),
+                    node_ids=node_ids,
+                )
+                node_records = [record async for record in result]
+                result = await session.run(
+                    Query(CYPHER_NEIGHBORS_BATCH, timeout=cypher_timeout(timeout)),
+                    node_ids=node_ids,
+                )
+                neighbor_records = [record async for record in result]
+            return group_neighbors(node_ids, node_records, neighbor_records)
+        except Exception as e:
+            logger.error(f"Failed to retrieve nodes {e}")
+            return {}
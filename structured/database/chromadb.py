@@ -4,17 +4,19 @@ Chromadb module containing all the functions for chromadb
 
 import os
 import json
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
 import logging
 import chromadb
 
 # from langchain_openai import OpenAIEmbeddings
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
 
 
-from utils import json_to_txt, text_chunking
+from utils import Deadline, json_to_txt
 from . import config
+from .corpus import bump_corpus_version
+from .embedding import get_embedding_model
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,33 @@ class ChunkDict(BaseModel):
     chunk: str
     source: str
     chunk_id: str
+    extraction_id: Optional[str] = None
+    first_level_class: Optional[str] = None
+
+
+# optional ChunkDict fields that are stored as metadata when present
+OPTIONAL_METADATA = ("extraction_id", "first_level_class")
+
+
+def merge_records(records: List[dict]) -> List[dict]:
+    """
+    De-duplicate records on their text keeping the closest distance
+
+    Args:
+        records(List[dict]): records with text and distance
+
+    Returns:
+        merged(List[dict]): unique records sorted from the closest
+    """
+    best: Dict[str, dict] = {}
+    for r in records:
+        if r["text"] not in best or r["distance"] < best[r["text"]]["distance"]:
+            best[r["text"]] = r
+    return sorted(best.values(), key=lambda r: r["distance"])
+
+
+# text encoded by warm_up
+WARM_UP_TEXT = "warm up"
 
 
 class Chromadb:
@@ -38,12 +67,23 @@ class Chromadb:
         """
         logger.info("Initializing Chroma")
         openai_api_key = config.OPENAI_API_KEY
-        self.chroma_client = chromadb.PersistentClient(path="vectordb")
+        self.chroma_client = chromadb.PersistentClient(path=config.CHROMA_PATH)
         # self.embedding_model = OpenAIEmbeddings(model=embedding_model)
-        self.embedding_model = SentenceTransformer(
-            "sentence-transformers/all-MiniLM-L6-v2"
+        self.embedding_model_name = config.EMBEDDING_MODEL
+        self.embedding_model = get_embedding_model()
+        # shared by the fan-out searches, a pool per call would leave its threads behind on timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.CHROMA_SEARCH_WORKERS, thread_name_prefix="chroma"
         )
 
+    def warm_up(self) -> None:
+        """
+        Run a first encode and open the collections so that the first query does not pay for
+        the lazy initialization of the model and of the Chroma client
+        """
+        self.embedding_model.encode([WARM_UP_TEXT])
+        self.chroma_client.list_collections()
+
     def store_chunks(self, chunks: List[ChunkDict], collection_name: str) -> bool:
         """
         Stores the chunks with their respective file_name in db
@@ -62,11 +102,17 @@ class Chromadb:
             # embeddings = self.embedding_model.embed_documents(texts)
             embeddings = self.embedding_model.encode(texts)
             metadatas = [
-                {"text": c["chunk"], "source": c["source"], "chunk_id": c["chunk_id"]}
+                {
+                    "text": c["chunk"],
+                    "source": c["source"],
+                    "chunk_id": c["chunk_id"],
+                    **{k: c[k] for k in OPTIONAL_METADATA if c.get(k)},
+                }
                 for c in chunks
             ]
 
             collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas)
+            bump_corpus_version()
             return True
 
         except Exception as e:
@@ -74,7 +120,11 @@ class Chromadb:
             return False
 
     def retrieve_similar_chunks(
-        self, query: str, collection_name: str, top_k: int = 5
+        self,
+        query: str,
+        collection_name: str,
+        top_k: int = 5,
+        query_embedding: Optional[List[float]] = None,
     ) -> List[str]:
         """
         Retreive similar chunks from ChromaDB for the query
@@ -83,6 +133,7 @@ class Chromadb:
             query(str): the query to retrieve the similar chunks from
             collection_name(str): collection name that we are searching on
             top_k(int): how many similar chunks to retrieve
+            query_embedding(Optional[List[float]]): precomputed embedding of the query, encoded if not provided
 
         Returns:
             output(List[str]): list of similar chunks retrieved
@@ -93,9 +144,10 @@ class Chromadb:
             if collection:
                 print(f"Found collection for {collection_name}")
             # query_embedding = self.embedding_model.embed_query(query)
-            query_embedding = self.embedding_model.encode(query)
+            if query_embedding is None:
+                query_embedding = self.embedding_model.encode(query).tolist()
             results = collection.query(
-                query_embeddings=[query_embedding.tolist()], n_results=top_k
+                query_embeddings=[query_embedding], n_results=top_k
             )
             output = [
                 results["text"]
@@ -107,6 +159,170 @@ class Chromadb:
             print(f"Error fetching similar chunks: {e}")
             return []
 
+    def encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Encode all the queries with a single call to the embedding model
+
+        Args:
+            queries(List[str]): queries to be encoded
+
+        Returns:
+            embeddings(List[List[float]]): one embedding per query, in the same order
+        """
+        if not queries:
+            return []
+        return self.embedding_model.encode(queries).tolist()
+
+    def retrieve_similar_records_batch(
+        self,
+        query_embeddings: List[List[float]],
+        collection_name: str,
+        top_k: int = 5,
+        where: Optional[dict] = None,
+    ) -> List[List[dict]]:
+        """
+        Retrieve similar records for many query embeddings with a single collection query
+
+        Args:
+            query_embeddings(List[List[float]]): embeddings of the queries
+            collection_name(str): collection name that we are searching on
+            top_k(int): how many similar records to retrieve per query
+            where(Optional[dict]): metadata filter of the records
+
+        Returns:
+            output(List[List[dict]]): for each query embedding the metadata of the similar records
+                (text, source, chunk_id, ...) with their distance to the query
+        """
+        try:
+            if not query_embeddings:
+                return []
+            collection = self.chroma_client.get_collection(collection_name)
+            kwargs = {"where": where} if where else {}
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_k,
+                include=["metadatas", "distances"],
+                **kwargs,
+            )
+            return [
+                [
+                    {**m, "distance": d}
+                    for m, d in zip(metadatas, distances)
+                    if m["source"][0]
+                ]
+                for metadatas, distances in zip(
+                    results["metadatas"], results["distances"]
+                )
+            ]
+        except Exception as e:
+            logger.error(f"Error fetching similar chunks from {collection_name}: {e}")
+            return [[] for _ in query_embeddings]
+
+    def retrieve_similar_chunks_batch(
+        self, query_embeddings: List[List[float]], collection_name: str, top_k: int = 5
+    ) -> List[List[str]]:
+        """
+        Retrieve similar chunks for many query embeddings with a single collection query
+
+        Args:
+            query_embeddings(List[List[float]]): embeddings of the queries
+            collection_name(str): collection name that we are searching on
+            top_k(int): how many similar chunks to retrieve per query
+
+        Returns:
+            output(List[List[str]]): similar chunks for each of the query embeddings
+        """
+        records = self.retrieve_similar_records_batch(
+            query_embeddings=query_embeddings,
+            collection_name=collection_name,
+            top_k=top_k,
+        )
+        return [[r["text"] for r in query_records] for query_records in records]
+
+    def fan_out_retrieve_records(
+        self,
+        queries: List[str],
+        collection_names: List[str],
+        top_k: int = 5,
+        query_embeddings: Optional[List[List[float]]] = None,
+        per_query: Optional[Callable[[List[dict]], List[dict]]] = None,
+        where: Optional[dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, List[dict]]:
+        """
+        Retrieve similar records for every (query x collection) pair concurrently.
+        All the queries are encoded once and each collection is queried once with all the embeddings.
+
+        Args:
+            queries(List[str]): queries to retrieve the similar records for
+            collection_names(List[str]): collections to search on
+            top_k(int): how many similar records to retrieve per query
+            query_embeddings(Optional[List[List[float]]]): precomputed embeddings of the queries,
+                encoded if not provided
+            per_query(Optional[Callable[[List[dict]], List[dict]]]): applied to the records of each
+                query before they are merged, e.g. to trim them on their distance
+            where(Optional[dict]): metadata filter of the records
+            timeout(Optional[float]): seconds to wait for the collections, the ones still searching
+                after it are left empty
+
+        Returns:
+            output(Dict[str, List[dict]]): records for each collection, de-duplicated on their text
+                keeping the closest distance and sorted from the closest
+        """
+        output: Dict[str, List[dict]] = {c: [] for c in collection_names}
+        if not queries or not collection_names:
+            return output
+
+        if query_embeddings is None:
+            query_embeddings = self.encode_queries(queries)
+        deadline = Deadline(timeout)
+        futures = {
+            c: self.executor.submit(
+                self.retrieve_similar_records_batch,
+                query_embeddings,
+                c,
+                top_k,
+                where,
+            )
+            for c in collection_names
+        }
+        for c, future in futures.items():
+            try:
+                results = future.result(timeout=deadline.remaining())
+            except TimeoutError:
+                # drops the search if it is still queued behind other queries
+                future.cancel()
+                logger.warning(f"Retrieval from {c} ran out of time")
+                continue
+            output[c] = merge_records(
+                [
+                    r
+                    for records in results
+                    for r in (per_query(records) if per_query else records)
+                ]
+            )
+        return output
+
+    def fan_out_retrieve(
+        self, queries: List[str], collection_names: List[str], top_k: int = 5
+    ) -> Dict[str, List[str]]:
+        """
+        Retrieve similar chunks for every (query x collection) pair concurrently.
+        All the queries are encoded once and each collection is queried once with all the embeddings.
+
+        Args:
+            queries(List[str]): queries to retrieve the similar chunks for
+            collection_names(List[str]): collections to search on
+            top_k(int): how many similar chunks to retrieve per query
+
+        Returns:
+            output(Dict[str, List[str]]): de-duplicated similar chunks for each collection
+        """
+        records = self.fan_out_retrieve_records(
+            queries=queries, collection_names=collection_names, top_k=top_k
+        )
+        return {c: [r["text"] for r in rs] for c, rs in records.items()}
+
     def collection_exists(self, collection_name: str) -> bool:
         """
         Checks if the collection already exists in the Chromadb
@@ -140,6 +356,7 @@ class Chromadb:
         """
         try:
             self.chroma_client.delete_collection(name=collection_name)
+            bump_corpus_version()
             print(f"Collection {collection_name} successfully deleted")
         except Exception as e:
             print(f"Failed to delete collection {collection_name}: {e}")
@@ -183,12 +400,14 @@ class Chromadb:
             contents = json_to_txt(file_name=str(file_path))
 
             total_chunks = []
-            for idx, c in enumerate(contents):
+            for idx, (c, extraction) in enumerate(zip(contents, obj["extractions"])):
                 # since the text(c) is small we are not going to split the text into chunks
                 chunk = {
                     "chunk": c,
                     "source": paper_id,
                     "chunk_id": paper_id + str(idx),
+                    "extraction_id": extraction["extraction_id"],
+                    "first_level_class": extraction["first_level_class"],
                 }
                 total_chunks.append(chunk)
             if self.store_chunks(total_chunks, collection_name=collection_name):
@@ -234,6 +453,9 @@ class Chromadb:
                 file_path(str): Name of the file to be store in the database
 
             """
+            # langchain is only loaded by the ingestion, not by the server
+            from utils import text_chunking
+
             chunks = []
             file_name = file_path.split("/")[-1]
             with open(file_path, "r") as f:
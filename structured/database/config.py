@@ -12,3 +12,21 @@ NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USERNAME = os.getenv("NEO4J_USERNAME")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Folder of EMBEDDING_MODEL saved with `python -m database.export_embedding_model`, loaded without
+# network access when set
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH")
+
+# Folder of the Chroma persistent client
+CHROMA_PATH = os.getenv("CHROMA_PATH", "vectordb")
+
+# File whose modification time is the version of the data stored in Chroma and Neo4j
+CORPUS_VERSION_FILE = os.getenv(
+    "CORPUS_VERSION_FILE", os.path.join("vectordb", "corpus_version")
+)
+
+# Smallest transaction timeout sent to Neo4j, which reads a timeout of 0 as no timeout at all
+CYPHER_MIN_TIMEOUT_SECONDS = float(os.getenv("CYPHER_MIN_TIMEOUT_SECONDS", "0.05"))
+
+# Threads shared by the concurrent searches of the collections
+CHROMA_SEARCH_WORKERS = int(os.getenv("CHROMA_SEARCH_WORKERS", "8"))
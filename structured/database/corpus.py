@@ -0,0 +1,36 @@
+"""
+Corpus version shared between the ingestion scripts and the server, used to invalidate caches when the data changes
+"""
+
+import os
+import time
+import logging
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def corpus_version() -> int:
+    """
+    Current version of the corpus, 0 if it was never bumped
+
+    Returns:
+        version(int): modification time of the corpus version file in nanoseconds
+    """
+    try:
+        return os.stat(config.CORPUS_VERSION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_corpus_version() -> None:
+    """
+    Mark the corpus as changed. The version lives in a file so that it is shared between processes.
+    """
+    try:
+        os.makedirs(os.path.dirname(config.CORPUS_VERSION_FILE) or ".", exist_ok=True)
+        with open(config.CORPUS_VERSION_FILE, "w") as f:
+            f.write(str(time.time_ns()))
+    except Exception as e:
+        logger.error(f"Failed to bump corpus version: {e}")
@@ -0,0 +1,56 @@
+"""
+Process wide registry of the embedding models, so that every Chromadb of a process shares one model
+and a pre-forking server can load it once in the master for all of its workers
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+from sentence_transformers import SentenceTransformer
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+_models: Dict[str, SentenceTransformer] = {}
+_lock = threading.Lock()
+
+
+def load_embedding_model(source: str) -> SentenceTransformer:
+    """
+    Load an embedding model. Models from the local artifact at EMBEDDING_MODEL_PATH are loaded
+    without network access so that starting a server never reaches the Hugging Face Hub
+
+    Args:
+        source(str): local folder or Hugging Face name of the model
+
+    Returns:
+        model(SentenceTransformer): embedding model
+    """
+    if source == config.EMBEDDING_MODEL_PATH:
+        logger.info(f"Loading the embedding model from {source}")
+        return SentenceTransformer(source, local_files_only=True)
+    logger.info(f"Loading the embedding model {source}")
+    return SentenceTransformer(source)
+
+
+def get_embedding_model(source: Optional[str] = None) -> SentenceTransformer:
+    """
+    Embedding model of the process, loaded on the first call
+
+    Args:
+        source(str): local folder or Hugging Face name of the model, EMBEDDING_MODEL_PATH or
+            EMBEDDING_MODEL by default
+
+    Returns:
+        model(SentenceTransformer): embedding model shared by all the callers
+    """
+    source = source or config.EMBEDDING_MODEL_PATH or config.EMBEDDING_MODEL
+    model = _models.get(source)
+    if model is None:
+        with _lock:
+            model = _models.get(source)
+            if model is None:
+                model = _models[source] = load_embedding_model(source)
+    return model
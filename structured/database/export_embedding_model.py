@@ -0,0 +1,33 @@
+"""
+Save the embedding model to a local folder, to be shipped with the server and loaded through
+EMBEDDING_MODEL_PATH without network access
+
+Usage: python -m database.export_embedding_model <folder>
+"""
+
+import sys
+import logging
+
+from sentence_transformers import SentenceTransformer
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def export_embedding_model(path: str) -> None:
+    """
+    Download EMBEDDING_MODEL and save it to the folder
+
+    Args:
+        path(str): folder to save the model to
+    """
+    model = SentenceTransformer(config.EMBEDDING_MODEL)
+    model.save(path)
+    logger.info(f"Saved {config.EMBEDDING_MODEL} to {path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python -m database.export_embedding_model <folder>")
+    export_embedding_model(sys.argv[1])
@@ -2,7 +2,7 @@
 Neo4j modules containing all the functions for Neo4j
 """
 
-from typing import List
+from typing import Dict, List, Optional
 import json
 import logging
 from dotenv import load_dotenv
@@ -11,7 +11,9 @@ from pydantic import BaseModel
 
 from neo4j import GraphDatabase, Query
 
+from utils import Deadline
 from . import config
+from .corpus import bump_corpus_version
 
 # TODO: Create Relevant section on the properties of nodes & edge that only that can be sent to the LLMs
 
@@ -211,16 +213,18 @@ class Neo4j:
                 session.execute_write(
                     self.create_paper_connections, Paper(**paper), extractions
                 )
-                return
+            bump_corpus_version()
+            return
         except Exception as e:
             logger.error(f"Failed to create knowledge graph {e}")
             return
 
-    def retrieve_neighbors(self, nodes: List[str]):
+    def retrieve_neighbors(self, nodes: List[str], timeout: Optional[float] = None):
         """
         Given nodes return all of this neighbors with their relationships
         Args:
             nodes(List[str]): Pid_EXT_id of the nodes to extract the neighbors an relationships of
+            timeout(Optional[float]): seconds for all the nodes, the nodes left when it runs out are skipped
 
         Returns:
             List of all the nodes, papers and relationships
@@ -228,75 +232,189 @@ class Neo4j:
         try:
             logger.info("Retrieving Neighbors")
             final_output = []
+            deadline = Deadline(timeout)
             with self.driver.session() as session:
                 for node in nodes:
+                    if deadline.expired():
+                        logger.warning(
+                            f"Out of time, skipped {len(nodes) - len(final_output)} nodes"
+                        )
+                        break
                     print("Finding neighbors for", node)
-                    output = {"Record": []}
-                    cypher_self = f"MATCH (node) WHERE node.id='{node}' RETURN node"
-                    # params = {"node_id": node}
-                    # result = session.run(Query(cypher_self, params))
-                    result = session.run(cypher_self)
-                    # print('For Node the number of results is ',len(result))
-                    for record in result:
-
-                        content = record["node"]._properties["content"]
-                        evidence = record["node"]._properties["evidence"]
-                        output["Node"] = {"content": content, "evidence": evidence}
-
-                    cypher_other = f"MATCH (node)-[relationship]-(neighbor) WHERE node.id ='{node}' RETURN relationship, neighbor"
-                    # print('Running Cypher: ', cypher_other)
-                    params = {"node_id": node}
-                    # result = session.run(Query(cypher_other, params))
-                    result = session.run(cypher_other)
-                    # print(f"Got cypher results {cypher_other}")
-
-                    for record in result:
-                        rec = {}
-                        relationship = record["relationship"]
-                        neighbour = record["neighbor"]
-                        if relationship:
-                            if relationship.type == "belongs_to":
-                                pass
-                            else:
-                                rel_type = relationship._properties["type"]
-                                rel_evd = relationship._properties["evidence"]
-                                rel_des = relationship._properties["description"]
-                                rec["Relationship"] = {
-                                    "Type": rel_type,
-                                    "Evidence": rel_evd,
-                                    "Description": rel_des,
-                                }
-
-                        if neighbour:
-                            if relationship.type == "belongs_to":
-                                if "Paper" not in output.keys():
-                                    paper_theme = neighbour._properties["main_theme"]
-                                    paper_key_contr = neighbour._properties[
-                                        "key_contributions"
-                                    ]
-                                    paper_prim_meth = neighbour._properties[
-                                        "primary_methods"
-                                    ]
-                                    paper_id = neighbour._properties["id"]
-                                    output["Paper"] = {
-                                        "main_theme": paper_theme,
-                                        "Key_contributions": paper_key_contr,
-                                        "paper_prim_meth": paper_prim_meth,
-                                        "paper_id": paper_id,
-                                    }
-                                pass
-                            else:
-                                nei_evd = neighbour._properties["evidence"]
-                                nei_cont = neighbour._properties["content"]
-                                rec["Neighbour"] = {
-                                    "Evidence": nei_evd,
-                                    "Content": nei_cont,
-                                }
-                        output["Record"].append(rec)
-                    final_output.append(output)
+                    node_records = list(
+                        session.run(
+                            Query(
+                                CYPHER_NODE,
+                                timeout=cypher_timeout(deadline.remaining()),
+                            ),
+                            node_id=node,
+                        )
+                    )
+                    if deadline.expired():
+                        logger.warning(
+                            f"Out of time, skipped {len(nodes) - len(final_output)} nodes"
+                        )
+                        break
+                    neighbor_records = list(
+                        session.run(
+                            Query(
+                                CYPHER_NEIGHBORS,
+                                timeout=cypher_timeout(deadline.remaining()),
+                            ),
+                            node_id=node,
+                        )
+                    )
+                    final_output.append(
+                        format_neighbors(node_records, neighbor_records)
+                    )
 
             logger.info(f"Successfully extracted {len(final_output)} neighbors")
             return final_output
         except Exception as e:
             logger.error(f"Failed to retrieve nodes {e}")
             return []
+
+    def retrieve_neighbors_batch(
+        self, nodes: List[str], timeout: Optional[float] = None
+    ) -> Dict[str, dict]:
+        """
+        Given nodes return all of their neighbors with their relationships in two round trips,
+        whatever the number of nodes
+        Args:
+            nodes(List[str]): Pid_EXT_id of the nodes to extract the neighbors an relationships of
+            timeout(Optional[float]): seconds each of the two transactions may take
+
+        Returns:
+            output(Dict[str, dict]): Node, Paper and the Record of relationships and neighbors per node id
+        """
+        try:
+            node_ids = list(dict.fromkeys(n for n in nodes if n))
+            if not node_ids:
+                return {}
+            if timeout is not None and timeout <= 0:
+                logger.warning(f"Out of time, skipped {len(node_ids)} nodes")
+                return {}
+            logger.info(f"Retrieving Neighbors of {len(node_ids)} nodes")
+            with self.driver.session() as session:
+                node_records = list(
+                    session.run(
+                        Query(CYPHER_NODES_BATCH, timeout=cypher_timeout(timeout)),
+                        node_ids=node_ids,
+                    )
+                )
+                neighbor_records = list(
+                    session.run(
+                        Query(CYPHER_NEIGHBORS_BATCH, timeout=cypher_timeout(timeout)),
+                        node_ids=node_ids,
+                    )
+                )
+            return group_neighbors(node_ids, node_records, neighbor_records)
+        except Exception as e:
+            logger.error(f"Failed to retrieve nodes {e}")
+            return {}
+
+
+CYPHER_NODE = "MATCH (node) WHERE node.id = $node_id RETURN node"
+CYPHER_NEIGHBORS = "MATCH (node)-[relationship]-(neighbor) WHERE node.id = $node_id RETURN relationship, neighbor"
+CYPHER_NODES_BATCH = "UNWIND $node_ids AS node_id MATCH (node) WHERE node.id = node_id RETURN node_id, node"
+CYPHER_NEIGHBORS_BATCH = "UNWIND $node_ids AS node_id MATCH (node)-[relationship]-(neighbor) WHERE node.id = node_id RETURN node_id, relationship, neighbor"
+
+
+def cypher_timeout(remaining: Optional[float]) -> Optional[float]:
+    """
+    Transaction timeout for the seconds left. The driver reads a timeout of 0 as "run without
+    timeout", so the callers skip the call when nothing is left and a near zero budget is raised
+    to CYPHER_MIN_TIMEOUT_SECONDS.
+
+    Args:
+        remaining(Optional[float]): seconds left, None without deadline
+
+    Returns:
+        timeout(Optional[float]): timeout of the transaction, None for the driver default
+    """
+    if remaining is None:
+        return None
+    return max(remaining, config.CYPHER_MIN_TIMEOUT_SECONDS)
+
+
+def group_neighbors(
+    node_ids: List[str], node_records: List, neighbor_records: List
+) -> Dict[str, dict]:
+    """
+    Format the records of CYPHER_NODES_BATCH and CYPHER_NEIGHBORS_BATCH per node
+    Args:
+        node_ids(List[str]): ids of the nodes that were fetched
+        node_records(List): records returned by CYPHER_NODES_BATCH
+        neighbor_records(List): records returned by CYPHER_NEIGHBORS_BATCH
+
+    Returns:
+        output(Dict[str, dict]): output of format_neighbors for every node id
+    """
+    nodes = {node_id: [] for node_id in node_ids}
+    neighbors = {node_id: [] for node_id in node_ids}
+    for record in node_records:
+        nodes.setdefault(record["node_id"], []).append(record)
+    for record in neighbor_records:
+        neighbors.setdefault(record["node_id"], []).append(record)
+    return {
+        node_id: format_neighbors(nodes[node_id], neighbors.get(node_id, []))
+        for node_id in nodes
+    }
+
+
+def format_neighbors(node_records: List, neighbor_records: List) -> dict:
+    """
+    Format the records of a node and its neighbors into the context sent to the LLM
+    Args:
+        node_records(List): records returned by CYPHER_NODE
+        neighbor_records(List): records returned by CYPHER_NEIGHBORS
+
+    Returns:
+        output(dict): Node, Paper and the Record of relationships and neighbors
+    """
+    output = {"Record": []}
+    for record in node_records:
+        content = record["node"]._properties["content"]
+        evidence = record["node"]._properties["evidence"]
+        output["Node"] = {"content": content, "evidence": evidence}
+
+    for record in neighbor_records:
+        rec = {}
+        relationship = record["relationship"]
+        neighbour = record["neighbor"]
+        if relationship:
+            if relationship.type == "belongs_to":
+                pass
+            else:
+                rel_type = relationship._properties["type"]
+                rel_evd = relationship._properties["evidence"]
+                rel_des = relationship._properties["description"]
+                rec["Relationship"] = {
+                    "Type": rel_type,
+                    "Evidence": rel_evd,
+                    "Description": rel_des,
+                }
+
+        if neighbour:
+            if relationship.type == "belongs_to":
+                if "Paper" not in output.keys():
+                    paper_theme = neighbour._properties["main_theme"]
+                    paper_key_contr = neighbour._properties["key_contributions"]
+                    paper_prim_meth = neighbour._properties["primary_methods"]
+                    paper_id = neighbour._properties["id"]
+                    output["Paper"] = {
+                        "main_theme": paper_theme,
+                        "Key_contributions": paper_key_contr,
+                        "paper_prim_meth": paper_prim_meth,
+                        "paper_id": paper_id,
+                    }
+                pass
+            else:
+                nei_evd = neighbour._properties["evidence"]
+                nei_cont = neighbour._properties["content"]
+                rec["Neighbour"] = {
+                    "Evidence": nei_evd,
+                    "Content": nei_cont,
+                }
+        output["Record"].append(rec)
+    return output
@@ -1,5 +1,5 @@
 import axios from "axios";
-import { queryUrl } from "../url";
+import { queryUrl, streamUrl } from "../url";
 
 export const fetchAnswer = async (query: string) => {
 	try {
@@ -12,3 +12,57 @@ export const fetchAnswer = async (query: string) => {
 		return { code: 500, message: "Sorry, internal server error" };
 	}
 };
+
+export type StreamEvent =
+	| { type: "sources"; sources: unknown; cached?: boolean }
+	| { type: "token"; content: string }
+	| { type: "error"; message: string };
+
+export const fetchStreamingAnswer = async (
+	query: string,
+	onEvent: (event: StreamEvent) => void,
+) => {
+	try {
+		const res = await fetch(streamUrl, {
+			method: "POST",
+			headers: { "Content-Type": "application/json" },
+			body: JSON.stringify({ query: query }),
+		});
+		if (res.status == 429 || res.status == 503) {
+			return { code: res.status, message: "The server is busy, please try again in a moment" };
+		}
+		if (!res.ok || !res.body) {
+			return { code: res.status, message: "Sorry, internal server error" };
+		}
+
+		const reader = res.body.getReader();
+		const decoder = new TextDecoder();
+		let buffer = "";
+		while (true) {
+			const { value, done } = await reader.read();
+			if (done) break;
+
+			// events can be split across network chunks so only complete events are parsed
+			buffer += decoder.decode(value, { stream: true });
+			const events = buffer.split("\n\n");
+			buffer = events.pop() ?? "";
+
+			for (const event of events) {
+				if (!event.startsWith("data: ")) continue;
+				const data = event.slice(6);
+				if (data === "[DONE]") {
+					return { code: 200, message: "" };
+				}
+				try {
+					onEvent(JSON.parse(data));
+				} catch (e) {
+					console.error("Error parsing JSON:", e);
+				}
+			}
+		}
+		return { code: 200, message: "" };
+	} catch (error: unknown) {
+		console.log(error);
+		return { code: 500, message: "Sorry, internal server error" };
+	}
+};
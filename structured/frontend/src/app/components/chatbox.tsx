@@ -1,12 +1,22 @@
 'use client'
 import { useState, useEffect, useRef } from "react";
-import { fetchAnswer } from "../api/api";
+import { fetchStreamingAnswer, StreamEvent } from "../api/api";
 import { toast } from "react-toastify";
 import ReactMarkdown from "react-markdown";
 
 type Message = {
     role: 'user' | 'assistant';
     content: string;
+    sources?: unknown;
+}
+
+
+const countSources = (sources: unknown): number => {
+    if (Array.isArray(sources)) return sources.filter(Boolean).length;
+    if (sources && typeof sources === 'object') {
+        return Object.values(sources).reduce((total: number, s) => total + countSources(s), 0);
+    }
+    return 0;
 }
 
 
@@ -31,60 +41,29 @@ export default function Chatbox() {
         setIsStreaming(true);
 
         const userQuery = e.target.message.value
-        const res = await fetchAnswer(userQuery)
-        if (res?.code == 200) {
-            const answer = res.message.answer
-            setMessages(prev => {
-                const allMessages = [...prev];
-                allMessages[allMessages.length - 1].content = answer;
-                return allMessages;
-            })
-        } else {
+        let assistantMessage = '';
+        const res = await fetchStreamingAnswer(userQuery, (event: StreamEvent) => {
+            if (event.type === 'sources') {
+                setMessages(prev => {
+                    const allMessages = [...prev];
+                    allMessages[allMessages.length - 1].sources = event.sources;
+                    return allMessages;
+                })
+            } else if (event.type === 'token') {
+                assistantMessage += event.content;
+                setMessages(prev => {
+                    const allMessages = [...prev];
+                    allMessages[allMessages.length - 1].content = assistantMessage;
+                    return allMessages;
+                })
+            } else if (event.type === 'error') {
+                toast(event.message)
+            }
+        })
+        if (res?.code != 200) {
             toast(res?.message)
         }
         setIsStreaming(false);
-
-        //
-        // const response = await fetchStreamingApi("query", {
-        //     method: "POST",
-        //     body: JSON.stringify({"query": e.target.message.value, "file_path": file_path}),
-        // });
-
-        // const reader = response.body.getReader();
-        // const decoder = new TextDecoder();
-        // let assistantMessage = '';
-        //
-        // while (true) {
-        //     const { value, done } = await reader.read();
-        //     if (done) break;
-        //     
-        //     const chunk = decoder.decode(value);
-        //     const lines = chunk.split('\n');
-        //
-        //     for (const line of lines) {
-        //         if (line.startsWith('data: ')) {
-        //             const data = line.slice(6);
-        //             if (data === '[DONE]') {
-        //                 setIsStreaming(false);
-        //                 break;
-        //             }
-        //             
-        //             try {
-        //                 const parsed = JSON.parse(data);
-        //                 assistantMessage += parsed.content;
-        //                 
-        //                 setMessages(prev => {
-        //                     const newMessages = [...prev];
-        //                     newMessages[newMessages.length - 1].content = assistantMessage;
-        //                     return newMessages;
-        //                 });
-        //             } catch (e) {
-        //                 console.error('Error parsing JSON:', e);
-        //             }
-        //         }
-        //     }
-        // }
-
     }
 
 
@@ -96,6 +75,11 @@ export default function Chatbox() {
                         <ReactMarkdown>
                             {message.content}
                         </ReactMarkdown>
+                        {message.role === 'assistant' && countSources(message.sources) > 0 && (
+                            <div className="mt-1 text-xs opacity-75">
+                                Answered from {countSources(message.sources)} sources
+                            </div>
+                        )}
                         {isStreaming && index === messages.length - 1 && (
                             <span className="inline-block w-1 h-4 ml-1 bg-white animate-pulse" />
                         )}
@@ -1,2 +1,3 @@
 export const serverUrl = "http://localhost:8000";
 export const queryUrl = `${serverUrl}/query`;
+export const streamUrl = `${serverUrl}/query/stream`;
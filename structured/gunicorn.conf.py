@@ -0,0 +1,50 @@
+"""
+Gunicorn configuration of the server: uvicorn workers forked from a master that already loaded the
+embedding model, so that the workers share its weights copy-on-write instead of each loading its own
+
+Usage: gunicorn server:app -c gunicorn.conf.py
+"""
+
+import gc
+import os
+
+# the tokenizers thread pool must not be started before the fork
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+bind = os.getenv("SERVING_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("SERVING_WORKERS", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# import server.py in the master, the lifespan still runs in every worker
+preload_app = True
+# the workers only report ready once warm, give them the time to load
+timeout = int(os.getenv("SERVING_WORKER_TIMEOUT", "120"))
+
+
+def on_starting(server):
+    """
+    Load the embedding model in the master, without encoding anything so that no torch thread pool
+    exists at fork time
+    """
+    from database import get_embedding_model
+
+    get_embedding_model()
+    server.log.info("Embedding model preloaded")
+
+
+def pre_fork(server, worker):
+    """
+    Move the objects of the master out of the garbage collector's reach, so that collections in the
+    workers do not write to and copy the shared pages
+    """
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Limit the torch threads of each worker so that the workers do not oversubscribe the cores
+    """
+    threads = os.getenv("SERVING_TORCH_THREADS")
+    if threads:
+        import torch
+
+        torch.set_num_threads(int(threads))
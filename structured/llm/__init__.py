@@ -3,3 +3,5 @@ entry point for LLM package
 """
 
 from .llm import LLM
+from .async_llm import AsyncLLM
+from .ontology_runner import OntologyRunner
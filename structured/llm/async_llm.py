@@ -0,0 +1,218 @@
+"""
+Async LLM module built on AsyncOpenAI, used by the server so that a slow completion does not block the event loop
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, AsyncIterator, List, Optional
+from openai import APIStatusError, AsyncOpenAI
+
+from utils import Deadline, record_error, record_llm_call
+from .base import BaseLLM
+from .rate_limit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncLLM(BaseLLM):
+    """
+    Query methods of LLM awaiting the calls to OpenAI. The prompts, parsing, caches and retry
+    policy come from BaseLLM, the ontology extraction stays on the sync LLM.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(client=AsyncOpenAI(**self.client_options()))
+
+    async def warm_up(self, connections: int = 1) -> None:
+        """
+        Open connections of the HTTP pool ahead of the first query. Any HTTP answer, even an
+        error status from a proxy without a models endpoint, means the connection is open.
+        Args:
+            connections(int): connections to open concurrently
+        """
+
+        async def ping() -> None:
+            try:
+                await self.client.models.list()
+            except APIStatusError as e:
+                logger.info(f"OpenAI answered the warm up with {e.status_code}")
+
+        await asyncio.gather(*(ping() for _ in range(connections)))
+
+    async def simple_query(self, query: str) -> str:
+        """
+        Async LLM.simple_query
+        """
+        try:
+            return await self._chat(
+                messages=[{"role": "user", "content": query}], method="simple_query"
+            )
+        except Exception as e:
+            logger.error(f"Failed to generate simple query: {e}")
+            return ""
+
+    async def revise_query(self, query: str, timeout: Optional[float] = None) -> str:
+        """
+        Async LLM.revise_query
+        """
+        try:
+            logger.info("LLM generating revised query")
+            return await self._chat(
+                messages=self._revise_query_messages(query=query),
+                method="revise_query",
+                timeout=timeout,
+            )
+        except Exception as e:
+            logger.error(f"Failed to generate revised query: {e}")
+            return ""
+
+    async def query_with_context(
+        self, context: Any, query: str, timeout: Optional[float] = None
+    ) -> str:
+        """
+        Async LLM.query_with_context
+        """
+        try:
+            logger.info("LLM generating answer with the provided context")
+            return await self._chat(
+                messages=self._query_with_context_messages(
+                    context=context, query=query
+                ),
+                method="query_with_context",
+                timeout=timeout,
+            )
+        except Exception as e:
+            logger.error(f"Failed to generated answer with the provided context: {e}")
+            return ""
+
+    async def stream_query_with_context(
+        self, context: Any, query: str, timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """
+        Async LLM.stream_query_with_context
+        """
+        try:
+            logger.info("LLM streaming answer with the provided context")
+            async for token in self._chat_stream(
+                messages=self._query_with_context_messages(
+                    context=context, query=query
+                ),
+                method="query_with_context",
+                timeout=timeout,
+            ):
+                yield token
+        except Exception as e:
+            logger.error(f"Failed to stream answer with the provided context: {e}")
+
+    async def extract_relevant_ids(
+        self, context: List[str], query: str, timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Async LLM.extract_relevant_ids
+        """
+        try:
+            logger.info("LLM extracting relevant ids from provided context")
+            answer = await self._chat(
+                messages=self._extract_relevant_ids_messages(
+                    context=context, query=query
+                ),
+                method="extract_relevant_ids",
+                timeout=timeout,
+            )
+            return self._parse_relevant_ids(answer)
+        except Exception as e:
+            logger.error(f"Failed to extract relevant ids from provided context: {e}")
+            return [""]
+
+    async def _create(self, method: str, timeout: Optional[float], **request):
+        """
+        Async LLM._create, waits for the rate limit and the backoff without blocking the loop
+        """
+        deadline = Deadline(timeout)
+        tokens = self._reserved_tokens(request)
+        for attempt in itertools.count():
+            await rate_limiter.acquire_async(tokens, deadline.remaining())
+            try:
+                return await self._client(deadline.remaining()).chat.completions.create(
+                    **request
+                )
+            except Exception as e:
+                delay = self._retry_delay(method, e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _chat(
+        self,
+        messages: List[dict],
+        method: str,
+        model: str = "",
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> str:
+        """
+        Async LLM._chat, the cache is read and written off the event loop
+        """
+        cache, key = self._response_cache(method, model, messages, kwargs)
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        try:
+            response = await self._create(
+                method, timeout, model=model or self.model, messages=messages, **kwargs
+            )
+        except Exception:
+            record_error(method)
+            raise
+        answer = self._answer(method, start, response)
+        if cache is not None and answer:
+            await asyncio.to_thread(cache.set, key, answer)
+        return answer
+
+    async def _chat_stream(
+        self,
+        messages: List[dict],
+        method: str,
+        model: str = "",
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        """
+        Async LLM._chat_stream, the cache is read and written off the event loop
+        """
+        cache, key = self._response_cache(method, model, messages, kwargs)
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                yield cached
+                return
+        start = time.perf_counter()
+        usage = None
+        tokens = []
+        try:
+            stream = await self._create(
+                method,
+                timeout,
+                model=model or self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                token = self._delta(chunk)
+                if token:
+                    tokens.append(token)
+                    yield token
+        except Exception:
+            record_error(method)
+            raise
+        record_llm_call(method=method, seconds=time.perf_counter() - start, usage=usage)
+        if cache is not None and tokens:
+            await asyncio.to_thread(cache.set, key, "".join(tokens))
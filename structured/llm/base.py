@@ -0,0 +1,250 @@
+"""
+Base of the LLM classes with everything that does not depend on how OpenAI is called: the client
+settings, the prompts, the response parsing, the cache keys and the retry policy
+"""
+
+import json
+import os
+import re
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import Deadline, record_llm_call, record_llm_retry
+from cache import SQLiteCache
+from cache import config as cache_config
+from .prompt_registry import prompts
+from .rate_limit import estimate_tokens, rate_limiter, retry_delay
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def response_caches() -> Dict[str, SQLiteCache]:
+    """
+    Persistent caches of the responses of the methods opted in with LLM_CACHE_METHODS
+
+    Returns:
+        caches(Dict[str, SQLiteCache]): cache per method name, empty when the persistent cache is disabled
+    """
+    if not cache_config.PERSISTENT_CACHE_ENABLED:
+        return {}
+    return {
+        method: SQLiteCache(
+            namespace=f"llm:{method}",
+            ttl_seconds=ttl,
+            max_entries=config.LLM_CACHE_MAX_ENTRIES,
+        )
+        for method, ttl in config.LLM_CACHE_METHODS.items()
+    }
+
+
+def response_key(model: str, messages: List[dict], params: dict) -> str:
+    """
+    Content address of a chat completion request
+
+    Args:
+        model(str): model of the request
+        messages(List[dict]): messages of the request
+        params(dict): other parameters of the request
+
+    Returns:
+        key(str): hash of the model, the messages and the parameters
+    """
+    return SQLiteCache.make_key(
+        model,
+        json.dumps(messages, sort_keys=True, default=str),
+        json.dumps(params, sort_keys=True, default=str),
+    )
+
+
+def user_message(query: str, context: Any) -> str:
+    """
+    User message of the calls answering from a context
+
+    Args:
+        query(str): question asked by the user
+        context(Any): retrieved context, placed last
+
+    Returns:
+        message(str): question followed by the context
+    """
+    return f"Question: {query}\n\nDocument_context:\n{context}"
+
+
+class BaseLLM:
+    """
+    Shared part of LLM and AsyncLLM, the subclasses only make the calls to OpenAI sync or async
+    """
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+        self.model = config.MODEL_NAME
+        self.cwd = os.path.dirname(__file__)
+        self.response_caches = response_caches()
+
+    @staticmethod
+    def client_options() -> dict:
+        """
+        Settings of the OpenAI client, retries are made by _create within the rate limit
+        """
+        return {
+            "api_key": config.OPENAI_API_KEY,
+            "base_url": config.OPENAI_BASE_URL,
+            "timeout": config.OPENAI_TIMEOUT_SECONDS,
+            "max_retries": 0,
+        }
+
+    @staticmethod
+    def _answer(method: str, start: float, response: Any) -> str:
+        """
+        Record the latency and token usage of the completion and return its content
+
+        Args:
+            method(str): name of the LLM method making the call, used as the metrics label
+            start(float): perf_counter when the call started
+            response(Any): chat completion
+
+        Returns:
+            answer(str): content of the first choice
+        """
+        record_llm_call(
+            method=method, seconds=time.perf_counter() - start, usage=response.usage
+        )
+        return response.choices[0].message.content or ""
+
+    @staticmethod
+    def _delta(chunk: Any) -> str:
+        """
+        Content delta of the first choice of a streamed chunk, empty for the usage chunk
+        """
+        if chunk.choices and chunk.choices[0].delta.content:
+            return chunk.choices[0].delta.content
+        return ""
+
+    def _response_cache(
+        self, method: str, model: str, messages: List[dict], params: dict
+    ) -> Tuple[Optional[SQLiteCache], str]:
+        """
+        Persistent cache of the method and the key of the request in it. The timeout is not part
+        of the key since it does not change the response.
+
+        Args:
+            method(str): name of the LLM method making the call
+            model(str): model of the request, empty for the configured model
+            messages(List[dict]): messages of the request
+            params(dict): extra parameters of the request
+
+        Returns:
+            cache(Optional[SQLiteCache]): None when the method is not opted in, key(str)
+        """
+        cache = self.response_caches.get(method)
+        if cache is None:
+            return None, ""
+        return cache, response_key(model or self.model, messages, params)
+
+    def _reserved_tokens(self, request: dict) -> int:
+        """
+        Tokens of the request to reserve from the TPM budget, not counted when there is no TPM limit
+        """
+        if not rate_limiter.tokens.per_minute:
+            return 0
+        return estimate_tokens(
+            request["messages"], request["model"], request.get("max_tokens")
+        )
+
+    def _retry_delay(
+        self, method: str, error: Exception, attempt: int, deadline: Deadline
+    ) -> Optional[float]:
+        """
+        Seconds to wait before retrying the failed attempt, None to give up and raise the error
+
+        Args:
+            method(str): name of the LLM method making the call
+            error(Exception): error raised by the attempt
+            attempt(int): number of the failed attempt, starting at 0
+            deadline(Deadline): deadline of all the attempts
+
+        Returns:
+            delay(Optional[float]): None when the error is not retried, the retries are exhausted or
+            the wait would overrun the deadline
+        """
+        delay = retry_delay(error, attempt)
+        remaining = deadline.remaining()
+        if (
+            delay is None
+            or attempt >= config.OPENAI_MAX_RETRIES
+            or (remaining is not None and delay >= remaining)
+        ):
+            return None
+        status = getattr(error, "status_code", None)
+        if status == 429:
+            rate_limiter.pause(delay)
+        record_llm_retry(method, str(status or "connection"))
+        logger.warning(
+            f"OpenAI call of {method} failed ({error}), retry {attempt + 1} in {delay:.2f}s"
+        )
+        return delay
+
+    def _client(self, timeout: Optional[float]):
+        """
+        Client to make an attempt with, bounded to timeout seconds when it is given so that the
+        attempt cannot overrun the deadline of the query
+        """
+        if timeout is None:
+            return self.client
+        return self.client.with_options(timeout=timeout)
+
+    def _read_prompt(self, prompt_name: str) -> str:
+        """
+        Read the prompt from the prompts folder through the prompt registry
+
+        Args:
+            prompt_name(str): file name of the prompt inside (/prompts/)
+
+        Returns:
+            prompt(str): content of the prompt file
+        """
+        return prompts.get(os.path.join(self.cwd, "prompts", prompt_name))
+
+    def prompt_hash(self, prompt_name: str) -> str:
+        """
+        Hash of the prompt, changes whenever the prompt file is edited
+
+        Args:
+            prompt_name(str): file name of the prompt inside (/prompts/)
+
+        Returns:
+            hash(str): sha256 of the prompt content
+        """
+        return prompts.hash(os.path.join(self.cwd, "prompts", prompt_name))
+
+    def _revise_query_messages(self, query: str) -> List[dict]:
+        system_prompt = self._read_prompt("revise_query.txt")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": query},
+        ]
+
+    # The system prompts are static so that they form a prefix OpenAI can cache across calls,
+    # everything that changes per call goes in the user message with the context last
+    def _query_with_context_messages(self, context: Any, query: str) -> List[dict]:
+        system_prompt = self._read_prompt("general_context.txt")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message(query=query, context=context)},
+        ]
+
+    def _extract_relevant_ids_messages(
+        self, context: List[str], query: str
+    ) -> List[dict]:
+        system_prompt = self._read_prompt("extract_relevant_ids.txt")
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message(query=query, context=context)},
+        ]
+
+    @staticmethod
+    def _parse_relevant_ids(answer: str) -> List[str]:
+        formatted = re.findall(r"\bP\d{3}_EXT_\d+\b", answer)
+        return formatted or [""]
@@ -9,3 +9,50 @@ load_dotenv()
 
 MODEL_NAME = "gpt-4o-mini"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Point the client at an OpenAI compatible server, e.g. the benchmark stub, None for api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Seconds an OpenAI call may take when the caller does not give its own timeout
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+
+# Client side budgets shared by every LLM instance of the process, 0 for unlimited
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "0"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "0"))
+# Completion tokens reserved from the TPM budget when the request does not set max_tokens
+OPENAI_COMPLETION_TOKENS_ESTIMATE = int(
+    os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", "512")
+)
+# Retries of the calls answered with 429, 5xx or failing to connect
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+# Exponential backoff between the retries, with full jitter, unless Retry-After asks for longer
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "1"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "60"))
+
+# Methods whose responses are kept in the persistent cache shared by all the processes, as a comma
+# separated list of method or method:ttl_seconds, e.g. "llm_ontology,extract_relevant_ids:86400"
+LLM_CACHE_METHODS = {
+    entry.split(":")[0].strip(): (float(entry.split(":")[1]) if ":" in entry else None)
+    for entry in os.getenv("LLM_CACHE_METHODS", "llm_ontology").split(",")
+    if entry.strip()
+}
+# Responses kept per method, the least recently used are evicted first
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+# Papers extracted concurrently by the ontology runner, all of them within the rate limit of the process
+ONTOLOGY_WORKERS = int(os.getenv("ONTOLOGY_WORKERS", "4"))
+# Manifest of the papers already extracted, kept inside the output folder
+ONTOLOGY_MANIFEST_NAME = ".ontology_manifest.json"
+
+# Extract the folder ontologies through the OpenAI Batch API, at half the price and outside the rate limit
+ONTOLOGY_BATCH = os.getenv("ONTOLOGY_BATCH", "false").lower() == "true"
+# Window the Batch API has to complete a batch, and seconds between two status checks
+BATCH_COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h")
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "30"))
+# Request file and state of the batch being processed, kept inside the output folder until its results are saved
+ONTOLOGY_BATCH_REQUESTS_NAME = ".ontology_batch_requests.jsonl"
+ONTOLOGY_BATCH_STATE_NAME = ".ontology_batch.json"
+
+# Papers longer than this many tokens are split along their sections into segments extracted
+# concurrently and merged, 0 to always send the whole paper
+ONTOLOGY_SEGMENT_TOKENS = int(os.getenv("ONTOLOGY_SEGMENT_TOKENS", "0"))
+# Segments of one paper extracted concurrently
+ONTOLOGY_SEGMENT_WORKERS = int(os.getenv("ONTOLOGY_SEGMENT_WORKERS", "4"))
@@ -2,29 +2,40 @@
 LLM module that contains all the functions to be called for the llm being used
 """
 
+import itertools
+import json
 import os
-import re
 import logging
 import time
-from typing import Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from openai import OpenAI
 
-from utils import convert_txt_to_json, tokencount_from_text
+from utils import (
+    convert_txt_to_json,
+    tokencount_from_text,
+    Deadline,
+    atomic_write,
+    record_error,
+    record_llm_call,
+)
+from .base import BaseLLM
+from .ontology_segments import merge_responses, split_sections
+from .prompt_registry import prompts
+from .rate_limit import rate_limiter
 from . import config
 
 logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
-class LLM:
+class LLM(BaseLLM):
     """
     LLM class to use all the functions from
     """
 
     def __init__(self) -> None:
-        self.client = OpenAI(api_key=config.OPENAI_API_KEY)
-        self.model = config.MODEL_NAME
-        self.cwd = os.path.dirname(__file__)
+        super().__init__(client=OpenAI(**self.client_options()))
 
     def simple_query(self, query: str) -> str:
         """
@@ -37,20 +48,19 @@ class LLM:
             answer(str): response from the llm
         """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model, messages=[{"role": "user", "content": query}]
+            return self._chat(
+                messages=[{"role": "user", "content": query}], method="simple_query"
             )
-            answer = response.choices[0].message.content
-            return answer or ""
         except Exception as e:
             logger.error(f"Failed to generate simple query: {e}")
             return ""
 
-    def revise_query(self, query: str) -> str:
+    def revise_query(self, query: str, timeout: Optional[float] = None) -> str:
         """
         Revise the user query to be later provided to the llm
         Args:
             query(str): question asked by the user
+            timeout(Optional[float]): seconds the call may take, without retry, None for the client default
 
         Returns:
             revised(str): revised question that was asked by the user
@@ -58,91 +68,212 @@ class LLM:
         try:
             logger.info("LLM generating revised query")
             print("LLM generating revised query")
-
-            prompt_path = os.path.join(self.cwd, "prompts", "revise_query.txt")
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                system_prompt = f.read()
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query},
-                ],
+            return self._chat(
+                messages=self._revise_query_messages(query=query),
+                method="revise_query",
+                timeout=timeout,
             )
-            answer = response.choices[0].message.content or ""
-            # print(answer)
-            return answer
         except Exception as e:
             logger.error(f"Failed to generate revised query: {e}")
             return ""
 
-    def query_with_context(self, context: Any, query: str) -> str:
+    def query_with_context(
+        self, context: Any, query: str, timeout: Optional[float] = None
+    ) -> str:
         """
         Generates a response using the LLM for the given query with the provided context.
         Args:
             context(Any): similar chunks to the query
             query(str): The question being asked by the user
+            timeout(Optional[float]): seconds the call may take, without retry, None for the client default
 
         Returns:
             answer(str): Answer provided by the LLM for the given query with the provided context
         """
         try:
             logger.info("LLM generating answer with the provided context")
-
-            prompt_path = os.path.join(self.cwd, "prompts", "general_context.txt")
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                system_prompt = f.read()
-
-            system_prompt = system_prompt.format(context=context)
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query},
-                ],
+            return self._chat(
+                messages=self._query_with_context_messages(
+                    context=context, query=query
+                ),
+                method="query_with_context",
+                timeout=timeout,
             )
-            answer = response.choices[0].message.content or ""
-
-            return answer
-
         except Exception as e:
             logger.error(f"Failed to generated answer with the provided context: {e}")
             return ""
 
-    def extract_relevant_ids(self, context: List[str], query: str) -> List[str]:
+    def stream_query_with_context(
+        self, context: Any, query: str, timeout: Optional[float] = None
+    ) -> Iterator[str]:
+        """
+        Streams the response of the LLM for the given query with the provided context token by token.
+        Args:
+            context(Any): similar chunks to the query
+            query(str): The question being asked by the user
+            timeout(Optional[float]): seconds the call may take, without retry, None for the client default
+
+        Returns:
+            tokens(Iterator[str]): pieces of the answer as they are generated
+        """
+        try:
+            logger.info("LLM streaming answer with the provided context")
+            yield from self._chat_stream(
+                messages=self._query_with_context_messages(
+                    context=context, query=query
+                ),
+                method="query_with_context",
+                timeout=timeout,
+            )
+        except Exception as e:
+            logger.error(f"Failed to stream answer with the provided context: {e}")
+
+    def extract_relevant_ids(
+        self, context: List[str], query: str, timeout: Optional[float] = None
+    ) -> List[str]:
         """
         From the given context and query filter only the context that will be highly relevant to the given query.
 
         Args:
             context(list[str]): similar chunks to the query
             query(str): The question being asked by the user
+            timeout(Optional[float]): seconds the call may take, without retry, None for the client default
 
         Returns: list[str]: List of strings containing list of extraction_ids that are relevant to the given query
         """
         try:
             logger.info("LLM extracting relevant ids from provided context")
+            answer = self._chat(
+                messages=self._extract_relevant_ids_messages(
+                    context=context, query=query
+                ),
+                method="extract_relevant_ids",
+                timeout=timeout,
+            )
+            return self._parse_relevant_ids(answer)
+        except Exception as e:
+            logger.error(f"Failed to extract relevant ids from provided context: {e}")
+            return [""]
 
-            prompt_path = os.path.join(self.cwd, "prompts", "extract_relevant_ids.txt")
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                system_prompt = f.read()
+    def _chat(
+        self,
+        messages: List[dict],
+        method: str,
+        model: str = "",
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> str:
+        """
+        Send the messages to the chat completions endpoint and record its latency and token usage
 
-            system_prompt = system_prompt.format(context=context)
+        Args:
+            messages(List[dict]): messages to send to the LLM
+            method(str): name of the LLM method making the call, used as the metrics label
+            model(str): model to use, defaults to the configured model
+            timeout(Optional[float]): seconds the call may take, without retry, None for the client default
+            kwargs: extra parameters for the chat completions endpoint
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": query},
-                ],
+        Returns:
+            answer(str): content of the first choice
+        """
+        cache, key = self._response_cache(method, model, messages, kwargs)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        start = time.perf_counter()
+        try:
+            response = self._create(
+                method, timeout, model=model or self.model, messages=messages, **kwargs
             )
-            answer = response.choices[0].message.content or ""
+        except Exception:
+            record_error(method)
+            raise
+        answer = self._answer(method, start, response)
+        if cache is not None and answer:
+            cache.set(key, answer)
+        return answer
+
+    def _chat_stream(
+        self,
+        messages: List[dict],
+        method: str,
+        model: str = "",
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Iterator[str]:
+        """
+        Stream the completion of the messages and record its latency and token usage once it is done
 
-            formatted = re.findall(r"\bP\d{3}_EXT_\d+\b", answer)
-            return formatted or [""]
-        except Exception as e:
-            logger.error(f"Failed to extract relevant ids from provided context: {e}")
-            return [""]
+        Args:
+            messages(List[dict]): messages to send to the LLM
+            method(str): name of the LLM method making the call, used as the metrics label
+            model(str): model to use, defaults to the configured model
+            timeout(Optional[float]): seconds the call may take, without retry, None for the client default
+            kwargs: extra parameters for the chat completions endpoint
+
+        Returns:
+            tokens(Iterator[str]): content deltas of the first choice
+        """
+        cache, key = self._response_cache(method, model, messages, kwargs)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        start = time.perf_counter()
+        usage = None
+        tokens = []
+        try:
+            stream = self._create(
+                method,
+                timeout,
+                model=model or self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                token = self._delta(chunk)
+                if token:
+                    tokens.append(token)
+                    yield token
+        except Exception:
+            record_error(method)
+            raise
+        record_llm_call(method=method, seconds=time.perf_counter() - start, usage=usage)
+        if cache is not None and tokens:
+            cache.set(key, "".join(tokens))
+
+    def _create(self, method: str, timeout: Optional[float], **request):
+        """
+        Create the chat completion within the rate limit of the process, retrying the 429, 5xx and
+        connection errors with backoff as long as the timeout allows
+
+        Args:
+            method(str): name of the LLM method making the call
+            timeout(Optional[float]): seconds all the attempts may take, None for no limit
+            request: parameters of the chat completions endpoint
+
+        Returns:
+            response: completion, or stream of chunks when request has stream=True
+        """
+        deadline = Deadline(timeout)
+        tokens = self._reserved_tokens(request)
+        for attempt in itertools.count():
+            rate_limiter.acquire(tokens, deadline.remaining())
+            try:
+                return self._client(deadline.remaining()).chat.completions.create(
+                    **request
+                )
+            except Exception as e:
+                delay = self._retry_delay(method, e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
 
     def generate_ontology(
         self,
@@ -152,6 +283,8 @@ class LLM:
         output_folder_json: str,
         folder_name: str = "",
         model: str = "gpt-4o",
+        workers: int = config.ONTOLOGY_WORKERS,
+        batch: bool = config.ONTOLOGY_BATCH,
     ):
         """
         Generate ontology for the given file using LLM
@@ -162,33 +295,34 @@ class LLM:
             output_folder(str): Folder to output the response of LLM, file will be named same as file_name.txt
             folder_name(str): Name of folder where the file is located
             mode(str): ChatGPT model to use
+            workers(int): papers of the folder extracted concurrently, finished papers are skipped on a re-run
+            batch(bool): extract the papers of the folder through the OpenAI Batch API instead
 
         Returns:
             None
         """
         system_prompt_folder = "../kg_prompts/prompts/"
         system_prompt_file_path = os.path.join(system_prompt_folder, system_prompt_file)
-        system_prompt = self.extract_content(file_path=system_prompt_file_path)
+        # the same system prompt leads every paper so it is served from the prompt cache
+        system_prompt = prompts.get(system_prompt_file_path)
         try:
             logger.info("Generating Ontology")
             if not file_name:
                 logger.info("No file provided so extracted from Folder")
-                for file in os.listdir(folder_name):
-                    content_file_path = os.path.join(folder_name, file)
-                    file_content = self.extract_content(file_path=content_file_path)
-                    response = self.llm_ontology(
-                        system_prompt=system_prompt,
-                        file_content=file_content,
-                        model=model,
-                    )
-                    self.write_to_output(
-                        content=response, file_name=file, output_folder=output_folder
-                    )
-                    convert_txt_to_json(
-                        file_name=file,
-                        content=response,
-                        output_folder=output_folder_json,
-                    )
+                from .ontology_runner import OntologyRunner
+
+                runner = OntologyRunner(
+                    llm=self,
+                    system_prompt_path=system_prompt_file_path,
+                    output_folder=output_folder,
+                    output_folder_json=output_folder_json,
+                    model=model,
+                    workers=workers,
+                )
+                if batch:
+                    runner.run_batch(folder_name)
+                else:
+                    runner.run(folder_name)
                 logger.info(f"Generated complete ontology for {folder_name}")
             else:
                 logger.info("File provided so extracting from the file")
@@ -201,7 +335,7 @@ class LLM:
                     f"Token count for the file {content_file_path.split('/')[-1]} is"
                 )
                 tokencount_from_text(text=file_content)
-                response = self.llm_ontology(
+                response = self.extract_ontology(
                     system_prompt=system_prompt, file_content=file_content
                 )
 
@@ -225,7 +359,7 @@ class LLM:
 
     def write_to_output(
         self, content: str, file_name: str, output_folder: str = "ontology_outputs/"
-    ) -> None:
+    ) -> bool:
         """
         Writes the provided content to the provided folder with the same name as the file name.txt
 
@@ -235,16 +369,17 @@ class LLM:
             output_folder(str): name of the folder to output the content
 
         Returns:
-            None
+            saved(bool): whether the file was written
         """
         output_file_name = (file_name.split(".")[0]) + ".txt"
         output_path = os.path.join(output_folder, output_file_name)
         try:
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(content)
+            atomic_write(output_path, content)
             logger.info(f"Success: Saved content to file {output_file_name}")
+            return True
         except Exception as e:
             logger.error(f"Error: Failed to save content of the file - {e}")
+            return False
 
     def extract_content(self, file_path: str) -> str:
         """
@@ -261,6 +396,63 @@ class LLM:
         logger.info(f"Success fully extracted form {file_path}")
         return content
 
+    def ontology_segments(
+        self, file_content: str, segment_tokens: int = config.ONTOLOGY_SEGMENT_TOKENS
+    ) -> List[str]:
+        """
+        Parts of the paper extracted separately
+
+        Args:
+            file_content(str): content of the paper
+            segment_tokens(int): token limit of a segment, 0 for the whole paper
+
+        Returns:
+            segments(List[str]): segments along the sections of the paper, the whole paper when it fits
+        """
+        if not segment_tokens:
+            return [file_content]
+        return split_sections(file_content, segment_tokens)
+
+    def extract_ontology(
+        self,
+        system_prompt: str,
+        file_content: str,
+        model: str = "gpt-4o",
+        segment_tokens: int = config.ONTOLOGY_SEGMENT_TOKENS,
+    ) -> str:
+        """
+        Extract the ontology of a paper. A paper longer than segment_tokens is split along its
+        sections, the segments are extracted concurrently and their ontologies merged, so the wall
+        time follows the longest segment instead of the whole paper.
+
+        Args:
+            system_prompt(str): System prompt to send to the LLM
+            file_content(str): Extracted file content to send to the LLM
+            model(str): LLM model
+            segment_tokens(int): token limit of a segment, 0 to send the whole paper
+
+        Returns:
+            content(str): Content extracted from the llm, empty when the paper or one of its segments failed
+        """
+        segments = self.ontology_segments(file_content, segment_tokens)
+        if len(segments) == 1:
+            return self.llm_ontology(
+                system_prompt=system_prompt, file_content=file_content, model=model
+            )
+        logger.info(f"Extracting the ontology from {len(segments)} segments")
+        with ThreadPoolExecutor(
+            max_workers=min(len(segments), config.ONTOLOGY_SEGMENT_WORKERS)
+        ) as executor:
+            responses = list(
+                executor.map(
+                    lambda segment: self.llm_ontology(
+                        system_prompt=system_prompt, file_content=segment, model=model
+                    ),
+                    segments,
+                )
+            )
+        return merge_responses(responses)
+
     def llm_ontology(
         self, system_prompt: str, file_content: str, model: str = "gpt-4o"
     ) -> str:
@@ -276,15 +468,15 @@ class LLM:
         try:
             logger.info("LLM Extracting the ontology")
             start = time.time()
-            response = self.client.chat.completions.create(
-                model=model,
+            answer = self._chat(
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": file_content},
                 ],
+                method="llm_ontology",
+                model=model,
                 timeout=400,
             )
-            answer = response.choices[0].message.content
             end = time.time()
             if answer:
                 logger.info(f"Time taken for the response {(end - start):.2f} seconds")
@@ -296,3 +488,73 @@ class LLM:
             logger.error(f"Error: Error extracting ontology from OpenAI - {e}")
 
         return ""
+
+    def submit_batch(self, requests_path: str) -> str:
+        """
+        Upload a JSONL file of chat completion requests and start a batch on it
+
+        Args:
+            requests_path(str): JSONL file with one {"custom_id", "method", "url", "body"} request per line
+
+        Returns:
+            batch_id(str): id of the batch created
+        """
+        with open(requests_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=config.BATCH_COMPLETION_WINDOW,
+        )
+        logger.info(f"Submitted batch {batch.id} of {requests_path}")
+        return batch.id
+
+    def wait_for_batch(
+        self, batch_id: str, poll_seconds: float = config.BATCH_POLL_SECONDS
+    ) -> Tuple[str, Dict[str, str]]:
+        """
+        Poll the batch until it ends and collect the content of its completions
+
+        Args:
+            batch_id(str): id of the batch
+            poll_seconds(float): seconds between two status checks
+
+        Returns:
+            status(str): final status of the batch, "completed", "failed", "expired" or "cancelled"
+            results(Dict[str, str]): content of every successful completion by custom_id, failed requests are left out
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        # a cancelling batch still writes the output of the requests it finished
+        while batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            counts = batch.request_counts
+            if counts:
+                logger.info(
+                    f"Batch {batch_id} {batch.status}: {counts.completed}/{counts.total} done"
+                )
+            time.sleep(poll_seconds)
+            batch = self.client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            logger.error(f"Batch {batch_id} ended {batch.status}: {batch.errors}")
+        if batch.error_file_id:
+            errors = self.client.files.content(batch.error_file_id).text
+            logger.error(
+                f"Batch {batch_id} has {len(errors.splitlines())} failed requests"
+            )
+        if not batch.output_file_id:
+            return batch.status, {}
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                logger.error(
+                    f"Batch request {result.get('custom_id')} failed: {result.get('error')}"
+                )
+                continue
+            choices = response["body"].get("choices") or [{}]
+            results[result["custom_id"]] = (choices[0].get("message") or {}).get(
+                "content"
+            ) or ""
+        return batch.status, results
@@ -0,0 +1,340 @@
+"""
+Parallel and resumable ontology extraction over a folder of papers
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from utils import atomic_write, convert_txt_to_json
+from .llm import LLM
+from .ontology_segments import merge_responses
+from .prompt_registry import prompts
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: str) -> str:
+    """
+    Args:
+        content(str): content of a paper
+
+    Returns:
+        hash(str): sha256 of the content
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class OntologyRunner:
+    """
+    Extracts the ontology of every paper of a folder with a pool of workers sharing the rate limit
+    of the process. A manifest in the output folder records the papers already extracted with the
+    hash of their content and of the prompt, so an interrupted run picks up where it stopped and a
+    re-run only extracts the new or changed papers.
+    """
+
+    def __init__(
+        self,
+        llm: LLM,
+        system_prompt_path: str,
+        output_folder: str,
+        output_folder_json: str,
+        model: str = "gpt-4o",
+        workers: int = config.ONTOLOGY_WORKERS,
+    ) -> None:
+        """
+        Args:
+            llm(LLM): LLM making the extraction calls
+            system_prompt_path(str): path of the system prompt of the extraction
+            output_folder(str): folder of the raw answers of the LLM, also holds the manifest
+            output_folder_json(str): folder of the json ontologies
+            model(str): model extracting the ontology
+            workers(int): papers extracted concurrently
+        """
+        self.llm = llm
+        self.system_prompt_path = system_prompt_path
+        self.output_folder = output_folder
+        self.output_folder_json = output_folder_json
+        self.model = model
+        self.workers = max(1, workers)
+        # folder of the papers of the current run
+        self.folder = ""
+        self.manifest_path = os.path.join(output_folder, config.ONTOLOGY_MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        self._lock = threading.Lock()
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        """
+        Returns:
+            manifest(Dict[str, dict]): entry of every extracted paper by file name, empty when there is no readable manifest
+        """
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Failed to read the manifest {self.manifest_path}: {e}")
+            return {}
+
+    def _record(self, file: str, entry: dict) -> None:
+        """
+        Add the paper to the manifest and save it, after each paper so that a crash loses no finished paper
+        """
+        with self._lock:
+            self.manifest[file] = entry
+            atomic_write(self.manifest_path, json.dumps(self.manifest, indent=2))
+
+    def is_done(self, file: str, paper_hash: str, prompt_hash: str) -> bool:
+        """
+        Whether the paper was extracted from the same content with the same prompt and model
+
+        Args:
+            file(str): file name of the paper
+            paper_hash(str): hash of the content of the paper
+            prompt_hash(str): hash of the system prompt
+
+        Returns:
+            done(bool): True when the manifest entry matches and the json ontology exists
+        """
+        entry = self.manifest.get(file)
+        return (
+            entry is not None
+            and entry.get("content_hash") == paper_hash
+            and entry.get("prompt_hash") == prompt_hash
+            and entry.get("model") == self.model
+            and os.path.exists(os.path.join(self.output_folder_json, entry["json"]))
+        )
+
+    def extract(self, file: str, system_prompt: str, prompt_hash: str) -> str:
+        """
+        Extract the ontology of one paper unless the manifest has it already
+
+        Args:
+            file(str): file name of the paper inside the folder
+            system_prompt(str): system prompt of the extraction
+            prompt_hash(str): hash of the system prompt
+
+        Returns:
+            status(str): "skipped", "extracted" or "failed"
+        """
+        file_content = self.llm.extract_content(
+            file_path=os.path.join(self.folder, file)
+        )
+        paper_hash = content_hash(file_content)
+        if self.is_done(file, paper_hash, prompt_hash):
+            return "skipped"
+        response = self.llm.extract_ontology(
+            system_prompt=system_prompt, file_content=file_content, model=self.model
+        )
+        return self._save(file, response, paper_hash, prompt_hash)
+
+    def _save(self, file: str, response: str, paper_hash: str, prompt_hash: str) -> str:
+        """
+        Write the ontology of the paper and add it to the manifest
+
+        Args:
+            file(str): file name of the paper
+            response(str): answer of the LLM, empty when the extraction failed
+            paper_hash(str): hash of the content of the paper
+            prompt_hash(str): hash of the system prompt
+
+        Returns:
+            status(str): "extracted" or "failed"
+        """
+        if not response:
+            return "failed"
+        saved = self.llm.write_to_output(
+            content=response, file_name=file, output_folder=self.output_folder
+        )
+        converted = convert_txt_to_json(
+            file_name=file, content=response, output_folder=self.output_folder_json
+        )
+        if not (saved and converted):
+            return "failed"
+        self._record(
+            file,
+            {
+                "content_hash": paper_hash,
+                "prompt_hash": prompt_hash,
+                "model": self.model,
+                "json": file.split(".")[0] + ".json",
+                "extracted_at": time.time(),
+            },
+        )
+        return "extracted"
+
+    def _start(self, folder_name: str) -> List[str]:
+        """
+        Prepare the output folders of a run
+
+        Args:
+            folder_name(str): folder of the papers
+
+        Returns:
+            files(List[str]): file names of the papers of the folder
+        """
+        self.folder = folder_name
+        os.makedirs(self.output_folder, exist_ok=True)
+        os.makedirs(self.output_folder_json, exist_ok=True)
+        return sorted(
+            file
+            for file in os.listdir(folder_name)
+            if not file.startswith(".")
+            and os.path.isfile(os.path.join(folder_name, file))
+        )
+
+    def run(self, folder_name: str) -> Dict[str, List[str]]:
+        """
+        Extract the ontology of every file of the folder
+
+        Args:
+            folder_name(str): folder of the papers
+
+        Returns:
+            summary(Dict[str, List[str]]): file names by status ("extracted", "skipped", "failed")
+        """
+        files = self._start(folder_name)
+        system_prompt = prompts.get(self.system_prompt_path)
+        prompt_hash = prompts.hash(self.system_prompt_path)
+        summary = {"extracted": [], "skipped": [], "failed": []}
+        logger.info(f"Extracting {len(files)} papers with {self.workers} workers")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.extract, file, system_prompt, prompt_hash): file
+                for file in files
+            }
+            for future in as_completed(futures):
+                file = futures[future]
+                try:
+                    status = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to extract the ontology of {file}: {e}")
+                    status = "failed"
+                summary[status].append(file)
+                logger.info(
+                    f"{status} {file} ({sum(map(len, summary.values()))}/{len(files)})"
+                )
+        logger.info(
+            f"Ontology extraction done: {len(summary['extracted'])} extracted, "
+            f"{len(summary['skipped'])} skipped, {len(summary['failed'])} failed"
+        )
+        return summary
+
+    def run_batch(self, folder_name: str) -> Dict[str, List[str]]:
+        """
+        Extract the ontology of every file of the folder through the OpenAI Batch API. The papers
+        missing from the manifest are written to a JSONL request file and submitted as one batch,
+        which is polled until it ends. The batch id is kept in the output folder so that an
+        interrupted run waits for the same batch instead of submitting the papers again. A batch
+        that ends without completing keeps its state, the next run submits the papers it missed.
+
+        Args:
+            folder_name(str): folder of the papers
+
+        Returns:
+            summary(Dict[str, List[str]]): file names by status ("extracted", "skipped", "failed")
+        """
+        files = self._start(folder_name)
+        summary = {"extracted": [], "skipped": [], "failed": []}
+        state_path = os.path.join(self.output_folder, config.ONTOLOGY_BATCH_STATE_NAME)
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = None
+        if state and state.get("status"):
+            # its results were saved by the previous run, the papers it missed are not in the manifest
+            logger.info(
+                f"Ontology batch {state['batch_id']} ended {state['status']}, "
+                "submitting the papers it missed"
+            )
+            state = None
+        if state:
+            logger.info(f"Resuming the ontology batch {state['batch_id']}")
+        else:
+            state = self._submit_batch(files, summary)
+            if state is None:
+                logger.info("Every paper of the folder is already extracted")
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(state_path)
+                return summary
+            atomic_write(state_path, json.dumps(state, indent=2))
+        batch_status, results = self.llm.wait_for_batch(state["batch_id"])
+        for file, paper in state["papers"].items():
+            response = merge_responses(
+                [results.get(f"{file}#{i}", "") for i in range(paper["segments"])]
+            )
+            status = self._save(file, response, paper["hash"], state["prompt_hash"])
+            summary[status].append(file)
+        if batch_status == "completed":
+            os.remove(state_path)
+        else:
+            logger.warning(
+                f"Ontology batch {state['batch_id']} ended {batch_status}, "
+                f"kept {state_path} for the next run"
+            )
+            atomic_write(state_path, json.dumps({**state, "status": batch_status}))
+        logger.info(
+            f"Ontology batch done: {len(summary['extracted'])} extracted, "
+            f"{len(summary['skipped'])} skipped, {len(summary['failed'])} failed"
+        )
+        return summary
+
+    def _submit_batch(
+        self, files: List[str], summary: Dict[str, List[str]]
+    ) -> Optional[dict]:
+        """
+        Write the requests of the papers missing from the manifest and submit them as a batch
+
+        Args:
+            files(List[str]): file names of the papers of the folder
+            summary(Dict[str, List[str]]): summary of the run, gets the skipped papers
+
+        Returns:
+            state(Optional[dict]): batch_id, prompt_hash and the content hash and number of segments of every submitted paper, None when there is nothing to extract
+        """
+        system_prompt = prompts.get(self.system_prompt_path)
+        prompt_hash = prompts.hash(self.system_prompt_path)
+        papers = {}
+        requests = []
+        for file in files:
+            file_content = self.llm.extract_content(
+                file_path=os.path.join(self.folder, file)
+            )
+            paper_hash = content_hash(file_content)
+            if self.is_done(file, paper_hash, prompt_hash):
+                summary["skipped"].append(file)
+                continue
+            # one request per segment of the paper, merged once the batch is done
+            segments = self.llm.ontology_segments(file_content)
+            papers[file] = {"hash": paper_hash, "segments": len(segments)}
+            for i, segment in enumerate(segments):
+                request = {
+                    "custom_id": f"{file}#{i}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.model,
+                        "messages": [
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": segment},
+                        ],
+                    },
+                }
+                requests.append(json.dumps(request))
+        if not requests:
+            return None
+        requests_path = os.path.join(
+            self.output_folder, config.ONTOLOGY_BATCH_REQUESTS_NAME
+        )
+        atomic_write(requests_path, "\n".join(requests) + "\n")
+        batch_id = self.llm.submit_batch(requests_path)
+        return {"batch_id": batch_id, "prompt_hash": prompt_hash, "papers": papers}
@@ -0,0 +1,208 @@
+"""
+Splitting of long papers into token bounded segments along their sections, and merging of the
+ontologies extracted from the segments into the ontology of the paper
+"""
+
+import json
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from utils import extract_json_block, tokencount_from_text
+
+logger = logging.getLogger(__name__)
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s", re.MULTILINE)
+# list fields of the paper summary that are combined across the segments
+SUMMARY_LIST_FIELDS = ("key_contributions", "primary_methods")
+
+
+def _count(text: str) -> int:
+    return tokencount_from_text(text=text, verbose=False)
+
+
+def _pieces(text: str, max_tokens: int) -> List[str]:
+    """
+    Split a section larger than max_tokens into paragraphs, then lines, then token bounded slices
+    """
+    for separator in ("\n\n", "\n"):
+        parts = [part for part in text.split(separator) if part.strip()]
+        if len(parts) > 1:
+            pieces = []
+            for part in parts:
+                if _count(part) > max_tokens:
+                    pieces.extend(_pieces(part, max_tokens))
+                else:
+                    pieces.append(part)
+            return pieces
+    # a single line longer than the segment, cut by characters in proportion to its tokens
+    size = max(1, len(text) * max_tokens // max(1, _count(text)))
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def split_sections(text: str, max_tokens: int) -> List[str]:
+    """
+    Split a markdown paper into segments of at most max_tokens tokens. Consecutive sections are
+    packed together, a section is only split inside when it does not fit in a segment on its own.
+    The text before the first heading, usually the title and the authors, opens every segment so
+    that each extraction knows the paper it reads.
+
+    Args:
+        text(str): markdown content of the paper
+        max_tokens(int): token limit of a segment
+
+    Returns:
+        segments(List[str]): the whole text when it fits in one segment
+    """
+    if _count(text) <= max_tokens:
+        return [text]
+    text = text.strip()
+    has_header = not HEADING_PATTERN.match(text)
+    starts = [match.start() for match in HEADING_PATTERN.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+    sections = [
+        text[start:end].strip()
+        for start, end in zip(starts, starts[1:] + [len(text)])
+        if text[start:end].strip()
+    ]
+    header = sections.pop(0) if has_header and len(sections) > 1 else ""
+    header_tokens = _count(header)
+    if header_tokens > max_tokens // 2:
+        # a header this long is content, not a title
+        sections.insert(0, header)
+        header, header_tokens = "", 0
+    budget = max_tokens - header_tokens
+
+    segments = []
+    current: List[str] = []
+    current_tokens = 0
+    for section in sections:
+        section_tokens = _count(section)
+        pieces = [section] if section_tokens <= budget else _pieces(section, budget)
+        for piece in pieces:
+            piece_tokens = section_tokens if len(pieces) == 1 else _count(piece)
+            if current and current_tokens + piece_tokens > budget:
+                segments.append(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        segments.append(current)
+    return ["\n\n".join(([header] if header else []) + parts) for parts in segments]
+
+
+def _node_key(extraction: dict) -> Tuple[str, str, str]:
+    """
+    Identity of a node across the segments: its classes and its normalized content
+    """
+    content = " ".join(str(extraction.get("extracted_content", "")).lower().split())
+    return (
+        str(extraction.get("first_level_class", "")).lower(),
+        str(extraction.get("second_level_class", "")).lower(),
+        content,
+    )
+
+
+def merge_ontologies(ontologies: List[dict]) -> dict:
+    """
+    Merge the ontologies extracted from the segments of a paper. Extraction and relationship ids are
+    renumbered in segment order as <paper_id>_EXT_### and <paper_id>_REL_###, nodes extracted
+    from several segments are kept once with the union of their keywords and the highest
+    confidence, and the relationships are pointed at the renumbered nodes.
+
+    Args:
+        ontologies(List[dict]): ontology of every segment, in the order of the paper
+
+    Returns:
+        ontology(dict): paper_id, paper_summary, extractions and relationships of the paper
+    """
+    paper_id = next((o["paper_id"] for o in ontologies if o.get("paper_id")), "")
+    summary = dict(
+        next((o["paper_summary"] for o in ontologies if o.get("paper_summary")), {})
+    )
+    for field in SUMMARY_LIST_FIELDS:
+        values = [
+            value
+            for ontology in ontologies
+            for value in (ontology.get("paper_summary") or {}).get(field) or []
+        ]
+        if values:
+            summary[field] = list(dict.fromkeys(values))
+
+    extractions: List[dict] = []
+    by_key: Dict[Tuple[str, str, str], dict] = {}
+    relationships: List[dict] = []
+    seen_edges = set()
+    for ontology in ontologies:
+        # extraction id of the segment -> id of the merged node
+        ids: Dict[str, str] = {}
+        for extraction in ontology.get("extractions") or []:
+            key = _node_key(extraction)
+            node = by_key.get(key)
+            if node is None:
+                node = {
+                    **extraction,
+                    "extraction_id": f"{paper_id}_EXT_{len(extractions) + 1:03d}",
+                }
+                by_key[key] = node
+                extractions.append(node)
+            else:
+                node["keywords"] = list(
+                    dict.fromkeys(
+                        (node.get("keywords") or [])
+                        + (extraction.get("keywords") or [])
+                    )
+                )
+                node["confidence_score"] = max(
+                    node.get("confidence_score") or 0,
+                    extraction.get("confidence_score") or 0,
+                )
+            ids[extraction.get("extraction_id", "")] = node["extraction_id"]
+        for relationship in ontology.get("relationships") or []:
+            source = ids.get(relationship.get("source_extraction_id"))
+            target = ids.get(relationship.get("target_extraction_id"))
+            edge = (source, target, relationship.get("relationship_type"))
+            if not source or not target or source == target or edge in seen_edges:
+                continue
+            seen_edges.add(edge)
+            relationships.append(
+                {
+                    **relationship,
+                    "relationship_id": f"{paper_id}_REL_{len(relationships) + 1:03d}",
+                    "source_extraction_id": source,
+                    "target_extraction_id": target,
+                }
+            )
+    return {
+        "paper_id": paper_id,
+        "paper_summary": summary,
+        "extractions": extractions,
+        "relationships": relationships,
+    }
+
+
+def merge_responses(responses: List[str]) -> str:
+    """
+    Merge the answers of the LLM for the segments of a paper into one answer
+
+    Args:
+        responses(List[str]): answer for every segment, in the order of the paper
+
+    Returns:
+        response(str): merged ontology in a json block, like the answer for a whole paper, empty when a segment has no ontology
+    """
+    if len(responses) == 1:
+        return responses[0]
+    ontologies: List[Optional[dict]] = []
+    for response in responses:
+        try:
+            ontologies.append(extract_json_block(response or ""))
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse the ontology of a segment: {e}")
+            return ""
+    if any(ontology is None for ontology in ontologies):
+        logger.error("A segment of the paper has no ontology")
+        return ""
+    merged = merge_ontologies(ontologies)
+    return f"```json\n{json.dumps(merged, indent=2)}\n```"
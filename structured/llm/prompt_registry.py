@@ -0,0 +1,65 @@
+"""
+Registry of the prompt templates, read once per process and reloaded when their file changes
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PromptRegistry:
+    """
+    Prompt files kept in memory with their modification time. A prompt is only read again
+    when its file was modified, so editing a prompt does not need a restart.
+    """
+
+    def __init__(self) -> None:
+        # path -> (mtime_ns, content, sha256)
+        self._prompts: Dict[str, Tuple[int, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, path: str) -> Tuple[int, str, str]:
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self._prompts.get(path)
+        if entry is None or entry[0] != mtime:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            if entry is not None:
+                logger.info(f"Reloaded the prompt {path}")
+            entry = (mtime, content, hashlib.sha256(content.encode()).hexdigest())
+            with self._lock:
+                self._prompts[path] = entry
+        return entry
+
+    def get(self, path: str) -> str:
+        """
+        Content of the prompt
+
+        Args:
+            path(str): path of the prompt file
+
+        Returns:
+            prompt(str): content of the prompt file
+        """
+        return self._entry(path)[1]
+
+    def hash(self, path: str) -> str:
+        """
+        Hash of the prompt, changes whenever the prompt file is edited
+
+        Args:
+            path(str): path of the prompt file
+
+        Returns:
+            hash(str): sha256 of the prompt content
+        """
+        return self._entry(path)[2]
+
+
+# shared by every LLM of the process
+prompts = PromptRegistry()
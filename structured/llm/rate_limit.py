@@ -0,0 +1,224 @@
+"""
+Client side rate limiting and retries of the OpenAI calls, shared by every LLM instance of the process
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from typing import List, Optional
+
+from openai import APIConnectionError, APIStatusError
+
+from . import config
+
+# tokens added by the chat format around the content of every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class RateLimited(Exception):
+    """
+    Raised when the rate limit cannot let a call through before its timeout
+    """
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously with per_minute units per minute, holding at most per_minute units.
+    Reservations may take the bucket below zero, the debt is the wait of the next reservations.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        """
+        Args:
+            per_minute(int): units allowed per minute, 0 for unlimited
+        """
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(
+            self.per_minute, self.level + (now - self.updated_at) * self.per_minute / 60
+        )
+        self.updated_at = now
+
+    def wait(self, units: float) -> float:
+        """
+        Seconds until the bucket holds the units, a reservation larger than the bucket waits for a full bucket
+        """
+        if not self.per_minute:
+            return 0.0
+        missing = min(units, self.per_minute) - self.level
+        return max(0.0, missing * 60 / self.per_minute)
+
+
+class RateLimiter:
+    """
+    Requests per minute and tokens per minute budgets. A call reserves one request and its estimated
+    tokens, then waits for the buckets to refill. A 429 pauses every call of the process.
+    """
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        """
+        Args:
+            rpm(int): requests per minute, 0 for unlimited
+            tpm(int): tokens per minute, 0 for unlimited
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Reserve one request and the tokens
+
+        Args:
+            tokens(int): estimated tokens of the call
+            max_wait(Optional[float]): longest acceptable wait, None to wait as long as needed
+
+        Returns:
+            wait(Optional[float]): seconds to wait before the call, None when it is over max_wait and nothing was reserved
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(
+                self.requests.wait(1),
+                self.tokens.wait(tokens),
+                self.paused_until - now,
+                0.0,
+            )
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.requests.level -= 1
+            self.tokens.level -= min(tokens, self.tokens.per_minute)
+            return wait
+
+    def acquire(self, tokens: int, max_wait: Optional[float] = None) -> None:
+        """
+        Block until the call fits in the budgets
+
+        Args:
+            tokens(int): estimated tokens of the call
+            max_wait(Optional[float]): longest acceptable wait, None to wait as long as needed
+        """
+        wait = self.reserve(tokens, max_wait)
+        if wait is None:
+            raise RateLimited(f"Rate limit wait exceeds {max_wait:.2f}s")
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(
+        self, tokens: int, max_wait: Optional[float] = None
+    ) -> None:
+        """
+        Wait without blocking the event loop until the call fits in the budgets
+
+        Args:
+            tokens(int): estimated tokens of the call
+            max_wait(Optional[float]): longest acceptable wait, None to wait as long as needed
+        """
+        wait = self.reserve(tokens, max_wait)
+        if wait is None:
+            raise RateLimited(f"Rate limit wait exceeds {max_wait:.2f}s")
+        if wait:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold every call of the process for the seconds, used when OpenAI answers 429
+
+        Args:
+            seconds(float): seconds to hold the calls
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(
+    messages: List[dict], model: str, max_tokens: Optional[int] = None
+) -> int:
+    """
+    Tokens a chat completion will be charged, the prompt counted with tiktoken plus the completion
+
+    Args:
+        messages(List[dict]): messages of the request
+        model(str): model of the request
+        max_tokens(Optional[int]): completion limit of the request, None for the configured estimate
+
+    Returns:
+        tokens(int): estimated prompt and completion tokens
+    """
+    from utils import count_tokens
+
+    prompt = sum(
+        count_tokens(str(message.get("content") or ""), model) + MESSAGE_OVERHEAD_TOKENS
+        for message in messages
+    )
+    return prompt + (max_tokens or config.OPENAI_COMPLETION_TOKENS_ESTIMATE)
+
+
+def retry_after(error: APIStatusError) -> Optional[float]:
+    """
+    Seconds asked by the Retry-After or retry-after-ms header of the response
+
+    Args:
+        error(APIStatusError): error raised by the client
+
+    Returns:
+        seconds(Optional[float]): None when the header is missing or unreadable
+    """
+    headers = error.response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+    except ValueError:
+        pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before retrying a failed call: the Retry-After of the response if it is longer,
+    otherwise an exponential backoff with full jitter
+
+    Args:
+        error(Exception): error raised by the call
+        attempt(int): number of the failed attempt, starting at 0
+
+    Returns:
+        delay(Optional[float]): None when the error is not worth retrying (4xx other than 429)
+    """
+    if isinstance(error, APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+    elif not isinstance(error, APIConnectionError):
+        return None
+    backoff = random.uniform(
+        0,
+        min(
+            config.OPENAI_BACKOFF_MAX_SECONDS,
+            config.OPENAI_BACKOFF_BASE_SECONDS * 2**attempt,
+        ),
+    )
+    asked = retry_after(error) if isinstance(error, APIStatusError) else None
+    return max(backoff, asked or 0.0)
+
+
+# budgets shared by every LLM instance of the process
+rate_limiter = RateLimiter(config.OPENAI_RPM_LIMIT, config.OPENAI_TPM_LIMIT)
@@ -3,3 +3,4 @@ Entry point of query package
 """
 
 from .query import Query
+from .async_query import AsyncQuery
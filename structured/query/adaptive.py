@@ -0,0 +1,52 @@
+"""
+Adaptive retrieval depth and graph expansion decisions driven by the retrieval distances
+"""
+
+from typing import List
+
+from . import config
+
+
+def adaptive_depth(
+    records: List[dict],
+    k_min: int = config.ADAPTIVE_TOP_K_MIN,
+    k_max: int = config.ADAPTIVE_TOP_K_MAX,
+    margin: float = config.ADAPTIVE_DISTANCE_MARGIN,
+) -> List[dict]:
+    """
+    Keep the records of a single query that are within a margin of its best record.
+    A query with one clear match keeps few records, a query with many close matches keeps up to k_max.
+
+    Args:
+        records(List[dict]): records retrieved for one query sorted from the closest
+        k_min(int): minimum records to keep
+        k_max(int): maximum records to keep
+        margin(float): maximum distance to the best record
+
+    Returns:
+        records(List[dict]): kept records sorted from the closest
+    """
+    if not records:
+        return []
+    cutoff = records[0]["distance"] + margin
+    depth = sum(1 for r in records[:k_max] if r["distance"] <= cutoff)
+    return records[: max(depth, k_min)]
+
+
+def vector_is_sufficient(
+    records: List[dict],
+    max_distance: float = config.GRAPH_SKIP_MAX_DISTANCE,
+    min_hits: int = config.GRAPH_SKIP_MIN_HITS,
+) -> bool:
+    """
+    Whether the Vector records are strong enough to answer without the graph expansion
+
+    Args:
+        records(List[dict]): Vector records with their distance
+        max_distance(float): distance under which a record is a strong hit
+        min_hits(int): strong hits needed
+
+    Returns:
+        sufficient(bool): True if the graph expansion can be skipped
+    """
+    return sum(1 for r in records if r["distance"] <= max_distance) >= min_hits
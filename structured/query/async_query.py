@@ -0,0 +1,697 @@
+"""
+Async query class so that the server can serve many user queries from a single event loop
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from database import AsyncNeo4j, Chromadb
+from utils import track_stage, record_cache, record_degraded, Deadline
+from llm import AsyncLLM
+from .query import (
+    Query,
+    answer_timeout,
+    query_deadline,
+    merge_retrieved,
+    new_records,
+    parse_revised_queries,
+    revised_only,
+    searched_collections,
+    unique_ids,
+    vector_records_of,
+)
+from .router import METADATA
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncQuery(Query):
+    """
+    Async variant of the Query class. OpenAI and Neo4j are awaited natively,
+    Chroma and SentenceTransformer work is offloaded to a bounded thread pool.
+    Routing, merging and context building are the ones of Query, only the stages doing I/O are async.
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        chromadb=None,
+        neo4j=None,
+        semantic_cache=None,
+        id_selector=None,
+        revise_cache=None,
+        embedding_cache=None,
+        router=None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        """
+        Args:
+            llm: AsyncLLM instance, a new one is created if not provided
+            neo4j: AsyncNeo4j instance, a new one is created if not provided
+            the other arguments are the ones of Query
+        """
+        super().__init__(
+            llm=llm or AsyncLLM(),
+            chromadb=chromadb or Chromadb(),
+            neo4j=neo4j or AsyncNeo4j(),
+            semantic_cache=semantic_cache,
+            id_selector=id_selector,
+            revise_cache=revise_cache,
+            embedding_cache=embedding_cache,
+            router=router,
+            executor=executor,
+        )
+
+    async def _run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking function in the executor without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        # in a copy of the context like asyncio.to_thread, run_in_executor does not carry it
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, partial(context.run, func, *args, **kwargs)
+        )
+
+    async def query(
+        self,
+        user_query: str,
+        collection_name: str = "",
+        fan_out: bool = True,
+        speculative: bool = False,
+        deadline_seconds: Optional[float] = None,
+    ) -> str:
+        """
+        Async Query.query
+        """
+        with track_stage("query"):
+            embedding = None
+            if self.semantic_cache:
+                embedding = await self._run_blocking(
+                    self.semantic_cache.embed, user_query
+                )
+                cached = await asyncio.to_thread(
+                    self.semantic_cache.get, embedding, collection_name, user_query
+                )
+                record_cache("semantic", hit=cached is not None)
+                if cached is not None:
+                    return cached
+
+            deadline = query_deadline(deadline_seconds)
+            output = await self._query(
+                user_query=user_query,
+                collection_name=collection_name,
+                fan_out=fan_out,
+                speculative=speculative,
+                deadline=deadline,
+            )
+            if self.semantic_cache and not deadline.degraded:
+                await asyncio.to_thread(
+                    self.semantic_cache.put,
+                    embedding,
+                    collection_name,
+                    output,
+                    user_query,
+                )
+            return output
+
+    async def _query(
+        self,
+        user_query: str,
+        collection_name: str,
+        fan_out: bool,
+        speculative: bool,
+        deadline: Deadline,
+    ) -> str:
+        """
+        Async Query._query
+        """
+        context = await self.context(
+            user_query=user_query,
+            collection_name=collection_name,
+            fan_out=fan_out,
+            speculative=speculative,
+            deadline=deadline,
+        )
+        return await self.answer(
+            context=context, user_query=user_query, timeout=answer_timeout(deadline)
+        )
+
+    async def stream(
+        self,
+        user_query: str,
+        collection_name: str = "",
+        fan_out: bool = True,
+        speculative: bool = False,
+        deadline_seconds: Optional[float] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Async Query.stream
+        """
+        embedding = None
+        if self.semantic_cache:
+            embedding = await self._run_blocking(self.semantic_cache.embed, user_query)
+            cached = await asyncio.to_thread(
+                self.semantic_cache.get, embedding, collection_name, user_query
+            )
+            record_cache("semantic", hit=cached is not None)
+            if cached is not None:
+                yield {"type": "sources", "sources": [], "cached": True}
+                yield {"type": "token", "content": cached}
+                return
+
+        deadline = query_deadline(deadline_seconds)
+        context = await self.context(
+            user_query=user_query,
+            collection_name=collection_name,
+            fan_out=fan_out,
+            speculative=speculative,
+            deadline=deadline,
+        )
+        yield {"type": "sources", "sources": context}
+        tokens = []
+        with track_stage("query_with_context"):
+            async for token in self.llm.stream_query_with_context(
+                context=context, query=user_query, timeout=answer_timeout(deadline)
+            ):
+                tokens.append(token)
+                yield {"type": "token", "content": token}
+        if self.semantic_cache and not deadline.degraded:
+            await asyncio.to_thread(
+                self.semantic_cache.put,
+                embedding,
+                collection_name,
+                "".join(tokens),
+                user_query,
+            )
+
+    @staticmethod
+    async def _cancel(*tasks: Optional[asyncio.Task]) -> None:
+        """
+        Cancel the tasks still running and wait for them, so that none outlives the call that
+        started it when one of its stages raises or the call is cancelled
+        """
+        started = [t for t in tasks if t is not None]
+        for task in started:
+            task.cancel()
+        await asyncio.gather(*started, return_exceptions=True)
+
+    async def _gather_bounded(self, coroutines: List) -> List:
+        """
+        Await the coroutines concurrently, at most BATCH_MAX_CONCURRENCY at a time
+        """
+        semaphore = asyncio.Semaphore(config.BATCH_MAX_CONCURRENCY)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return list(await asyncio.gather(*(bounded(c) for c in coroutines)))
+
+    async def query_many(
+        self, user_queries: List[str], collection_name: str = "both"
+    ) -> List[str]:
+        """
+        Async Query.query_many, the answers are awaited at most BATCH_MAX_CONCURRENCY at a time
+        """
+        with track_stage("query_many"):
+            answers: List[Optional[str]] = [None] * len(user_queries)
+            embeddings: List[Any] = [None] * len(user_queries)
+            if self.semantic_cache:
+                for i, user_query in enumerate(user_queries):
+                    embeddings[i] = await self._run_blocking(
+                        self.semantic_cache.embed, user_query
+                    )
+                    answers[i] = await asyncio.to_thread(
+                        self.semantic_cache.get,
+                        embeddings[i],
+                        collection_name,
+                        user_query,
+                    )
+                    record_cache("semantic", hit=answers[i] is not None)
+
+            pending = [i for i, answer in enumerate(answers) if answer is None]
+            contexts = await self.contexts_many(
+                user_queries=[user_queries[i] for i in pending],
+                collection_name=collection_name,
+            )
+            generated = await self._gather_bounded(
+                [
+                    self.answer(context=c, user_query=user_queries[i])
+                    for i, c in zip(pending, contexts)
+                ]
+            )
+            for i, answer in zip(pending, generated):
+                answers[i] = answer
+                if self.semantic_cache:
+                    await asyncio.to_thread(
+                        self.semantic_cache.put,
+                        embeddings[i],
+                        collection_name,
+                        answer,
+                        user_queries[i],
+                    )
+            return answers
+
+    async def contexts_many(
+        self, user_queries: List[str], collection_name: str = "both"
+    ) -> List[Any]:
+        """
+        Async Query.contexts_many
+        """
+        # one executor hop and one batched encode for all the questions
+        resolved = await self._run_blocking(
+            self.resolve_collections,
+            user_queries=user_queries,
+            collection_name=collection_name,
+        )
+        batched = [i for i, (c, _) in enumerate(resolved) if c.lower() == "both"]
+        single = [i for i, (c, _) in enumerate(resolved) if c.lower() != "both"]
+        contexts: List[Any] = [None] * len(user_queries)
+
+        # the questions routed to a single collection take the regular path
+        single_task = asyncio.ensure_future(
+            self._gather_bounded(
+                [
+                    self.context(
+                        user_query=user_queries[i], collection_name=resolved[i][0]
+                    )
+                    for i in single
+                ]
+            )
+        )
+        try:
+            revised, collections = await asyncio.gather(
+                self._gather_bounded([self.revise(user_queries[i]) for i in batched]),
+                self._run_blocking(self.chromadb.list_collections),
+            )
+            retrieved = await self._run_blocking(
+                self.retrieve_many,
+                query_groups=revised,
+                collection_names=[c.name for c in collections],
+                top_k=10,
+            )
+
+            vector_records, graph_records = {}, {}
+            for i, records in zip(batched, retrieved):
+                vector_records[i] = vector_records_of(records)
+                graph_records[i] = self.graph_records_to_expand(
+                    retrieved=records,
+                    vector_records=vector_records[i],
+                    with_graph=resolved[i][1],
+                )
+            selecting = [i for i in batched if graph_records[i] is not None]
+            selected = await self._gather_bounded(
+                [
+                    self.select_ids(
+                        records=graph_records[i], user_query=user_queries[i]
+                    )
+                    for i in selecting
+                ]
+            )
+            relevant_ids = {i: list(ids) for i, ids in zip(selecting, selected)}
+            by_id = await self.neighbors_batch(
+                [node for ids in relevant_ids.values() for node in ids]
+            )
+
+            for i in batched:
+                contexts[i] = await self._run_blocking(
+                    self.batched_context,
+                    vector_records=vector_records[i],
+                    graph_records=graph_records[i],
+                    relevant_ids=relevant_ids.get(i, []),
+                    by_id=by_id,
+                )
+            for i, context in zip(single, await single_task):
+                contexts[i] = context
+        finally:
+            # a failing batched stage does not leave the single collection contexts running
+            await self._cancel(single_task)
+        return contexts
+
+    async def context(
+        self,
+        user_query: str,
+        collection_name: str,
+        fan_out: bool = True,
+        speculative: bool = False,
+        deadline: Optional[Deadline] = None,
+    ) -> Any:
+        """
+        Async Query.context
+        """
+        deadline = deadline or Deadline()
+        collection_name, with_graph = await self._run_blocking(
+            self.resolve_collection,
+            user_query=user_query,
+            collection_name=collection_name,
+        )
+        if collection_name == METADATA:
+            return await self.metadata_context(user_query=user_query, deadline=deadline)
+        if collection_name.lower() == "both":
+            relevant_ids = None
+            if speculative:
+                collections = await self._run_blocking(self.chromadb.list_collections)
+                retrieved, relevant_ids = await self.speculative_retrieve(
+                    user_query=user_query,
+                    collection_names=searched_collections(collections, with_graph),
+                    top_k=10,
+                    deadline=deadline,
+                )
+            else:
+                revised_query, collections = await asyncio.gather(
+                    self.revise(user_query=user_query, deadline=deadline),
+                    self._run_blocking(self.chromadb.list_collections),
+                )
+                retrieved = await self.retrieve(
+                    queries=revised_query,
+                    collection_names=searched_collections(collections, with_graph),
+                    top_k=10,
+                    fan_out=fan_out,
+                    deadline=deadline,
+                )
+
+            vector_records = vector_records_of(retrieved)
+            graph_records = self.graph_records_to_expand(
+                retrieved=retrieved, vector_records=vector_records
+            )
+            graph = None
+            if graph_records is not None:
+                graph = await self.bounded_graph_context(
+                    records=graph_records,
+                    user_query=user_query,
+                    relevant_ids=relevant_ids,
+                    deadline=deadline,
+                )
+            return await self._run_blocking(
+                self.graph_stage_context,
+                collection_name=collection_name,
+                vector_records=vector_records,
+                graph_records=graph_records,
+                graph=graph,
+                relevant_ids=relevant_ids,
+            )
+
+        retrieved = await self.retrieve(
+            queries=[user_query],
+            collection_names=[collection_name],
+            top_k=10,
+            deadline=deadline,
+        )
+        records = retrieved[collection_name]
+        if collection_name.lower() == "graph":
+            graph = await self.bounded_graph_context(
+                records=records, user_query=user_query, deadline=deadline
+            )
+            return await self._run_blocking(
+                self.graph_stage_context,
+                collection_name=collection_name,
+                graph_records=records,
+                graph=graph,
+            )
+        return await self._run_blocking(
+            self.build_context, collection_name=collection_name, vector_records=records
+        )
+
+    async def revise(
+        self, user_query: str, deadline: Optional[Deadline] = None
+    ) -> List[str]:
+        """
+        Async Query.revise, the persistent cache is read and written in the executor
+        """
+        with track_stage("revise_query"):
+            cached = await self._run_blocking(self._cached_revision, user_query)
+            if cached:
+                return cached
+            timeout = (deadline or Deadline()).budget(config.DEADLINE_REVISE_FRACTION)
+            revised, parsed = parse_revised_queries(
+                await self.llm.revise_query(query=user_query, timeout=timeout),
+                user_query,
+            )
+            if parsed:
+                await self._run_blocking(self._store_revision, user_query, revised)
+            return revised
+
+    async def encode_async(self, queries: List[str]) -> List[List[float]]:
+        """
+        Query.encode in the executor, the persistent cache lookups are SQLite reads and writes
+
+        Args:
+            queries(List[str]): queries to be encoded
+
+        Returns:
+            embeddings(List[List[float]]): one embedding per query, in the same order
+        """
+        return await self._run_blocking(self.encode, queries)
+
+    async def retrieve(
+        self,
+        queries: List[str],
+        collection_names: List[str],
+        top_k: int = 10,
+        fan_out: bool = True,
+        where: Optional[dict] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, List[dict]]:
+        """
+        Query.retrieve in the executor
+        """
+        return await self._run_blocking(
+            super().retrieve,
+            queries=queries,
+            collection_names=collection_names,
+            top_k=top_k,
+            fan_out=fan_out,
+            where=where,
+            deadline=deadline,
+        )
+
+    async def metadata_context(
+        self, user_query: str, deadline: Optional[Deadline] = None
+    ) -> Any:
+        """
+        Async Query.metadata_context
+        """
+        retrieved = await self.retrieve(
+            queries=[user_query],
+            collection_names=["Graph"],
+            top_k=10,
+            where={"first_level_class": "Metadata"},
+            deadline=deadline,
+        )
+        if not retrieved["Graph"]:
+            return await self.context(
+                user_query=user_query, collection_name="Graph", deadline=deadline
+            )
+        return await self._run_blocking(
+            self.build_context,
+            collection_name=METADATA,
+            vector_records=retrieved["Graph"],
+        )
+
+    async def select_ids(
+        self, records: List[dict], user_query: str, timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Async Query.select_ids, the local selection runs in the executor
+        """
+        with track_stage("extract_relevant_ids"):
+            if config.ID_SELECTION_MODE == "local":
+                relevant_ids = await self._run_blocking(
+                    self.id_selector.select, records=records, user_query=user_query
+                )
+                if relevant_ids or not config.ID_SELECTION_LLM_FALLBACK:
+                    return relevant_ids or [""]
+                logger.info("No id selected locally, falling back to the LLM")
+            return await self.llm.extract_relevant_ids(
+                context=[r["text"] for r in records], query=user_query, timeout=timeout
+            )
+
+    async def neighbors(
+        self, relevant_ids: List[str], timeout: Optional[float] = None
+    ) -> List:
+        """
+        Async Query.neighbors, timeout bounds each Neo4j transaction
+        """
+        with track_stage("retrieve_neighbors"):
+            return await self.neo4j.retrieve_neighbors(
+                nodes=relevant_ids, timeout=timeout
+            )
+
+    async def neighbors_batch(self, relevant_ids: List[str]) -> Dict[str, dict]:
+        """
+        Async Query.neighbors_batch
+        """
+        if not any(relevant_ids):
+            return {}
+        with track_stage("retrieve_neighbors"):
+            return await self.neo4j.retrieve_neighbors_batch(nodes=relevant_ids)
+
+    async def answer(
+        self, context: Any, user_query: str, timeout: Optional[float] = None
+    ) -> str:
+        """
+        Async Query.answer
+        """
+        with track_stage("query_with_context"):
+            return await self.llm.query_with_context(
+                context=context, query=user_query, timeout=timeout
+            )
+
+    async def speculative_retrieve(
+        self,
+        user_query: str,
+        collection_names: List[str],
+        top_k: int = 10,
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[Dict[str, List[dict]], Optional[List[str]]]:
+        """
+        Async Query.speculative_retrieve
+        """
+        deadline = deadline or Deadline()
+        ids_timeout = deadline.budget(config.DEADLINE_GRAPH_FRACTION)
+        revise_task = asyncio.create_task(
+            self.revise(user_query=user_query, deadline=deadline)
+        )
+        ids_task = None
+        try:
+            retrieved = await self.retrieve(
+                queries=[user_query],
+                collection_names=collection_names,
+                top_k=top_k,
+                deadline=deadline,
+            )
+            if "Graph" in retrieved:
+                ids_task = asyncio.create_task(
+                    self.select_ids(
+                        records=retrieved["Graph"],
+                        user_query=user_query,
+                        timeout=ids_timeout,
+                    )
+                )
+
+            missing = revised_only(await revise_task, user_query)
+            extra = await self.retrieve(
+                queries=missing,
+                collection_names=collection_names,
+                top_k=top_k,
+                deadline=deadline,
+            )
+            new_graph_records = new_records(
+                extra.get("Graph", []), retrieved.get("Graph", [])
+            )
+            merged = merge_retrieved(retrieved, extra)
+
+            relevant_ids = None
+            if ids_task:
+                relevant_ids = list(await ids_task)
+                if new_graph_records:
+                    logger.info(
+                        f"Revised queries added {len(new_graph_records)} Graph chunks"
+                    )
+                    relevant_ids.extend(
+                        await self.select_ids(
+                            records=new_graph_records,
+                            user_query=user_query,
+                            timeout=ids_timeout,
+                        )
+                    )
+                relevant_ids = unique_ids(relevant_ids)
+            return merged, relevant_ids
+        finally:
+            await self._cancel(revise_task, ids_task)
+
+    async def graph_context(
+        self,
+        records: List[dict],
+        user_query: str,
+        relevant_ids: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[List[str], List]:
+        """
+        Async Query.graph_context
+        """
+        stage = Deadline(timeout)
+        if relevant_ids is None:
+            if stage.expired():
+                logger.warning("Graph stage out of time, skipped the id selection")
+                return [""], [""]
+            relevant_ids = await self.select_ids(
+                records=records, user_query=user_query, timeout=stage.remaining()
+            )
+        context = [""]
+        if any(relevant_ids):
+            if stage.expired():
+                logger.warning("Graph stage out of time, skipped the graph expansion")
+                return relevant_ids, context
+            context = await self.neighbors(
+                relevant_ids=relevant_ids, timeout=stage.remaining()
+            )
+        return relevant_ids, context
+
+    async def bounded_graph_context(
+        self,
+        records: List[dict],
+        user_query: str,
+        relevant_ids: Optional[List[str]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Optional[Tuple[List[str], List]]:
+        """
+        Async Query.bounded_graph_context, the graph stage is cancelled when it runs out of budget
+        """
+        budget = (deadline or Deadline()).budget(config.DEADLINE_GRAPH_FRACTION)
+        try:
+            return await asyncio.wait_for(
+                self.graph_context(
+                    records=records,
+                    user_query=user_query,
+                    relevant_ids=relevant_ids,
+                    timeout=budget,
+                ),
+                timeout=budget,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Graph stage ran out of its {budget:.2f}s budget, answering without it"
+            )
+            deadline.degraded = True
+            record_degraded("graph")
+            return None
+
+    async def warm_up(self, connections: int = 1) -> Dict[str, float]:
+        """
+        Warm the embedding model and open the Neo4j and OpenAI connections concurrently,
+        raising if one of them is not usable
+        Args:
+            connections(int): connections to open in the Neo4j and OpenAI pools
+
+        Returns:
+            timings(Dict[str, float]): seconds taken by each component
+        """
+
+        async def timed(name: str, step) -> Tuple[str, float]:
+            start = time.perf_counter()
+            await step
+            elapsed = time.perf_counter() - start
+            logger.info(f"Warmed up {name} in {elapsed:.2f}s")
+            return name, elapsed
+
+        timings = await asyncio.gather(
+            timed("embedding", self._run_blocking(self.chromadb.warm_up)),
+            timed("neo4j", self.neo4j.warm_up(connections)),
+            timed("openai", self.llm.warm_up(connections)),
+        )
+        return dict(timings)
+
+    async def close(self) -> None:
+        """
+        Release the Neo4j connection pool and the executor
+        """
+        await self.neo4j.close()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,98 @@
+"""
+This is config file from where we manage all the variables to be used in the query folder
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Threads shared by the stages of the queries: the speculative revision, the deadline bounded graph
+# stage and, in AsyncQuery, the Chroma and SentenceTransformer work offloaded from the event loop
+EXECUTOR_MAX_WORKERS = int(os.getenv("QUERY_EXECUTOR_MAX_WORKERS", "8"))
+
+# Start retrieval on the raw user query while revise_query is in flight
+SPECULATIVE_RETRIEVAL = (
+    os.getenv("QUERY_SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+)
+
+# How the relevant extraction ids are selected from the Graph collection: "local" or "llm"
+ID_SELECTION_MODE = os.getenv("QUERY_ID_SELECTION_MODE", "local")
+# Fall back to the LLM selection when the local selection does not find any id
+ID_SELECTION_LLM_FALLBACK = (
+    os.getenv("QUERY_ID_SELECTION_LLM_FALLBACK", "true").lower() == "true"
+)
+# Maximum squared L2 distance of a Graph chunk to be selected, all-MiniLM-L6-v2 embeddings are
+# normalized so 1.2 keeps chunks with a cosine similarity of at least 0.4
+ID_SELECTION_MAX_DISTANCE = float(os.getenv("QUERY_ID_SELECTION_MAX_DISTANCE", "1.2"))
+ID_SELECTION_MAX_IDS = int(os.getenv("QUERY_ID_SELECTION_MAX_IDS", "10"))
+# Optional CPU cross-encoder used to rerank the Graph chunks, empty to disable
+ID_SELECTION_RERANK_MODEL = os.getenv("QUERY_ID_SELECTION_RERANK_MODEL", "")
+
+# Pack the retrieved context into a token budget per source before query_with_context
+CONTEXT_PACKING = os.getenv("QUERY_CONTEXT_PACKING", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = {
+    "Vector": int(os.getenv("QUERY_CONTEXT_TOKEN_BUDGET_VECTOR", "3000")),
+    "Graph": int(os.getenv("QUERY_CONTEXT_TOKEN_BUDGET_GRAPH", "3000")),
+}
+# Score multiplier of the neighbors and of the paper of a selected node relative to the node itself
+GRAPH_NEIGHBOR_DECAY = float(os.getenv("QUERY_GRAPH_NEIGHBOR_DECAY", "0.5"))
+GRAPH_PAPER_DECAY = float(os.getenv("QUERY_GRAPH_PAPER_DECAY", "0.8"))
+
+# Remove exact and near duplicate context items before packing
+CONTEXT_DEDUP = os.getenv("QUERY_CONTEXT_DEDUP", "true").lower() == "true"
+# Maximum number of differing SimHash bits (out of 64) for two items to be near duplicates
+DEDUP_SIMHASH_DISTANCE = int(os.getenv("QUERY_DEDUP_SIMHASH_DISTANCE", "3"))
+# Share of the shingles of the smaller item found in the other for them to be duplicates
+DEDUP_CONTAINMENT_THRESHOLD = float(
+    os.getenv("QUERY_DEDUP_CONTAINMENT_THRESHOLD", "0.8")
+)
+# Smallest ratio between the shingle counts of two items for the containment to apply, a short
+# fact quoted in a long chunk is not a duplicate of it
+DEDUP_LENGTH_RATIO = float(os.getenv("QUERY_DEDUP_LENGTH_RATIO", "0.8"))
+
+# Size the retrieval per query from the distances instead of a fixed top_k
+ADAPTIVE_RETRIEVAL = os.getenv("QUERY_ADAPTIVE_RETRIEVAL", "true").lower() == "true"
+# Every query fetches ADAPTIVE_TOP_K_MAX records and keeps at least ADAPTIVE_TOP_K_MIN of them
+ADAPTIVE_TOP_K_MIN = int(os.getenv("QUERY_ADAPTIVE_TOP_K_MIN", "3"))
+ADAPTIVE_TOP_K_MAX = int(os.getenv("QUERY_ADAPTIVE_TOP_K_MAX", "20"))
+# Records further than this squared L2 distance from the best record of the query are dropped
+ADAPTIVE_DISTANCE_MARGIN = float(os.getenv("QUERY_ADAPTIVE_DISTANCE_MARGIN", "0.3"))
+# In "both" mode the graph expansion is skipped when at least GRAPH_SKIP_MIN_HITS Vector records
+# are closer than GRAPH_SKIP_MAX_DISTANCE (0.5 is a cosine similarity of 0.75)
+GRAPH_SKIP_MAX_DISTANCE = float(os.getenv("QUERY_GRAPH_SKIP_MAX_DISTANCE", "0.5"))
+GRAPH_SKIP_MIN_HITS = int(os.getenv("QUERY_GRAPH_SKIP_MIN_HITS", "3"))
+
+# Classes of the Graph extractions, the first level classes are used by the query router rules
+FIRST_LEVEL_CLASSES_FILE = os.getenv(
+    "QUERY_FIRST_LEVEL_CLASSES_FILE",
+    os.path.join(
+        os.path.dirname(os.path.dirname(__file__)),
+        "data",
+        "classes",
+        "first_level_classes.json",
+    ),
+)
+FIRST_LEVEL_CLASSES_VERSION = os.getenv("QUERY_FIRST_LEVEL_CLASSES_VERSION", "v3")
+# Optional JSON file {"vector": [...], "graph": [...], "metadata": [...]} of labelled questions,
+# e.g. taken from the query logs, replacing the built in router examples
+ROUTER_EXAMPLES_FILE = os.getenv("QUERY_ROUTER_EXAMPLES_FILE", "")
+# Minimum cosine similarity to the closest example and margin over the second route,
+# below either the query is routed to both paths
+ROUTER_MIN_SIMILARITY = float(os.getenv("QUERY_ROUTER_MIN_SIMILARITY", "0.45"))
+ROUTER_MARGIN = float(os.getenv("QUERY_ROUTER_MARGIN", "0.05"))
+
+# Questions of a query_many batch whose revise and answer LLM calls run concurrently
+BATCH_MAX_CONCURRENCY = int(os.getenv("QUERY_BATCH_MAX_CONCURRENCY", "16"))
+
+# Seconds a query may take before its remaining stages are cut short, 0 to disable
+DEADLINE_SECONDS = float(os.getenv("QUERY_DEADLINE_SECONDS", "30")) or None
+# Share of the deadline each stage may take, the answer gets whatever is left
+DEADLINE_REVISE_FRACTION = float(os.getenv("QUERY_DEADLINE_REVISE_FRACTION", "0.2"))
+DEADLINE_RETRIEVE_FRACTION = float(
+    os.getenv("QUERY_DEADLINE_RETRIEVE_FRACTION", "0.15")
+)
+# When the graph stage runs out of budget the answer is generated from the Vector context alone
+DEADLINE_GRAPH_FRACTION = float(os.getenv("QUERY_DEADLINE_GRAPH_FRACTION", "0.3"))
+# Seconds the answer is always given, even when the earlier stages used up the deadline
+DEADLINE_MIN_ANSWER_SECONDS = float(os.getenv("QUERY_DEADLINE_MIN_ANSWER_SECONDS", "5"))
@@ -0,0 +1,182 @@
+"""
+Packs the retrieved context into a token budget per source before it is sent to query_with_context
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from utils import count_tokens
+from .id_selection import record_extraction_id
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class ContextItem(BaseModel):
+    text: str
+    source: str  # Vector or Graph
+    score: float
+    provenance: List[str] = Field(default_factory=list)
+    tokens: int = 0
+
+
+class PackedContext(BaseModel):
+    context: Dict[str, List[str]]
+    packed_tokens: Dict[str, int]
+    dropped: Dict[str, List[ContextItem]]
+
+    @property
+    def dropped_tokens(self) -> Dict[str, int]:
+        return {s: sum(i.tokens for i in items) for s, items in self.dropped.items()}
+
+
+def similarity(distance: float) -> float:
+    """
+    Cosine similarity from the squared L2 distance returned by Chroma for normalized embeddings
+
+    Args:
+        distance(float): squared L2 distance
+
+    Returns:
+        similarity(float): similarity between 0 and 1
+    """
+    return max(0.0, 1.0 - distance / 2)
+
+
+def vector_items(records: List[dict]) -> List[ContextItem]:
+    """
+    Context items of the Vector records scored by their similarity to the query
+
+    Args:
+        records(List[dict]): records retrieved from the Vector collection
+
+    Returns:
+        items(List[ContextItem]): one item per record
+    """
+    return [
+        ContextItem(
+            text=r["text"],
+            source="Vector",
+            score=similarity(r["distance"]),
+            provenance=[f"Vector:{r.get('chunk_id', r.get('source', ''))}"],
+        )
+        for r in records
+    ]
+
+
+def graph_items(
+    neighbors: List, relevant_ids: List[str], records: List[dict]
+) -> List[ContextItem]:
+    """
+    Context items of the nodes returned by retrieve_neighbors. A node is scored by the similarity of its
+    Graph record, its neighbors and its paper are scored lower the further they are from the node.
+
+    Args:
+        neighbors(List): output of retrieve_neighbors, in the same order as relevant_ids
+        relevant_ids(List[str]): extraction ids the neighbors were retrieved for
+        records(List[dict]): records retrieved from the Graph collection
+
+    Returns:
+        items(List[ContextItem]): items of the nodes, relationships and papers
+    """
+    id_scores: Dict[str, float] = {}
+    for r in records:
+        extraction_id = record_extraction_id(r)
+        id_scores[extraction_id] = max(
+            id_scores.get(extraction_id, 0.0), similarity(r["distance"])
+        )
+    # ids selected by the LLM may not be in the records, give them the weakest known score
+    default_score = min(id_scores.values()) if id_scores else 1.0
+
+    items = []
+    for node_id, output in zip(relevant_ids, neighbors):
+        if not isinstance(output, dict):
+            continue
+        score = id_scores.get(node_id, default_score)
+        node = output.get("Node")
+        if node:
+            items.append(
+                ContextItem(
+                    text=f"{node_id}: {node['content']} Evidence: {node['evidence']}",
+                    source="Graph",
+                    score=score,
+                    provenance=[f"Graph:{node_id}"],
+                )
+            )
+        paper = output.get("Paper")
+        if paper:
+            items.append(
+                ContextItem(
+                    text=(
+                        f"Paper {paper['paper_id']}: {paper['main_theme']} "
+                        f"Key contributions: {paper['Key_contributions']} "
+                        f"Primary methods: {paper['paper_prim_meth']}"
+                    ),
+                    source="Graph",
+                    score=score * config.GRAPH_PAPER_DECAY,
+                    provenance=[f"Graph:{paper['paper_id']}"],
+                )
+            )
+        for rec in output.get("Record", []):
+            relationship = rec.get("Relationship")
+            neighbour = rec.get("Neighbour")
+            if not neighbour:
+                continue
+            text = f"{node_id} is connected to: {neighbour['Content']} Evidence: {neighbour['Evidence']}"
+            if relationship:
+                text = (
+                    f"{node_id} {relationship['Type']} {neighbour['Content']} "
+                    f"({relationship['Description']}) Evidence: {relationship['Evidence']}"
+                )
+            items.append(
+                ContextItem(
+                    text=text,
+                    source="Graph",
+                    score=score * config.GRAPH_NEIGHBOR_DECAY,
+                    provenance=[f"Graph:{node_id}"],
+                )
+            )
+    return items
+
+
+def pack_context(
+    items: List[ContextItem],
+    budgets: Dict[str, int],
+    llm_model: str = "gpt-4o",
+) -> PackedContext:
+    """
+    Greedily fill the token budget of every source with the highest scoring items.
+    An item that does not fit is dropped and the next one is tried so the budget is filled as much as possible.
+
+    Args:
+        items(List[ContextItem]): items to pack
+        budgets(Dict[str, int]): token budget per source, a source without a budget is not limited
+        llm_model(str): model used to count the tokens
+
+    Returns:
+        packed(PackedContext): texts kept per source, in order of score, and the items dropped
+    """
+    context: Dict[str, List[str]] = {}
+    packed_tokens: Dict[str, int] = {}
+    dropped: Dict[str, List[ContextItem]] = {}
+    for item in sorted(items, key=lambda i: i.score, reverse=True):
+        context.setdefault(item.source, [])
+        packed_tokens.setdefault(item.source, 0)
+        dropped.setdefault(item.source, [])
+        item.tokens = count_tokens(item.text, llm_model=llm_model)
+        budget: Optional[int] = budgets.get(item.source)
+        if budget is not None and packed_tokens[item.source] + item.tokens > budget:
+            dropped[item.source].append(item)
+            continue
+        context[item.source].append(item.text)
+        packed_tokens[item.source] += item.tokens
+
+    for source, items_dropped in dropped.items():
+        if items_dropped:
+            logger.info(
+                f"Context packing dropped {len(items_dropped)} {source} items "
+                f"({sum(i.tokens for i in items_dropped)} tokens) to fit {budgets.get(source)} tokens"
+            )
+    return PackedContext(context=context, packed_tokens=packed_tokens, dropped=dropped)
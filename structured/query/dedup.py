@@ -0,0 +1,143 @@
+"""
+Removes exact and near duplicate context items across the Vector and Graph contexts
+"""
+
+import hashlib
+import logging
+import re
+from typing import List, Set
+
+from .context_packer import ContextItem
+from . import config
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 3
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lower case the text and keep only its words so formatting differences do not matter
+
+    Args:
+        text(str): text to normalize
+
+    Returns:
+        normalized(str): words of the text separated by a single space
+    """
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+def shingles(normalized: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """
+    Hashed word n-grams of the normalized text
+
+    Args:
+        normalized(str): normalized text
+        size(int): number of words per shingle
+
+    Returns:
+        shingles(Set[int]): 64 bit hashes of the shingles
+    """
+    words = normalized.split()
+    if len(words) <= size:
+        return {_hash64(normalized)} if words else set()
+    return {
+        _hash64(" ".join(words[i : i + size])) for i in range(len(words) - size + 1)
+    }
+
+
+def simhash(hashed_shingles: Set[int]) -> int:
+    """
+    64 bit SimHash fingerprint, near identical texts have fingerprints a few bits apart
+
+    Args:
+        hashed_shingles(Set[int]): hashed shingles of the text
+
+    Returns:
+        fingerprint(int): SimHash of the text
+    """
+    weights = [0] * 64
+    for h in hashed_shingles:
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class _Fingerprint:
+    def __init__(self, item: ContextItem) -> None:
+        normalized = normalize_text(item.text)
+        self.item = item
+        self.content_hash = hashlib.sha1(normalized.encode()).hexdigest()
+        self.shingles = shingles(normalized)
+        self.simhash = simhash(self.shingles)
+
+    def duplicates(self, other: "_Fingerprint") -> bool:
+        if self.content_hash == other.content_hash:
+            return True
+        if not self.shingles or not other.shingles:
+            return False
+        if (
+            bin(self.simhash ^ other.simhash).count("1")
+            <= config.DEDUP_SIMHASH_DISTANCE
+        ):
+            return True
+        # containment only between items of comparable length, a long chunk quoting a short fact
+        # has content the fact lacks and dropping either of them would lose information
+        smaller, larger = sorted((len(self.shingles), len(other.shingles)))
+        if smaller / larger < config.DEDUP_LENGTH_RATIO:
+            return False
+        overlap = len(self.shingles & other.shingles)
+        return overlap / smaller >= config.DEDUP_CONTAINMENT_THRESHOLD
+
+    def contains(self, other: "_Fingerprint") -> bool:
+        """
+        Whether the item holds every shingle of the other and more
+        """
+        return len(self.shingles) > len(other.shingles) and self.shingles.issuperset(
+            other.shingles
+        )
+
+
+def deduplicate(items: List[ContextItem]) -> List[ContextItem]:
+    """
+    Remove the duplicates of the context items with content hashing and SimHash/shingle
+    containment near duplicate detection. The highest scoring copy is kept, or the longer one
+    when it strictly contains the other, and the provenance of the copies removed is added to it.
+
+    Args:
+        items(List[ContextItem]): context items from all the sources
+
+    Returns:
+        items(List[ContextItem]): unique items sorted from the highest score
+    """
+    kept: List[_Fingerprint] = []
+    for item in sorted(items, key=lambda i: i.score, reverse=True):
+        fingerprint = _Fingerprint(item)
+        duplicate_of = next((k for k in kept if k.duplicates(fingerprint)), None)
+        if duplicate_of is None:
+            kept.append(fingerprint)
+            continue
+        if fingerprint.contains(duplicate_of):
+            # the longer copy takes the place and the score of the one kept so far
+            replaced = duplicate_of.item
+            item.score = replaced.score
+            item.provenance = replaced.provenance + [
+                p for p in item.provenance if p not in replaced.provenance
+            ]
+            kept[kept.index(duplicate_of)] = fingerprint
+            continue
+        for p in item.provenance:
+            if p not in duplicate_of.item.provenance:
+                duplicate_of.item.provenance.append(p)
+
+    removed = len(items) - len(kept)
+    if removed:
+        logger.info(f"Removed {removed} duplicate context items out of {len(items)}")
+    return [k.item for k in kept]
@@ -0,0 +1,95 @@
+"""
+Local selection of the relevant extraction ids from the records of the Graph collection
+"""
+
+import re
+import logging
+import threading
+from typing import List
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_ID_PATTERN = re.compile(r"\bP\d{3}_EXT_\d+\b")
+
+
+def record_extraction_id(record: dict) -> str:
+    """
+    Extraction id of a Graph record. Collections stored before the extraction_id metadata existed
+    only have it inside the text so it is parsed from there.
+
+    Args:
+        record(dict): record retrieved from the Graph collection
+
+    Returns:
+        extraction_id(str): extraction id, empty if none is found
+    """
+    if record.get("extraction_id"):
+        return record["extraction_id"]
+    match = EXTRACTION_ID_PATTERN.search(record.get("text", ""))
+    return match.group(0) if match else ""
+
+
+class IdSelector:
+    """
+    Selects the extraction ids with a distance threshold and an optional cross-encoder rerank,
+    without a round trip to the LLM
+    """
+
+    def __init__(
+        self,
+        max_distance: float = config.ID_SELECTION_MAX_DISTANCE,
+        max_ids: int = config.ID_SELECTION_MAX_IDS,
+        rerank_model: str = config.ID_SELECTION_RERANK_MODEL,
+    ) -> None:
+        """
+        Args:
+            max_distance(float): maximum distance of a record to the query to be selected
+            max_ids(int): maximum number of ids returned
+            rerank_model(str): name of the CrossEncoder model, empty to disable the rerank
+        """
+        self.max_distance = max_distance
+        self.max_ids = max_ids
+        self.rerank_model = rerank_model
+        self._cross_encoder = None
+        self._lock = threading.Lock()
+
+    @property
+    def cross_encoder(self):
+        """
+        CrossEncoder loaded on first use
+        """
+        if self._cross_encoder is None:
+            with self._lock:
+                if self._cross_encoder is None:
+                    from sentence_transformers import CrossEncoder
+
+                    logger.info(f"Loading cross-encoder {self.rerank_model}")
+                    self._cross_encoder = CrossEncoder(self.rerank_model, device="cpu")
+        return self._cross_encoder
+
+    def select(self, records: List[dict], user_query: str) -> List[str]:
+        """
+        Select the extraction ids relevant to the user query
+
+        Args:
+            records(List[dict]): records retrieved from the Graph collection with their distance
+            user_query(str): question asked by the user
+
+        Returns:
+            relevant_ids(List[str]): extraction ids from the most relevant, can be empty
+        """
+        candidates = sorted(
+            (r for r in records if r["distance"] <= self.max_distance),
+            key=lambda r: r["distance"],
+        )
+        if self.rerank_model and candidates:
+            scores = self.cross_encoder.predict(
+                [(user_query, r["text"]) for r in candidates]
+            )
+            ranked = sorted(zip(scores, candidates), key=lambda p: p[0], reverse=True)
+            candidates = [r for _, r in ranked]
+
+        ids = [record_extraction_id(r) for r in candidates]
+        return [i for i in dict.fromkeys(ids) if i][: self.max_ids]
@@ -2,82 +2,1275 @@
 Query class for a single user query session
 """
 
+import contextvars
 import os
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import json
 import logging
+import re
 from pathlib import Path
 
-from utils import json_to_txt, chunking
+from utils import (
+    json_to_txt,
+    track_stage,
+    record_chunks,
+    record_cache,
+    record_context,
+    record_graph_expansion,
+    record_degraded,
+    Deadline,
+)
 from database import Neo4j, Chromadb
+from database.chromadb import merge_records
 from llm import LLM
+from cache import SemanticCache, SQLiteCache
+from cache import config as cache_config
+from .adaptive import adaptive_depth, vector_is_sufficient
+from .router import BOTH, GRAPH, METADATA, QueryRouter
+from .id_selection import IdSelector
+from .context_packer import graph_items, pack_context, vector_items
+from .dedup import deduplicate
+from . import config
 
 logger = logging.getLogger(__name__)
 
 
+def submit_in_context(
+    executor: ThreadPoolExecutor, func: Callable, *args, **kwargs
+) -> Future:
+    """
+    Submit the call to the executor in a copy of the current context, so that the context
+    variables of the request, such as the ones of the metrics observers, follow it to the worker
+
+    Args:
+        executor(ThreadPoolExecutor): executor to run the call in
+        func(Callable): function to call with the args and kwargs
+
+    Returns:
+        future(Future): future of the call
+    """
+    return executor.submit(
+        contextvars.copy_context().run, partial(func, *args, **kwargs)
+    )
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query so that trivially different spellings of the same question compare equal
+
+    Args:
+        query(str): query to normalize
+
+    Returns:
+        normalized(str): lower cased query with collapsed whitespace
+    """
+    return " ".join(query.lower().split())
+
+
+def parse_revised_queries(answer: str, user_query: str) -> Tuple[List[str], bool]:
+    """
+    Parse the revise_query answer into the list of revised queries
+
+    Args:
+        answer(str): raw answer of revise_query, expected to be a JSON list of strings
+        user_query(str): question asked by the user, used when the answer cannot be parsed
+
+    Returns:
+        revised_query(List[str]): revised queries, [user_query] if the answer is not a list of strings
+        parsed(bool): whether the answer could be parsed
+    """
+    candidates = [answer]
+    # the model sometimes wraps the list in a code block or a sentence
+    match = re.search(r"\[.*\]", answer or "", re.DOTALL)
+    if match:
+        candidates.append(match.group(0))
+    for candidate in candidates:
+        try:
+            revised = json.loads(candidate)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(revised, str):
+            revised = [revised]
+        if (
+            isinstance(revised, list)
+            and revised
+            and all(isinstance(q, str) and q.strip() for q in revised)
+        ):
+            return revised, True
+    logger.warning("Could not parse the revised queries, using the user query")
+    return [user_query], False
+
+
+def query_deadline(deadline_seconds: Optional[float]) -> Deadline:
+    """
+    Deadline of a query
+
+    Args:
+        deadline_seconds(Optional[float]): seconds asked by the caller, None for DEADLINE_SECONDS, 0 for no deadline
+
+    Returns:
+        deadline(Deadline): deadline starting now
+    """
+    if deadline_seconds is None:
+        return Deadline(config.DEADLINE_SECONDS)
+    return Deadline(deadline_seconds or None)
+
+
+def answer_timeout(deadline: Deadline) -> Optional[float]:
+    """
+    Seconds left for the answer, never less than DEADLINE_MIN_ANSWER_SECONDS
+
+    Args:
+        deadline(Deadline): deadline of the query
+
+    Returns:
+        timeout(Optional[float]): timeout of the answer, None without deadline
+    """
+    remaining = deadline.remaining()
+    if remaining is None:
+        return None
+    return max(remaining, config.DEADLINE_MIN_ANSWER_SECONDS)
+
+
+def merge_retrieved(
+    first: Dict[str, List[dict]], second: Dict[str, List[dict]]
+) -> Dict[str, List[dict]]:
+    """
+    Merge the records retrieved per collection removing the duplicates
+
+    Args:
+        first(Dict[str, List[dict]]): records per collection
+        second(Dict[str, List[dict]]): records per collection to add
+
+    Returns:
+        merged(Dict[str, List[dict]]): records per collection sorted from the closest
+    """
+    merged = {}
+    for c in list(dict.fromkeys([*first.keys(), *second.keys()])):
+        merged[c] = merge_records(first.get(c, []) + second.get(c, []))
+    return merged
+
+
+def new_records(records: List[dict], known: List[dict]) -> List[dict]:
+    """
+    Records whose text is not in the known records
+
+    Args:
+        records(List[dict]): records to filter
+        known(List[dict]): records already seen
+
+    Returns:
+        records(List[dict]): records not seen yet
+    """
+    known_texts = {r["text"] for r in known}
+    return [r for r in records if r["text"] not in known_texts]
+
+
+def vector_records_of(retrieved: Dict[str, List[dict]]) -> List[dict]:
+    """
+    Records of the Vector collections, every collection but Graph
+
+    Args:
+        retrieved(Dict[str, List[dict]]): records per collection
+
+    Returns:
+        records(List[dict]): records of the collections other than Graph
+    """
+    return [r for c, records in retrieved.items() if c != "Graph" for r in records]
+
+
+def searched_collections(collections: List[Any], with_graph: bool) -> List[str]:
+    """
+    Names of the collections searched in "both" mode
+
+    Args:
+        collections(List[Any]): collections of the Chroma client
+        with_graph(bool): whether the Graph collection is searched
+
+    Returns:
+        collection_names(List[str]): names of the searched collections
+    """
+    return [c.name for c in collections if with_graph or c.name != "Graph"]
+
+
+def revised_only(revised: List[str], user_query: str) -> List[str]:
+    """
+    Revised queries that differ from the user query, the ones left to retrieve after the
+    speculative retrieval of the user query
+
+    Args:
+        revised(List[str]): revised queries
+        user_query(str): question asked by the user
+
+    Returns:
+        queries(List[str]): revised queries not already retrieved
+    """
+    return [q for q in revised if normalize_query(q) != normalize_query(user_query)]
+
+
+def unique_ids(relevant_ids: List[str]) -> List[str]:
+    """
+    Relevant extraction ids without duplicates and empty ids, [""] when none is left
+    """
+    return [i for i in dict.fromkeys(relevant_ids) if i] or [""]
+
+
 class Query:
     """
-    Query class to handle a single user query session
+    Query class to handle the user queries. One instance is shared by all the requests of the server,
+    so the state of a query only lives in the arguments and locals of its calls.
 
     """
 
-    def __init__(self):
-        self.messages = []  # Store all the context for previous messages
-        self.papers = []
-        self.llm = LLM()
-        self.chromadb = Chromadb()
-        self.neo4j = Neo4j()
+    def __init__(
+        self,
+        llm=None,
+        chromadb=None,
+        neo4j=None,
+        semantic_cache=None,
+        id_selector=None,
+        revise_cache=None,
+        embedding_cache=None,
+        router=None,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        """
+        Args:
+            llm: LLM instance, a new one is created if not provided
+            chromadb: Chromadb instance, a new one is created if not provided
+            neo4j: Neo4j instance, a new one is created if not provided
+            semantic_cache: SemanticCache in front of the pipeline, created from the Chromadb
+                embedding model when enabled in the cache config
+            id_selector: IdSelector used when the ids are selected locally
+            revise_cache: SQLiteCache of the revised queries, created when the persistent cache is enabled
+            embedding_cache: SQLiteCache of the query embeddings, created when the persistent cache is enabled
+            router: QueryRouter used when the collection_name is "auto"
+            executor: thread pool shared by the stages running next to the main one
+        """
+        self.llm = llm or LLM()
+        self.chromadb = chromadb or Chromadb()
+        self.neo4j = neo4j or Neo4j()
+        self.id_selector = id_selector or IdSelector()
+        self.semantic_cache = semantic_cache
+        if self.semantic_cache is None and cache_config.SEMANTIC_CACHE_ENABLED:
+            self.semantic_cache = SemanticCache(
+                embedding_model=self.chromadb.embedding_model
+            )
+        self.revise_cache = revise_cache
+        self.embedding_cache = embedding_cache
+        if cache_config.PERSISTENT_CACHE_ENABLED:
+            self.revise_cache = self.revise_cache or SQLiteCache(
+                namespace="revise_query",
+                ttl_seconds=cache_config.REVISE_CACHE_TTL_SECONDS,
+            )
+            self.embedding_cache = self.embedding_cache or SQLiteCache(
+                namespace="query_embeddings",
+                max_entries=cache_config.EMBEDDING_CACHE_MAX_ENTRIES,
+            )
+        self.router = router or QueryRouter(encoder=self.encode)
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=config.EXECUTOR_MAX_WORKERS, thread_name_prefix="query"
+        )
 
-    def query(self, user_query: str, collection_name: str = "") -> str:
+    def query(
+        self,
+        user_query: str,
+        collection_name: str = "",
+        fan_out: bool = True,
+        speculative: bool = False,
+        deadline_seconds: Optional[float] = None,
+    ) -> str:
         """
         function to query the LLM
         Args:
             user_query(str): question to ask to the LLM
-            collection_name(str): Collection name to query from. Set to none to query for all.
+            collection_name(str): Collection name to query from. Set to none to query for all,
+                "auto" lets the router pick the retrieval paths of the question
+            fan_out(bool): In "both" mode retrieve all (revised query x collection) pairs concurrently
+                with a single batched encode and one query per collection
+            speculative(bool): In "both" mode start retrieval on the raw user_query while revise_query
+                is in flight, and only run the retrievals the revised queries add
+            deadline_seconds(Optional[float]): time allowed to the query, split into the budgets of
+                its stages, DEADLINE_SECONDS by default and 0 for none. When the graph stage runs out of budget the
+                answer is generated from the Vector context alone.
         Returns:
             Answer from the LLM
         """
-        revised_query = json.loads(self.llm.revise_query(query=user_query))
-        output = ""
-        available_collections = [c.name for c in self.chromadb.list_collections()]
-        if collection_name.lower() == "both":
-            overall_context = {"Vector": [], "Graph": []}
-            for c in available_collections:
-                similar_chunks = set()
-                for query in revised_query:
-                    similar = self.chromadb.retrieve_similar_chunks(
-                        query=query, collection_name=c, top_k=10
+        with track_stage("query"):
+            embedding = None
+            if self.semantic_cache:
+                embedding = self.semantic_cache.embed(user_query)
+                cached = self.semantic_cache.get(embedding, collection_name, user_query)
+                record_cache("semantic", hit=cached is not None)
+                if cached is not None:
+                    return cached
+
+            deadline = query_deadline(deadline_seconds)
+            output = self._query(
+                user_query=user_query,
+                collection_name=collection_name,
+                fan_out=fan_out,
+                speculative=speculative,
+                deadline=deadline,
+            )
+            # a degraded answer is not kept, the next ask may have the time for the full context
+            if self.semantic_cache and not deadline.degraded:
+                self.semantic_cache.put(embedding, collection_name, output, user_query)
+            return output
+
+    def _query(
+        self,
+        user_query: str,
+        collection_name: str,
+        fan_out: bool,
+        speculative: bool,
+        deadline: Deadline,
+    ) -> str:
+        """
+        Run the retrieval and answer pipeline for the query, see query for the arguments
+        """
+        context = self.context(
+            user_query=user_query,
+            collection_name=collection_name,
+            fan_out=fan_out,
+            speculative=speculative,
+            deadline=deadline,
+        )
+        return self.answer(
+            context=context, user_query=user_query, timeout=answer_timeout(deadline)
+        )
+
+    def stream(
+        self,
+        user_query: str,
+        collection_name: str = "",
+        fan_out: bool = True,
+        speculative: bool = False,
+        deadline_seconds: Optional[float] = None,
+    ) -> Iterator[dict]:
+        """
+        Stream the answer of the user query. The retrieved sources are sent first, then the answer token by token.
+        Args:
+            user_query(str): question to ask to the LLM
+            collection_name(str): Collection name to query from
+            fan_out(bool): see query
+            speculative(bool): see query
+            deadline_seconds(Optional[float]): see query
+        Returns:
+            events(Iterator[dict]): {"type": "sources", "sources": ...} followed by {"type": "token", "content": str}
+        """
+        embedding = None
+        if self.semantic_cache:
+            embedding = self.semantic_cache.embed(user_query)
+            cached = self.semantic_cache.get(embedding, collection_name, user_query)
+            record_cache("semantic", hit=cached is not None)
+            if cached is not None:
+                yield {"type": "sources", "sources": [], "cached": True}
+                yield {"type": "token", "content": cached}
+                return
+
+        deadline = query_deadline(deadline_seconds)
+        context = self.context(
+            user_query=user_query,
+            collection_name=collection_name,
+            fan_out=fan_out,
+            speculative=speculative,
+            deadline=deadline,
+        )
+        yield {"type": "sources", "sources": context}
+        tokens = []
+        with track_stage("query_with_context"):
+            for token in self.llm.stream_query_with_context(
+                context=context, query=user_query, timeout=answer_timeout(deadline)
+            ):
+                tokens.append(token)
+                yield {"type": "token", "content": token}
+        if self.semantic_cache and not deadline.degraded:
+            self.semantic_cache.put(
+                embedding, collection_name, "".join(tokens), user_query
+            )
+
+    def query_many(
+        self, user_queries: List[str], collection_name: str = "both"
+    ) -> List[str]:
+        """
+        Answer many questions at once. The (revised) queries are encoded in one call and every collection
+        is searched once for all of them, the neighbors of all the selected ids are fetched in one Neo4j
+        round trip and the answers are generated concurrently.
+
+        Args:
+            user_queries(List[str]): questions to answer
+            collection_name(str): see query
+
+        Returns:
+            answers(List[str]): one answer per question, in the same order
+        """
+        with track_stage("query_many"):
+            answers: List[Optional[str]] = [None] * len(user_queries)
+            embeddings: List[Any] = [None] * len(user_queries)
+            if self.semantic_cache:
+                for i, user_query in enumerate(user_queries):
+                    embeddings[i] = self.semantic_cache.embed(user_query)
+                    answers[i] = self.semantic_cache.get(
+                        embeddings[i], collection_name, user_query
                     )
-                    for s in similar:
-                        similar_chunks.add(s)
-                if c == "Graph":
-                    answer = self.llm.extract_relevant_ids(
-                        context=list(similar_chunks), query=user_query
+                    record_cache("semantic", hit=answers[i] is not None)
+
+            pending = [i for i, answer in enumerate(answers) if answer is None]
+            contexts = self.contexts_many(
+                user_queries=[user_queries[i] for i in pending],
+                collection_name=collection_name,
+            )
+            with ThreadPoolExecutor(
+                max_workers=config.BATCH_MAX_CONCURRENCY, thread_name_prefix="batch"
+            ) as executor:
+                generated = [
+                    submit_in_context(
+                        executor, self.answer, context=c, user_query=user_queries[i]
                     )
+                    for i, c in zip(pending, contexts)
+                ]
+                for i, future in zip(pending, generated):
+                    answers[i] = answer = future.result()
+                    if self.semantic_cache:
+                        self.semantic_cache.put(
+                            embeddings[i], collection_name, answer, user_queries[i]
+                        )
+            return answers
 
-                    context = [""]
-                    if answer:
-                        context = self.neo4j.retrieve_neighbors(nodes=answer)
-                    overall_context["Graph"].extend(context)
-                else:
-                    overall_context["Vector"].extend(list(similar_chunks))
-            output = self.llm.query_with_context(
-                context=overall_context, query=user_query
+    def contexts_many(
+        self, user_queries: List[str], collection_name: str = "both"
+    ) -> List[Any]:
+        """
+        Retrieve the contexts of many questions with batched retrieval, see query_many
+
+        Args:
+            user_queries(List[str]): questions to retrieve the context of
+            collection_name(str): see query
+
+        Returns:
+            contexts(List[Any]): one context per question, in the same order
+        """
+        resolved = self.resolve_collections(
+            user_queries=user_queries, collection_name=collection_name
+        )
+        batched = [i for i, (c, _) in enumerate(resolved) if c.lower() == "both"]
+        contexts: List[Any] = [None] * len(user_queries)
+
+        with ThreadPoolExecutor(
+            max_workers=config.BATCH_MAX_CONCURRENCY, thread_name_prefix="batch"
+        ) as executor:
+            # the questions routed to a single collection take the regular path
+            single = {
+                i: submit_in_context(
+                    executor,
+                    self.context,
+                    user_query=user_queries[i],
+                    collection_name=c,
+                )
+                for i, (c, _) in enumerate(resolved)
+                if c.lower() != "both"
+            }
+            revise_futures = [
+                submit_in_context(executor, self.revise, user_queries[i])
+                for i in batched
+            ]
+            revised = [f.result() for f in revise_futures]
+            available_collections = [c.name for c in self.chromadb.list_collections()]
+            retrieved = self.retrieve_many(
+                query_groups=revised, collection_names=available_collections, top_k=10
             )
-        else:
-            similar_chunks = self.chromadb.retrieve_similar_chunks(
-                query=user_query, collection_name=collection_name, top_k=10
+
+            vector_records, graph_records, id_futures = {}, {}, {}
+            for i, records in zip(batched, retrieved):
+                vector_records[i] = vector_records_of(records)
+                graph_records[i] = self.graph_records_to_expand(
+                    retrieved=records,
+                    vector_records=vector_records[i],
+                    with_graph=resolved[i][1],
+                )
+                if graph_records[i] is not None:
+                    id_futures[i] = submit_in_context(
+                        executor,
+                        self.select_ids,
+                        records=graph_records[i],
+                        user_query=user_queries[i],
+                    )
+            relevant_ids = {i: list(f.result()) for i, f in id_futures.items()}
+            by_id = self.neighbors_batch(
+                [node for ids in relevant_ids.values() for node in ids]
+            )
+
+            for i in batched:
+                contexts[i] = self.batched_context(
+                    vector_records=vector_records[i],
+                    graph_records=graph_records[i],
+                    relevant_ids=relevant_ids.get(i, []),
+                    by_id=by_id,
+                )
+            for i, future in single.items():
+                contexts[i] = future.result()
+        return contexts
+
+    def context(
+        self,
+        user_query: str,
+        collection_name: str,
+        fan_out: bool = True,
+        speculative: bool = False,
+        deadline: Optional[Deadline] = None,
+    ) -> Any:
+        """
+        Retrieve the context used to answer the user query, see query for the arguments
+
+        Returns:
+            context(Any): {"Vector": [...], "Graph": [...]} in "both" mode, otherwise the context of the collection
+        """
+        deadline = deadline or Deadline()
+        collection_name, with_graph = self.resolve_collection(
+            user_query=user_query, collection_name=collection_name
+        )
+        if collection_name == METADATA:
+            return self.metadata_context(user_query=user_query, deadline=deadline)
+        if collection_name.lower() == "both":
+            available_collections = searched_collections(
+                self.chromadb.list_collections(), with_graph
+            )
+            relevant_ids = None
+            if speculative:
+                retrieved, relevant_ids = self.speculative_retrieve(
+                    user_query=user_query,
+                    collection_names=available_collections,
+                    top_k=10,
+                    deadline=deadline,
+                )
+            else:
+                retrieved = self.retrieve(
+                    queries=self.revise(user_query=user_query, deadline=deadline),
+                    collection_names=available_collections,
+                    top_k=10,
+                    fan_out=fan_out,
+                    deadline=deadline,
+                )
+
+            vector_records = vector_records_of(retrieved)
+            graph_records = self.graph_records_to_expand(
+                retrieved=retrieved, vector_records=vector_records
             )
+            graph = None
+            if graph_records is not None:
+                graph = self.bounded_graph_context(
+                    records=graph_records,
+                    user_query=user_query,
+                    relevant_ids=relevant_ids,
+                    deadline=deadline,
+                )
+            return self.graph_stage_context(
+                collection_name=collection_name,
+                vector_records=vector_records,
+                graph_records=graph_records,
+                graph=graph,
+                relevant_ids=relevant_ids,
+            )
+
+        records = self.retrieve(
+            queries=[user_query],
+            collection_names=[collection_name],
+            top_k=10,
+            deadline=deadline,
+        )[collection_name]
+        if collection_name.lower() == "graph":
+            graph = self.bounded_graph_context(
+                records=records, user_query=user_query, deadline=deadline
+            )
+            return self.graph_stage_context(
+                collection_name=collection_name, graph_records=records, graph=graph
+            )
+        return self.build_context(
+            collection_name=collection_name, vector_records=records
+        )
+
+    def resolve_collection(
+        self,
+        user_query: str,
+        collection_name: str,
+        embedding: Optional[List[float]] = None,
+    ) -> Tuple[str, bool]:
+        """
+        Collection to run the query against, the router picks it when collection_name is "auto"
+
+        Args:
+            user_query(str): question asked by the user
+            collection_name(str): requested collection name
+            embedding(Optional[List[float]]): embedding of the question, encoded by the router only
+                when no keyword rule matches
+
+        Returns:
+            collection_name(str): "both", "Graph", "metadata" or the requested collection
+            with_graph(bool): whether the Graph collection is searched in "both" mode
+        """
+        if collection_name.lower() != "auto":
+            return collection_name, True
+        route = self.router.route(user_query=user_query, embedding=embedding)
+        if route == GRAPH:
+            return "Graph", True
+        if route == METADATA:
+            return METADATA, False
+        return "both", route == BOTH
+
+    def resolve_collections(
+        self, user_queries: List[str], collection_name: str
+    ) -> List[Tuple[str, bool]]:
+        """
+        resolve_collection for many questions, the ones no keyword rule routes are encoded together in one batch
+
+        Args:
+            user_queries(List[str]): questions asked by the user
+            collection_name(str): requested collection name
+
+        Returns:
+            resolved(List[Tuple[str, bool]]): collection name and with_graph of every question
+        """
+        if collection_name.lower() != "auto":
+            return [(collection_name, True)] * len(user_queries)
+        embeddings: List[Optional[List[float]]] = [None] * len(user_queries)
+        unruled = [i for i, q in enumerate(user_queries) if self.router.rule(q) is None]
+        if unruled:
+            encoded = self.encode([user_queries[i] for i in unruled])
+            for i, embedding in zip(unruled, encoded):
+                embeddings[i] = embedding
+        return [
+            self.resolve_collection(
+                user_query=q, collection_name=collection_name, embedding=e
+            )
+            for q, e in zip(user_queries, embeddings)
+        ]
+
+    def metadata_context(
+        self, user_query: str, deadline: Optional[Deadline] = None
+    ) -> Any:
+        """
+        Context of a bibliographic question, taken from the Metadata extractions of the Graph collection
+        without any Neo4j lookup. Falls back to the Graph path when no chunk has the class metadata.
+
+        Args:
+            user_query(str): question asked by the user
+            deadline(Optional[Deadline]): deadline of the query
+
+        Returns:
+            context(Any): Metadata chunks
+        """
+        records = self.retrieve(
+            queries=[user_query],
+            collection_names=["Graph"],
+            top_k=10,
+            where={"first_level_class": "Metadata"},
+            deadline=deadline,
+        )["Graph"]
+        if not records:
+            return self.context(
+                user_query=user_query, collection_name="Graph", deadline=deadline
+            )
+        return self.build_context(collection_name=METADATA, vector_records=records)
+
+    def expand_graph(self, vector_records: List[dict]) -> bool:
+        """
+        Whether the graph expansion is worth running in "both" mode.
+        In adaptive mode it is skipped when the Vector records already clear the confidence margin.
+
+        Args:
+            vector_records(List[dict]): records retrieved from the Vector collections
+
+        Returns:
+            expand(bool): True if the Graph path should run
+        """
+        expand = not (
+            config.ADAPTIVE_RETRIEVAL and vector_is_sufficient(vector_records)
+        )
+        record_graph_expansion(expanded=expand)
+        return expand
+
+    def graph_records_to_expand(
+        self,
+        retrieved: Dict[str, List[dict]],
+        vector_records: List[dict],
+        with_graph: bool = True,
+    ) -> Optional[List[dict]]:
+        """
+        Graph records to run the graph stage on in "both" mode
+
+        Args:
+            retrieved(Dict[str, List[dict]]): records per collection
+            vector_records(List[dict]): records of the Vector collections
+            with_graph(bool): whether the question was routed to the Graph path
+
+        Returns:
+            graph_records(Optional[List[dict]]): records of the Graph collection, None when the graph stage is skipped
+        """
+        if "Graph" in retrieved and with_graph and self.expand_graph(vector_records):
+            return retrieved["Graph"]
+        return None
+
+    def graph_stage_context(
+        self,
+        collection_name: str,
+        vector_records: Optional[List[dict]] = None,
+        graph_records: Optional[List[dict]] = None,
+        graph: Optional[Tuple[List[str], List]] = None,
+        relevant_ids: Optional[List[str]] = None,
+    ) -> Any:
+        """
+        Build the context once the graph stage is over
+
+        Args:
+            collection_name(str): "both" or "Graph"
+            vector_records(Optional[List[dict]]): records retrieved from the Vector collections
+            graph_records(Optional[List[dict]]): records the graph stage ran on
+            graph(Optional[Tuple[List[str], List]]): output of graph_context, None when the stage was
+                skipped or ran out of budget
+            relevant_ids(Optional[List[str]]): ids selected ahead of the graph stage
+
+        Returns:
+            context(Any): see build_context
+        """
+        if graph is None:
             if collection_name.lower() == "graph":
-                answer = self.llm.extract_relevant_ids(
-                    context=similar_chunks, query=user_query
+                # answer from the Graph chunks themselves
+                return self.build_context(
+                    collection_name="Vector", vector_records=graph_records
+                )
+            return self.build_context(
+                collection_name=collection_name,
+                vector_records=vector_records,
+                relevant_ids=relevant_ids,
+            )
+        relevant_ids, neighbors = graph
+        return self.build_context(
+            collection_name=collection_name,
+            vector_records=vector_records,
+            graph_records=graph_records,
+            relevant_ids=relevant_ids,
+            neighbors=neighbors,
+        )
+
+    def batched_context(
+        self,
+        vector_records: List[dict],
+        graph_records: Optional[List[dict]],
+        relevant_ids: List[str],
+        by_id: Dict[str, dict],
+    ) -> Any:
+        """
+        Context of one question of contexts_many from the neighbors fetched for all of them
+
+        Args:
+            vector_records(List[dict]): records of the question from the Vector collections
+            graph_records(Optional[List[dict]]): records of the question from the Graph collection
+            relevant_ids(List[str]): ids selected for the question
+            by_id(Dict[str, dict]): output of neighbors_batch
+
+        Returns:
+            context(Any): {"Vector": [...], "Graph": [...]}
+        """
+        return self.build_context(
+            collection_name="both",
+            vector_records=vector_records,
+            graph_records=graph_records,
+            relevant_ids=relevant_ids,
+            neighbors=[by_id.get(node, {"Record": []}) for node in relevant_ids],
+        )
+
+    def build_context(
+        self,
+        collection_name: str,
+        vector_records: Optional[List[dict]] = None,
+        graph_records: Optional[List[dict]] = None,
+        relevant_ids: Optional[List[str]] = None,
+        neighbors: Optional[List] = None,
+    ) -> Any:
+        """
+        Build the context sent to query_with_context. When packing is enabled the items are scored,
+        de-duplicated across sources and packed into the token budget of their source.
+
+        Args:
+            collection_name(str): collection the query is asked against
+            vector_records(Optional[List[dict]]): records retrieved from the Vector collections
+            graph_records(Optional[List[dict]]): records retrieved from the Graph collection
+            relevant_ids(Optional[List[str]]): extraction ids the neighbors were retrieved for
+            neighbors(Optional[List]): output of retrieve_neighbors
+
+        Returns:
+            context(Any): {"Vector": [...], "Graph": [...]} in "both" mode, otherwise the context of the collection
+        """
+        vector_records = vector_records or []
+        neighbors = neighbors or []
+        if not config.CONTEXT_PACKING:
+            context = {
+                "Vector": [r["text"] for r in vector_records],
+                "Graph": neighbors,
+            }
+        else:
+            items = vector_items(vector_records) + graph_items(
+                neighbors=neighbors,
+                relevant_ids=relevant_ids or [],
+                records=graph_records or [],
+            )
+            if config.CONTEXT_DEDUP:
+                items = deduplicate(items)
+            packed = pack_context(
+                items=items,
+                budgets=config.CONTEXT_TOKEN_BUDGET,
+                llm_model=self.llm.model,
+            )
+            dropped_tokens = packed.dropped_tokens
+            for source, tokens in packed.packed_tokens.items():
+                record_context(
+                    source=source,
+                    packed_tokens=tokens,
+                    dropped_tokens=dropped_tokens.get(source, 0),
+                )
+            context = {
+                "Vector": packed.context.get("Vector", []),
+                "Graph": packed.context.get("Graph", []),
+            }
+
+        if collection_name.lower() == "both":
+            return context
+        if collection_name.lower() == "graph":
+            return context["Graph"]
+        return context["Vector"]
+
+    def revise(self, user_query: str, deadline: Optional[Deadline] = None) -> List[str]:
+        """
+        Revise the user query into the queries used for retrieval. When revise_query runs out of
+        its budget the user query is used as is.
+
+        Args:
+            user_query(str): question asked by the user
+            deadline(Optional[Deadline]): deadline of the query
+
+        Returns:
+            revised_query(List[str]): revised queries
+        """
+        with track_stage("revise_query"):
+            cached = self._cached_revision(user_query)
+            if cached:
+                return cached
+            timeout = (deadline or Deadline()).budget(config.DEADLINE_REVISE_FRACTION)
+            revised, parsed = parse_revised_queries(
+                self.llm.revise_query(query=user_query, timeout=timeout), user_query
+            )
+            if parsed:
+                self._store_revision(user_query, revised)
+            return revised
+
+    def _revise_key(self, user_query: str) -> str:
+        """
+        Key of the revised queries, changes with the model and the revise_query prompt
+        """
+        return SQLiteCache.make_key(
+            self.llm.model,
+            self.llm.prompt_hash("revise_query.txt"),
+            normalize_query(user_query),
+        )
+
+    def _cached_revision(self, user_query: str) -> Optional[List[str]]:
+        """
+        Revised queries stored in the persistent cache for the user query
+
+        Args:
+            user_query(str): question asked by the user
+
+        Returns:
+            revised_query(Optional[List[str]]): revised queries, None on a miss
+        """
+        if self.revise_cache is None:
+            return None
+        return self.revise_cache.get(self._revise_key(user_query))
+
+    def _store_revision(self, user_query: str, revised: List[str]) -> None:
+        """
+        Store the revised queries of the user query in the persistent cache
+        """
+        if self.revise_cache is not None:
+            self.revise_cache.set(self._revise_key(user_query), revised)
+
+    def encode(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embeddings of the queries, only the queries missing from the persistent cache are encoded
+
+        Args:
+            queries(List[str]): queries to be encoded
+
+        Returns:
+            embeddings(List[List[float]]): one embedding per query, in the same order
+        """
+        if self.embedding_cache is None:
+            return self.chromadb.encode_queries(queries)
+        model_name = getattr(self.chromadb, "embedding_model_name", "")
+        keys = [SQLiteCache.make_key(model_name, q) for q in queries]
+        embeddings = [self.embedding_cache.get(k) for k in keys]
+        missing = [i for i, e in enumerate(embeddings) if e is None]
+        if missing:
+            encoded = self.chromadb.encode_queries([queries[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.embedding_cache.set(keys[i], embedding)
+        return embeddings
+
+    def retrieve(
+        self,
+        queries: List[str],
+        collection_names: List[str],
+        top_k: int = 10,
+        fan_out: bool = True,
+        where: Optional[dict] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, List[dict]]:
+        """
+        Retrieve the similar records of all the queries from every collection
+
+        Args:
+            queries(List[str]): queries to retrieve the similar records for
+            collection_names(List[str]): collections to search on
+            top_k(int): how many similar records to retrieve per query, in adaptive mode the depth of
+                every query is picked from the distances between ADAPTIVE_TOP_K_MIN and ADAPTIVE_TOP_K_MAX
+            fan_out(bool): batch the queries and search the collections concurrently,
+                otherwise every (query x collection) pair is retrieved one after the other
+            where(Optional[dict]): metadata filter of the records
+            deadline(Optional[Deadline]): deadline of the query, bounds the wait for the collections
+
+        Returns:
+            retrieved(Dict[str, List[dict]]): de-duplicated records (text, distance and metadata)
+                per collection sorted from the closest
+        """
+        per_query = None
+        if config.ADAPTIVE_RETRIEVAL:
+            top_k, per_query = config.ADAPTIVE_TOP_K_MAX, adaptive_depth
+        with track_stage("retrieve_similar_chunks"):
+            if fan_out:
+                retrieved = self.chromadb.fan_out_retrieve_records(
+                    queries=queries,
+                    collection_names=collection_names,
+                    top_k=top_k,
+                    query_embeddings=self.encode(queries),
+                    per_query=per_query,
+                    where=where,
+                    timeout=(deadline or Deadline()).budget(
+                        config.DEADLINE_RETRIEVE_FRACTION
+                    ),
                 )
-                context = [""]
-                if answer:
-                    context = self.neo4j.retrieve_neighbors(nodes=answer)
-                output = self.llm.query_with_context(context=context, query=user_query)
             else:
-                output = self.llm.query_with_context(
-                    context=similar_chunks, query=user_query
+                retrieved = {}
+                for c in collection_names:
+                    records = []
+                    for query in queries:
+                        query_records = self.chromadb.retrieve_similar_records_batch(
+                            query_embeddings=self.encode([query]),
+                            collection_name=c,
+                            top_k=top_k,
+                            where=where,
+                        )[0]
+                        records.extend(
+                            per_query(query_records) if per_query else query_records
+                        )
+                    retrieved[c] = merge_records(records)
+        for c, records in retrieved.items():
+            record_chunks(collection=c, count=len(records))
+        return retrieved
+
+    def retrieve_many(
+        self,
+        query_groups: List[List[str]],
+        collection_names: List[str],
+        top_k: int = 10,
+    ) -> List[Dict[str, List[dict]]]:
+        """
+        Retrieve the similar records of many groups of queries with one encode call and one query per collection
+
+        Args:
+            query_groups(List[List[str]]): queries of every question, e.g. its revised queries
+            collection_names(List[str]): collections to search on
+            top_k(int): see retrieve
+
+        Returns:
+            retrieved(List[Dict[str, List[dict]]]): for every group the de-duplicated records per collection
+                sorted from the closest
+        """
+        per_query = None
+        if config.ADAPTIVE_RETRIEVAL:
+            top_k, per_query = config.ADAPTIVE_TOP_K_MAX, adaptive_depth
+        queries = [q for group in query_groups for q in group]
+        with track_stage("retrieve_similar_chunks"):
+            embeddings = self.encode(queries)
+            with ThreadPoolExecutor(
+                max_workers=max(len(collection_names), 1)
+            ) as executor:
+                futures = {
+                    c: executor.submit(
+                        self.chromadb.retrieve_similar_records_batch,
+                        embeddings,
+                        c,
+                        top_k,
+                    )
+                    for c in collection_names
+                }
+                results = {c: future.result() for c, future in futures.items()}
+
+        output, offset = [], 0
+        for group in query_groups:
+            retrieved = {}
+            for c, per_embedding in results.items():
+                retrieved[c] = merge_records(
+                    [
+                        r
+                        for records in per_embedding[offset : offset + len(group)]
+                        for r in (per_query(records) if per_query else records)
+                    ]
                 )
+                record_chunks(collection=c, count=len(retrieved[c]))
+            output.append(retrieved)
+            offset += len(group)
         return output
+
+    def select_ids(
+        self, records: List[dict], user_query: str, timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Select the extraction ids relevant to the user query from the Graph records.
+        Depending on the config the ids are selected locally from the distances, with the LLM,
+        or locally with the LLM as a fallback when nothing clears the threshold.
+
+        Args:
+            records(List[dict]): similar records retrieved from the Graph collection
+            user_query(str): question asked by the user
+            timeout(Optional[float]): seconds the LLM selection may take
+
+        Returns:
+            relevant_ids(List[str]): relevant extraction ids
+        """
+        with track_stage("extract_relevant_ids"):
+            if config.ID_SELECTION_MODE == "local":
+                relevant_ids = self.id_selector.select(
+                    records=records, user_query=user_query
+                )
+                if relevant_ids or not config.ID_SELECTION_LLM_FALLBACK:
+                    return relevant_ids or [""]
+                logger.info("No id selected locally, falling back to the LLM")
+            return self.llm.extract_relevant_ids(
+                context=[r["text"] for r in records], query=user_query, timeout=timeout
+            )
+
+    def neighbors(
+        self, relevant_ids: List[str], timeout: Optional[float] = None
+    ) -> List:
+        """
+        Expand the relevant extraction ids to their neighbors in the graph
+
+        Args:
+            relevant_ids(List[str]): relevant extraction ids
+            timeout(Optional[float]): seconds the Neo4j lookups may take
+
+        Returns:
+            context(List): neighbors of the relevant nodes
+        """
+        with track_stage("retrieve_neighbors"):
+            return self.neo4j.retrieve_neighbors(nodes=relevant_ids, timeout=timeout)
+
+    def neighbors_batch(self, relevant_ids: List[str]) -> Dict[str, dict]:
+        """
+        Expand the relevant extraction ids of many questions with a single Neo4j fetch
+
+        Args:
+            relevant_ids(List[str]): relevant extraction ids of all the questions
+
+        Returns:
+            neighbors(Dict[str, dict]): neighbors per extraction id
+        """
+        if not any(relevant_ids):
+            return {}
+        with track_stage("retrieve_neighbors"):
+            return self.neo4j.retrieve_neighbors_batch(nodes=relevant_ids)
+
+    def answer(
+        self, context: Any, user_query: str, timeout: Optional[float] = None
+    ) -> str:
+        """
+        Answer the user query from the retrieved context
+
+        Args:
+            context(Any): context retrieved for the user query
+            user_query(str): question asked by the user
+            timeout(Optional[float]): seconds the LLM may take
+
+        Returns:
+            answer(str): answer from the LLM
+        """
+        with track_stage("query_with_context"):
+            return self.llm.query_with_context(
+                context=context, query=user_query, timeout=timeout
+            )
+
+    def speculative_retrieve(
+        self,
+        user_query: str,
+        collection_names: List[str],
+        top_k: int = 10,
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[Dict[str, List[dict]], Optional[List[str]]]:
+        """
+        Retrieve records and relevant Graph ids for the raw user query while revise_query is in flight.
+        Once the revised queries arrive only the queries that differ from the user query are retrieved,
+        and only the Graph records they add are sent to the id selection.
+
+        Args:
+            user_query(str): question asked by the user
+            collection_names(List[str]): collections to search on
+            top_k(int): how many similar records to retrieve per query
+            deadline(Optional[Deadline]): deadline of the query
+
+        Returns:
+            retrieved(Dict[str, List[dict]]): records per collection for the user query and its revisions
+            relevant_ids(Optional[List[str]]): relevant extraction ids, None if there is no Graph collection
+        """
+        deadline = deadline or Deadline()
+        ids_timeout = deadline.budget(config.DEADLINE_GRAPH_FRACTION)
+        revise_future = submit_in_context(
+            self.executor, self.revise, user_query=user_query, deadline=deadline
+        )
+        ids_future = None
+        try:
+            retrieved = self.retrieve(
+                queries=[user_query],
+                collection_names=collection_names,
+                top_k=top_k,
+                deadline=deadline,
+            )
+            if "Graph" in retrieved:
+                ids_future = submit_in_context(
+                    self.executor,
+                    self.select_ids,
+                    records=retrieved["Graph"],
+                    user_query=user_query,
+                    timeout=ids_timeout,
+                )
+
+            missing = revised_only(revise_future.result(), user_query)
+            extra = self.retrieve(
+                queries=missing,
+                collection_names=collection_names,
+                top_k=top_k,
+                deadline=deadline,
+            )
+            new_graph_records = new_records(
+                extra.get("Graph", []), retrieved.get("Graph", [])
+            )
+            merged = merge_retrieved(retrieved, extra)
+
+            relevant_ids = None
+            if ids_future:
+                relevant_ids = list(ids_future.result())
+                if new_graph_records:
+                    logger.info(
+                        f"Revised queries added {len(new_graph_records)} Graph chunks"
+                    )
+                    relevant_ids.extend(
+                        self.select_ids(
+                            records=new_graph_records,
+                            user_query=user_query,
+                            timeout=ids_timeout,
+                        )
+                    )
+                relevant_ids = unique_ids(relevant_ids)
+            return merged, relevant_ids
+        finally:
+            # the calls carry their own timeouts, only the ones still queued are dropped
+            for future in (revise_future, ids_future):
+                if future:
+                    future.cancel()
+
+    def graph_context(
+        self,
+        records: List[dict],
+        user_query: str,
+        relevant_ids: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[List[str], List]:
+        """
+        Select the relevant extraction ids from the Graph records and expand them to their neighbors
+
+        Args:
+            records(List[dict]): similar records retrieved from the Graph collection
+            user_query(str): question asked by the user
+            relevant_ids(Optional[List[str]]): already selected extraction ids, skips the selection
+            timeout(Optional[float]): seconds the selection and the expansion may take together
+
+        Returns:
+            relevant_ids(List[str]): selected extraction ids
+            context(List): neighbors of the relevant nodes, in the order of the ids
+        """
+        stage = Deadline(timeout)
+        if relevant_ids is None:
+            if stage.expired():
+                logger.warning("Graph stage out of time, skipped the id selection")
+                return [""], [""]
+            relevant_ids = self.select_ids(
+                records=records, user_query=user_query, timeout=stage.remaining()
+            )
+        context = [""]
+        if any(relevant_ids):
+            if stage.expired():
+                logger.warning("Graph stage out of time, skipped the graph expansion")
+                return relevant_ids, context
+            context = self.neighbors(
+                relevant_ids=relevant_ids, timeout=stage.remaining()
+            )
+        return relevant_ids, context
+
+    def bounded_graph_context(
+        self,
+        records: List[dict],
+        user_query: str,
+        relevant_ids: Optional[List[str]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Optional[Tuple[List[str], List]]:
+        """
+        graph_context within the graph budget of the deadline
+
+        Args:
+            records(List[dict]): similar records retrieved from the Graph collection
+            user_query(str): question asked by the user
+            relevant_ids(Optional[List[str]]): already selected extraction ids, skips the selection
+            deadline(Optional[Deadline]): deadline of the query
+
+        Returns:
+            graph(Optional[Tuple[List[str], List]]): output of graph_context, None when it ran out of
+                budget and the query has to be answered without it
+        """
+        deadline = deadline or Deadline()
+        budget = deadline.budget(config.DEADLINE_GRAPH_FRACTION)
+        if budget is None:
+            return self.graph_context(
+                records=records, user_query=user_query, relevant_ids=relevant_ids
+            )
+        # graph_context passes the budget to the LLM and Neo4j calls, so the work stops with it
+        future = submit_in_context(
+            self.executor,
+            self.graph_context,
+            records=records,
+            user_query=user_query,
+            relevant_ids=relevant_ids,
+            timeout=budget,
+        )
+        try:
+            return future.result(timeout=budget)
+        except TimeoutError:
+            future.cancel()
+            logger.warning(
+                f"Graph stage ran out of its {budget:.2f}s budget, answering without it"
+            )
+            deadline.degraded = True
+            record_degraded("graph")
+            return None
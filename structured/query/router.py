@@ -0,0 +1,242 @@
+"""
+Local query router that picks the retrieval paths a question needs
+"""
+
+import json
+import logging
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils import record_route
+from . import config
+
+logger = logging.getLogger(__name__)
+
+VECTOR = "vector"
+GRAPH = "graph"
+METADATA = "metadata"
+BOTH = "both"
+
+# The rules only route a question away from the Vector path when its phrasing is unambiguous:
+# "published" or "which year" alone also appear in questions about the content of the papers
+METADATA_PATTERN = re.compile(
+    r"\b(who (wrote|authored|are the authors|is the author)|authors? of|written by|"
+    r"(which|what) journals?|dois?|titles? of|publisher of|affiliations? of|"
+    r"(when|what year|which year) (was|were) (the|this|that|these|those) "
+    r"(paper|papers|study|studies|article|articles) (published|written)|"
+    r"how (do i|to|should i) cite|citations? (of|for))\b"
+)
+GRAPH_PATTERN = re.compile(
+    r"\b(relationships? between|connections? between|compare|comparison|differences? between|"
+    r"which papers|what papers|across (the )?papers|other papers)\b"
+)
+# relations and extraction classes are also asked about the text of a single paper, so these
+# questions keep both paths
+RELATION_PATTERN = re.compile(
+    r"\b(relate[sd]? to|related|connected|linked|influences?|affects?|leads? to|depends? on)\b"
+)
+
+ROUTE_EXAMPLES = {
+    VECTOR: [
+        "What is a flood threshold?",
+        "Explain how storm surge is modeled",
+        "Define sea level rise",
+        "Summarize the findings about rainfall intensity",
+        "Describe the hydrological model used",
+        "What does the study say about groundwater recharge?",
+    ],
+    GRAPH: [
+        "How does land use affect runoff across the studies?",
+        "Which papers use the same dataset?",
+        "What is the relationship between urbanization and flooding?",
+        "Compare the methods used for flood forecasting",
+        "Which study areas share the same limitations?",
+        "What findings are connected to climate change?",
+    ],
+    METADATA: [
+        "Who are the authors of the paper?",
+        "When was the paper published?",
+        "Which journal published the study?",
+        "What is the DOI of the paper?",
+        "List the titles of the papers",
+    ],
+}
+
+
+def load_first_level_classes(
+    path: str = config.FIRST_LEVEL_CLASSES_FILE,
+    version: str = config.FIRST_LEVEL_CLASSES_VERSION,
+) -> List[str]:
+    """
+    Names of the first level classes of the Graph extractions
+
+    Args:
+        path(str): path of first_level_classes.json
+        version(str): version of the classes inside the file
+
+    Returns:
+        classes(List[str]): class names, empty if the file cannot be read
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            classes = json.load(f)[version]
+        return [c["class_name"] if isinstance(c, dict) else c for c in classes]
+    except Exception as e:
+        logger.error(f"Failed to load the first level classes: {e}")
+        return []
+
+
+def load_examples(path: str = config.ROUTER_EXAMPLES_FILE) -> Dict[str, List[str]]:
+    """
+    Labelled questions of each route, the built in examples if no file is configured
+
+    Args:
+        path(str): path of a JSON file mapping each route to its questions
+
+    Returns:
+        examples(Dict[str, List[str]]): questions per route
+    """
+    if not path:
+        return ROUTE_EXAMPLES
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            examples = json.load(f)
+        return {r: q for r, q in examples.items() if r in (VECTOR, GRAPH, METADATA)}
+    except Exception as e:
+        logger.error(
+            f"Failed to load the router examples, using the built in ones: {e}"
+        )
+        return ROUTE_EXAMPLES
+
+
+class QueryRouter:
+    """
+    CPU only router deciding which retrieval paths a question needs.
+    Keyword rules over the question and the first level classes are tried first, then the question is
+    matched to the closest labelled example embedding. Uncertain questions go to both paths.
+    """
+
+    def __init__(
+        self,
+        encoder: Callable[[List[str]], List[List[float]]],
+        examples: Optional[Dict[str, List[str]]] = None,
+        classes: Optional[List[str]] = None,
+        min_similarity: float = config.ROUTER_MIN_SIMILARITY,
+        margin: float = config.ROUTER_MARGIN,
+    ) -> None:
+        """
+        Args:
+            encoder(Callable[[List[str]], List[List[float]]]): embeds a batch of texts, e.g. Chromadb.encode_queries
+            examples(Optional[Dict[str, List[str]]]): labelled questions per route
+            classes(Optional[List[str]]): first level classes of the Graph extractions
+            min_similarity(float): minimum cosine similarity to the closest example
+            margin(float): minimum similarity margin of the best route over the second one
+        """
+        self.encoder = encoder
+        self.examples = examples or load_examples()
+        classes = load_first_level_classes() if classes is None else classes
+        # a question naming an extraction class ("study area", "data sources") may use Graph nodes
+        class_phrases = [
+            c.lower().replace("-", " ") for c in classes if c.lower() != "metadata"
+        ]
+        self.class_pattern = (
+            re.compile(r"\b(" + "|".join(map(re.escape, class_phrases)) + r")\b")
+            if class_phrases
+            else None
+        )
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self._routes: List[str] = []
+        self._example_embeddings: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _load_examples(self) -> None:
+        """
+        Embed the labelled examples once, on the first routed question
+        """
+        with self._lock:
+            if self._example_embeddings is not None:
+                return
+            routes, questions = [], []
+            for route, qs in self.examples.items():
+                routes.extend([route] * len(qs))
+                questions.extend(qs)
+            embeddings = np.asarray(self.encoder(questions), dtype=np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+            self._routes = routes
+            self._example_embeddings = embeddings
+
+    def rule(self, user_query: str) -> Optional[str]:
+        """
+        Route given by the keyword rules
+
+        Args:
+            user_query(str): question asked by the user
+
+        Returns:
+            route(Optional[str]): route, None if no rule matches
+        """
+        text = " ".join(user_query.lower().split())
+        if METADATA_PATTERN.search(text):
+            return METADATA
+        if GRAPH_PATTERN.search(text):
+            return GRAPH
+        if RELATION_PATTERN.search(text):
+            return BOTH
+        if self.class_pattern and self.class_pattern.search(text):
+            return BOTH
+        return None
+
+    def classify(self, embedding: List[float]) -> Optional[str]:
+        """
+        Route of the closest labelled examples
+
+        Args:
+            embedding(List[float]): embedding of the question
+
+        Returns:
+            route(Optional[str]): route, None if the question is not close enough to one route
+        """
+        if not self.examples:
+            return None
+        self._load_examples()
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+        similarities = self._example_embeddings @ query
+        best: Dict[str, float] = {}
+        for route, s in zip(self._routes, similarities):
+            best[route] = max(best.get(route, -1.0), float(s))
+        ranked = sorted(best.items(), key=lambda x: x[1], reverse=True)
+        if ranked[0][1] < self.min_similarity:
+            return None
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < self.margin:
+            return None
+        return ranked[0][0]
+
+    def route(self, user_query: str, embedding: Optional[List[float]] = None) -> str:
+        """
+        Retrieval paths needed by the question
+
+        Args:
+            user_query(str): question asked by the user
+            embedding(Optional[List[float]]): embedding of the question, encoded if not provided
+
+        Returns:
+            route(str): "vector", "graph", "metadata" or "both"
+        """
+        route, method = self.rule(user_query), "rule"
+        if route is None:
+            try:
+                if embedding is None:
+                    embedding = self.encoder([user_query])[0]
+                route, method = self.classify(embedding), "embedding"
+            except Exception as e:
+                logger.error(f"Failed to classify the query: {e}")
+        if route is None:
+            route, method = BOTH, "fallback"
+        record_route(route=route, method=method)
+        logger.info(f"Routed query to {route} ({method})")
+        return route
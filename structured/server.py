@@ -1,22 +1,79 @@
 from fastapi import FastAPI, Query, responses
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import json
 import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 
 
-from query import Query
+from query import AsyncQuery
+from query import config as query_config
+from query.query import normalize_query
+from serving import AdmissionController, Readiness, Rejected, SingleFlight
+from serving import config as serving_config
+from utils import metrics_payload
 
-query_class = Query()
+# built by the lifespan, the queries are rejected with 503 until readiness.ready
+query_class: Optional[AsyncQuery] = None
+readiness = Readiness()
+admission = AdmissionController()
+coalescer = SingleFlight()
+COLLECTION = "auto"
 
 
 class QueryRequest(BaseModel):
     query: str
 
 
-app = FastAPI()
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+
+
+def build_query() -> AsyncQuery:
+    """
+    Load the embedding model and open the clients, blocking so it runs in a thread
+    """
+    return AsyncQuery(
+        executor=ThreadPoolExecutor(
+            max_workers=serving_config.THREAD_POOL_SIZE, thread_name_prefix="query"
+        )
+    )
+
+
+async def start_up() -> None:
+    """
+    Build the query pipeline and warm it up, retrying until it succeeds. /healthz answers meanwhile.
+    """
+    global query_class
+    while True:
+        try:
+            if query_class is None:
+                query_class = await asyncio.to_thread(build_query)
+            timings = await query_class.warm_up(
+                connections=serving_config.WARM_UP_CONNECTIONS
+            )
+            readiness.set_ready(timings)
+            return
+        except Exception as e:
+            readiness.set_failed(e)
+            await asyncio.sleep(serving_config.WARM_UP_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    starting = asyncio.create_task(start_up())
+    yield
+    starting.cancel()
+    if query_class is not None:
+        await query_class.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -44,10 +101,215 @@ async def post_query(request: QueryRequest):
             print("Empty query")
             return {"answer": "Please ask a valid question"}
 
+        readiness.check()
         user_query = request.query
-        COLLECTION = "both"
-        answer = query_class.query(user_query=user_query, collection_name=COLLECTION)
+        answer = await coalescer.run(
+            (normalize_query(user_query), COLLECTION),
+            lambda: answer_query(user_query),
+        )
         return {"answer": answer}
+    except Rejected as e:
+        return rejected_response(e)
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            status_code=504,
+            content={"error": "timeout", "message": "Sorry the query took too long"},
+        )
     except Exception as e:
         print(f"Error occured:{e}")
-        return {"error": e, "message": "Sorry an Error occured"}
+        return {"error": str(e), "message": "Sorry an Error occured"}
+
+
+@app.post("/query/batch")
+async def post_query_batch(request: BatchQueryRequest):
+    """
+    batch entry point for evaluation jobs and tools, answers all the questions with batched
+    retrieval and concurrent LLM calls. The batch takes a single admission slot.
+
+    Args:
+        request: BatchQueryRequest(queries:List[str])
+
+    Returns:
+        response: {"answers": List[str]} in the order of the queries
+    """
+    if len(request.queries) > serving_config.MAX_BATCH_SIZE:
+        return JSONResponse(
+            status_code=413,
+            content={
+                "error": "batch too large",
+                "message": f"Send at most {serving_config.MAX_BATCH_SIZE} queries per batch",
+            },
+        )
+    try:
+        answers = ["Please ask a valid question"] * len(request.queries)
+        asked = [i for i, q in enumerate(request.queries) if q]
+        readiness.check()
+        ticket = await admission.acquire()
+        try:
+            generated = await asyncio.wait_for(
+                query_class.query_many(
+                    user_queries=[request.queries[i] for i in asked],
+                    collection_name=COLLECTION,
+                ),
+                timeout=serving_config.BATCH_TIMEOUT_SECONDS,
+            )
+        finally:
+            ticket.release()
+        for i, answer in zip(asked, generated):
+            answers[i] = answer
+        return {"answers": answers}
+    except Rejected as e:
+        return rejected_response(e)
+    except asyncio.TimeoutError:
+        return JSONResponse(
+            status_code=504,
+            content={"error": "timeout", "message": "Sorry the batch took too long"},
+        )
+    except Exception as e:
+        print(f"Error occured:{e}")
+        return {"error": str(e), "message": "Sorry an Error occured"}
+
+
+@app.post("/query/stream")
+async def post_query_stream(request: QueryRequest):
+    """
+    streaming entry point for the user_query. Sends server sent events, the retrieved sources first
+    and then the tokens of the answer as they are generated, finishing with [DONE]
+
+    Args:
+        request: QueryRequest(query:str)
+
+    Returns:
+        response: text/event-stream of {"type": "sources"|"token"|"error", ...}
+    """
+
+    stream = None
+    if request.query:
+        key = (normalize_query(request.query), COLLECTION)
+        stream = coalescer.stream_in_flight(key)
+        if stream is None:
+            # the slot is taken before the response starts so that a rejection gets its status code
+            try:
+                readiness.check()
+                ticket = await admission.acquire()
+            except Rejected as e:
+                return rejected_response(e)
+            stream = coalescer.start_stream(key, stream_query(request.query, ticket))
+
+    async def events():
+        try:
+            if stream is None:
+                yield sse_event({"type": "sources", "sources": []})
+                yield sse_event(
+                    {"type": "token", "content": "Please ask a valid question"}
+                )
+            else:
+                async for event in stream.subscribe():
+                    yield sse_event(event)
+        except TimeoutError:
+            yield sse_event(
+                {"type": "error", "message": "Sorry the query took too long"}
+            )
+        except Exception as e:
+            print(f"Error occured:{e}")
+            yield sse_event({"type": "error", "message": "Sorry an Error occured"})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def answer_query(user_query: str) -> str:
+    """
+    Answer the query once admitted, shared by the identical concurrent requests
+
+    Args:
+        user_query(str): question asked by the user
+
+    Returns:
+        answer(str): answer of the LLM
+    """
+    ticket = await admission.acquire()
+    try:
+        return await asyncio.wait_for(
+            query_class.query(
+                user_query=user_query,
+                collection_name=COLLECTION,
+                speculative=query_config.SPECULATIVE_RETRIEVAL,
+            ),
+            timeout=serving_config.REQUEST_TIMEOUT_SECONDS,
+        )
+    finally:
+        ticket.release()
+
+
+async def stream_query(user_query: str, ticket) -> AsyncIterator[dict]:
+    """
+    Events of the streamed answer, shared by the identical concurrent requests.
+    The admission slot is held until the answer is complete even if the clients go away.
+
+    Args:
+        user_query(str): question asked by the user
+        ticket(Ticket): admission slot of the query
+
+    Returns:
+        events(AsyncIterator[dict]): events of AsyncQuery.stream
+    """
+    try:
+        async with asyncio.timeout(serving_config.REQUEST_TIMEOUT_SECONDS):
+            async for event in query_class.stream(
+                user_query=user_query,
+                collection_name=COLLECTION,
+                speculative=query_config.SPECULATIVE_RETRIEVAL,
+            ):
+                yield event
+    finally:
+        ticket.release()
+
+
+def rejected_response(error: Rejected) -> JSONResponse:
+    """
+    Response of a query rejected by the admission control
+    """
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"error": error.reason, "message": "Server is busy, please retry"},
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def sse_event(event: dict) -> str:
+    """
+    Format the event as a server sent event
+    """
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+
+@app.get("/healthz")
+async def get_healthz():
+    """
+    Liveness probe, the process is up and its event loop answers
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def get_readyz():
+    """
+    Readiness probe, 503 until the models are loaded and the connection pools are warm
+    """
+    return JSONResponse(
+        status_code=200 if readiness.ready else 503, content=readiness.status()
+    )
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus metrics of the query pipeline and the LLM calls
+    """
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
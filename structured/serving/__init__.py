@@ -0,0 +1,7 @@
+"""
+Entry point for serving package
+"""
+
+from .admission import AdmissionController, Rejected
+from .coalesce import SingleFlight, SharedStream
+from .readiness import Readiness
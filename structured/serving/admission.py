@@ -0,0 +1,109 @@
+"""
+Admission control of the server: a bounded number of queries in flight and a bounded wait queue with a deadline
+"""
+
+import asyncio
+import logging
+import math
+
+from utils import record_admission, set_serving_load
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """
+    Raised when a query is not admitted, carries the HTTP status to answer with
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    Slot held by an admitted query, releasing it more than once is a no-op
+    """
+
+    def __init__(self, controller: "AdmissionController") -> None:
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """
+    Admits at most max_in_flight queries at once. Up to max_queue more wait for a slot for at most
+    queue_timeout seconds, the others are rejected right away so that a slow OpenAI cannot pile requests up.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = config.MAX_IN_FLIGHT,
+        max_queue: int = config.MAX_QUEUE,
+        queue_timeout: float = config.QUEUE_TIMEOUT_SECONDS,
+    ) -> None:
+        """
+        Args:
+            max_in_flight(int): queries running concurrently
+            max_queue(int): queries waiting for a slot
+            queue_timeout(float): seconds a query waits for a slot before it is rejected
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    def _update_load(self) -> None:
+        set_serving_load(in_flight=self.in_flight, queued=self.queued)
+
+    async def acquire(self) -> Ticket:
+        """
+        Wait for a slot
+
+        Returns:
+            ticket(Ticket): slot to release once the query is answered
+
+        Raises:
+            Rejected: 429 if the queue is full, 503 if no slot frees up before the queue timeout
+        """
+        retry_after = max(1, math.ceil(self.queue_timeout))
+        if not self._semaphore.locked():
+            # a free slot is taken without yielding to the event loop
+            await self._semaphore.acquire()
+        elif self.queued >= self.max_queue:
+            record_admission("rejected_queue_full")
+            raise Rejected(429, "Too many queries waiting", retry_after)
+        else:
+            self.queued += 1
+            self._update_load()
+            try:
+                await asyncio.wait_for(
+                    self._semaphore.acquire(), timeout=self.queue_timeout
+                )
+            except asyncio.TimeoutError:
+                record_admission("rejected_timeout")
+                raise Rejected(503, "Timed out waiting for a free slot", retry_after)
+            finally:
+                self.queued -= 1
+                self._update_load()
+
+        self.in_flight += 1
+        self._update_load()
+        record_admission("admitted")
+        return Ticket(self)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._update_load()
+        self._semaphore.release()
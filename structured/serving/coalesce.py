@@ -0,0 +1,138 @@
+"""
+Single-flight coalescing: concurrent requests for the same key share one in-flight computation or stream
+"""
+
+import asyncio
+import logging
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+)
+
+from utils import record_coalesced
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStream:
+    """
+    Stream consumed once by a background task and replayed to every subscriber.
+    A subscriber joining late first receives the events already produced.
+    """
+
+    def __init__(self, source: AsyncIterator[dict]) -> None:
+        """
+        Args:
+            source(AsyncIterator[dict]): events to share, consumed even if every subscriber goes away
+        """
+        self.events: List[dict] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[dict]) -> None:
+        try:
+            async for event in source:
+                self.events.append(event)
+                async with self._changed:
+                    self._changed.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[dict]:
+        """
+        Events of the stream from the first one
+
+        Returns:
+            events(AsyncIterator[dict]): events, raises the error of the source if it failed
+        """
+        i = 0
+        while True:
+            if i < len(self.events):
+                yield self.events[i]
+                i += 1
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            async with self._changed:
+                await self._changed.wait_for(lambda: i < len(self.events) or self.done)
+
+
+class SingleFlight:
+    """
+    Keeps the in-flight computations and streams by key so that identical concurrent requests join them.
+    The computation runs in its own task, a request that gives up does not cancel it for the others.
+    """
+
+    def __init__(self, enabled: bool = config.COALESCE_REQUESTS) -> None:
+        """
+        Args:
+            enabled(bool): if False every request runs its own computation
+        """
+        self.enabled = enabled
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, SharedStream] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Result of func, shared with the concurrent calls of the same key
+
+        Args:
+            key(Hashable): identity of the computation
+            func(Callable[[], Awaitable[Any]]): starts the computation, only called if none is in flight
+
+        Returns:
+            result(Any): result of the computation, raises its exception if it failed
+        """
+        if not self.enabled:
+            return await func()
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            record_coalesced("query")
+        return await asyncio.shield(task)
+
+    def stream_in_flight(self, key: Hashable) -> Optional[SharedStream]:
+        """
+        Stream of the key that is still producing events, None if there is none
+        """
+        if not self.enabled:
+            return None
+        stream = self._streams.get(key)
+        if stream is not None:
+            record_coalesced("stream")
+        return stream
+
+    def start_stream(self, key: Hashable, source: AsyncIterator[dict]) -> SharedStream:
+        """
+        Start sharing the stream of the key
+
+        Args:
+            key(Hashable): identity of the stream
+            source(AsyncIterator[dict]): events of the stream
+
+        Returns:
+            stream(SharedStream): stream to subscribe to
+        """
+        stream = SharedStream(source)
+        if self.enabled:
+            self._streams[key] = stream
+            stream.task.add_done_callback(lambda _: self._streams.pop(key, None))
+        return stream
@@ -0,0 +1,29 @@
+"""
+This is config file from where we manage all the variables to be used in the serving folder
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Queries answered concurrently by one server process
+MAX_IN_FLIGHT = int(os.getenv("SERVING_MAX_IN_FLIGHT", "8"))
+# Queries waiting for a free slot, the next ones are rejected with 429
+MAX_QUEUE = int(os.getenv("SERVING_MAX_QUEUE", "32"))
+# Seconds a query may wait for a slot before it is rejected with 503
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("SERVING_QUEUE_TIMEOUT_SECONDS", "10"))
+# Seconds a query may run once admitted before it is answered with 504
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("SERVING_REQUEST_TIMEOUT_SECONDS", "60"))
+# Questions accepted by one /query/batch request and seconds the batch may run once admitted
+MAX_BATCH_SIZE = int(os.getenv("SERVING_MAX_BATCH_SIZE", "256"))
+BATCH_TIMEOUT_SECONDS = float(os.getenv("SERVING_BATCH_TIMEOUT_SECONDS", "900"))
+# Threads running the blocking parts of the pipeline (Chroma, SentenceTransformer, SQLite)
+THREAD_POOL_SIZE = int(os.getenv("SERVING_THREAD_POOL_SIZE", "16"))
+# Connections opened in the Neo4j and OpenAI pools before the server reports ready
+WARM_UP_CONNECTIONS = int(os.getenv("SERVING_WARM_UP_CONNECTIONS", "4"))
+# Seconds between two attempts when the start up fails
+WARM_UP_RETRY_SECONDS = float(os.getenv("SERVING_WARM_UP_RETRY_SECONDS", "5"))
+
+# Share one computation between the concurrent requests of the same normalized query
+COALESCE_REQUESTS = os.getenv("SERVING_COALESCE_REQUESTS", "true").lower() == "true"
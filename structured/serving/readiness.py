@@ -0,0 +1,66 @@
+"""
+Start up state of the server, reported by /readyz so that no traffic is routed to a cold server
+"""
+
+import logging
+import math
+import time
+from typing import Dict, Optional
+
+from .admission import Rejected
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Ready once the models are loaded and the connection pools are warm. Until then the queries
+    are rejected with 503 and a Retry-After.
+    """
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.started_at = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+
+    def set_ready(self, timings: Dict[str, float]) -> None:
+        """
+        Args:
+            timings(Dict[str, float]): seconds taken to warm up each component
+        """
+        self.ready = True
+        self.error = None
+        self.timings = timings
+        self.ready_after = time.monotonic() - self.started_at
+        logger.info(f"Server ready after {self.ready_after:.2f}s")
+
+    def set_failed(self, error: Exception) -> None:
+        """
+        Args:
+            error(Exception): reason why the start up failed, it is retried
+        """
+        self.error = str(error)
+        logger.error(f"Start up failed, retrying: {error}")
+
+    def check(self) -> None:
+        """
+        Raise Rejected with 503 while the server is starting
+        """
+        if not self.ready:
+            raise Rejected(503, "starting", math.ceil(config.WARM_UP_RETRY_SECONDS))
+
+    def status(self) -> dict:
+        """
+        Returns:
+            status(dict): body of /readyz
+        """
+        if self.ready:
+            return {
+                "status": "ready",
+                "ready_after": self.ready_after,
+                "timings": self.timings,
+            }
+        return {"status": "starting", "error": self.error}
@@ -0,0 +1,130 @@
+"""
+Shared setup of the tests, run from the structured folder with python -m pytest tests
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+# the packages are imported from the structured folder, as main.py and server.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# no OpenAI key, SQLite files or embedding model needed by the unit tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["PERSISTENT_CACHE_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+
+# words of the fake embedding space, one axis each
+VOCAB = [
+    "flood",
+    "threshold",
+    "sea",
+    "level",
+    "hurricane",
+    "gulf",
+    "rainfall",
+    "runoff",
+    "authors",
+    "model",
+]
+
+
+def embed(text: str) -> np.ndarray:
+    """
+    Normalized bag of words of the text over VOCAB, close texts share words
+    """
+    words = text.lower().split()
+    vector = np.array([words.count(w) for w in VOCAB] + [0.1], dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class WhitespaceEncoding:
+    def encode(self, text, **kwargs):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def whitespace_tokens(monkeypatch):
+    """
+    Count tokens by words so that no test needs tiktoken to download its encodings
+    """
+    import utils.tokenCount
+
+    monkeypatch.setattr(
+        utils.tokenCount, "get_encoding", lambda llm_model="": WhitespaceEncoding()
+    )
+
+
+class FakeEmbeddingModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return np.stack([embed(t) for t in texts])
+
+
+class FakeCollection:
+    """
+    Chroma collection answering with the squared L2 distances of the fake embeddings
+    """
+
+    def __init__(self, name, texts, delay=0.0):
+        self.name = name
+        self.records = [
+            {"text": t, "source": f"{name}.md", "chunk_id": f"{name}{i}"}
+            for i, t in enumerate(texts)
+        ]
+        self.delay = delay
+        self.queries = 0
+
+    def query(self, query_embeddings, n_results, include=None, where=None):
+        self.queries += 1
+        time.sleep(self.delay)
+        records = [
+            r
+            for r in self.records
+            if not where or all(r.get(k) == v for k, v in where.items())
+        ]
+        out = {"metadatas": [], "distances": []}
+        for q in query_embeddings:
+            scored = sorted(
+                (float(np.sum((embed(r["text"]) - np.asarray(q)) ** 2)), i)
+                for i, r in enumerate(records)
+            )[:n_results]
+            out["metadatas"].append([dict(records[i]) for _, i in scored])
+            out["distances"].append([d for d, _ in scored])
+        return out
+
+
+class FakeChromaClient:
+    def __init__(self):
+        self.collections = {}
+
+    def get_collection(self, name):
+        return self.collections[name]
+
+    def list_collections(self):
+        return list(self.collections.values())
+
+
+@pytest.fixture
+def fake_chroma(monkeypatch):
+    """
+    Chromadb on an in-memory client and the bag of words embedding model, add collections with
+    fake_chroma.chroma_client.collections[name] = FakeCollection(name, texts)
+    """
+    import database.chromadb
+
+    client = FakeChromaClient()
+    model = FakeEmbeddingModel()
+    monkeypatch.setattr(
+        database.chromadb.chromadb, "PersistentClient", lambda path: client
+    )
+    monkeypatch.setattr(database.chromadb, "get_embedding_model", lambda: model)
+    chroma = database.chromadb.Chromadb()
+    yield chroma
+    chroma.executor.shutdown(wait=False)
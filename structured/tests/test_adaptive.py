@@ -0,0 +1,82 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from query import config as query_config
+from query.adaptive import adaptive_depth, vector_is_sufficient
+from query.query import Query
+from conftest import FakeCollection
+
+
+def records(*distances):
+    return [{"text": str(d), "distance": d} for d in distances]
+
+
+def test_a_clear_match_keeps_the_minimum_depth():
+    kept = adaptive_depth(records(0.1, 0.9, 1.0, 1.1), k_min=2, k_max=4, margin=0.3)
+
+    assert [r["distance"] for r in kept] == [0.1, 0.9]
+
+
+def test_many_close_matches_keep_up_to_the_maximum_depth():
+    kept = adaptive_depth(records(0.1, 0.2, 0.3, 0.35), k_min=1, k_max=3, margin=0.3)
+
+    assert [r["distance"] for r in kept] == [0.1, 0.2, 0.3]
+
+
+def test_no_records_keep_nothing():
+    assert adaptive_depth([], k_min=3) == []
+
+
+def test_vector_is_sufficient_with_enough_strong_hits():
+    assert vector_is_sufficient(records(0.1, 0.2, 0.9), max_distance=0.5, min_hits=2)
+    assert not vector_is_sufficient(records(0.1, 0.9), max_distance=0.5, min_hits=2)
+
+
+# same embedding as the query, only words outside the vocabulary differ
+CLOSE = [
+    "flood threshold",
+    "flood threshold map",
+    "flood threshold chart",
+    "flood threshold rule",
+]
+
+
+@pytest.fixture
+def query(fake_chroma, monkeypatch):
+    monkeypatch.setattr(query_config, "ADAPTIVE_RETRIEVAL", True)
+    fake_chroma.chroma_client.collections = {
+        "Vector": FakeCollection("Vector", CLOSE + ["hurricane gulf"]),
+        "Graph": FakeCollection("Graph", ["flood model"]),
+    }
+    llm = Mock(model="gpt-4o")
+    llm.revise_query.return_value = json.dumps(["flood threshold"])
+    return Query(
+        llm=llm,
+        chromadb=fake_chroma,
+        neo4j=Mock(),
+        id_selector=Mock(),
+        router=Mock(),
+    )
+
+
+def test_retrieve_drops_the_records_beyond_the_margin(query):
+    retrieved = query.retrieve(["flood threshold"], ["Vector"])
+
+    # more than ADAPTIVE_TOP_K_MIN close records are kept, the far one is dropped
+    assert sorted(r["text"] for r in retrieved["Vector"]) == sorted(CLOSE)
+
+
+def test_strong_vector_records_skip_the_graph_expansion(query):
+    context = query.context(user_query="flood threshold", collection_name="both")
+
+    query.id_selector.select.assert_not_called()
+    query.neo4j.retrieve_neighbors.assert_not_called()
+    assert context["Graph"] == []
+
+
+def test_the_graph_expansion_runs_without_adaptive_retrieval(query, monkeypatch):
+    monkeypatch.setattr(query_config, "ADAPTIVE_RETRIEVAL", False)
+
+    assert query.expand_graph(records(0.0, 0.0, 0.0))
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from serving.admission import AdmissionController, Rejected
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_free_slots_are_admitted_and_released_once():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=2, max_queue=0)
+        first = await controller.acquire()
+        await controller.acquire()
+        assert controller.in_flight == 2
+        first.release()
+        first.release()
+        return controller.in_flight
+
+    assert run(scenario()) == 1
+
+
+def test_a_full_queue_is_rejected_with_429():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=0)
+        await controller.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        return rejected.value
+
+    rejected = run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+
+
+def test_a_queued_query_times_out_with_503():
+    async def scenario():
+        controller = AdmissionController(
+            max_in_flight=1, max_queue=1, queue_timeout=0.05
+        )
+        await controller.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        return rejected.value.status_code, controller.queued
+
+    assert run(scenario()) == (503, 0)
+
+
+def test_a_queued_query_gets_the_released_slot():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=1)
+        ticket = await controller.acquire()
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.queued == 1
+        ticket.release()
+        await waiting
+        return controller.in_flight, controller.queued
+
+    assert run(scenario()) == (1, 0)
@@ -0,0 +1,56 @@
+import asyncio
+from unittest.mock import Mock
+
+import pytest
+
+from llm import AsyncLLM, LLM
+from query import config as query_config
+from query.async_query import AsyncQuery
+from query.query import Query
+from conftest import FakeCollection
+
+
+@pytest.fixture
+def chroma(fake_chroma):
+    fake_chroma.chroma_client.collections = {
+        "Vector": FakeCollection("Vector", ["flood threshold sea level"]),
+    }
+    return fake_chroma
+
+
+def test_async_query_keeps_every_argument_of_query(chroma):
+    revise_cache, embedding_cache, router = Mock(), Mock(), Mock()
+
+    query = AsyncQuery(
+        llm=Mock(),
+        chromadb=chroma,
+        neo4j=Mock(),
+        id_selector=Mock(),
+        revise_cache=revise_cache,
+        embedding_cache=embedding_cache,
+        router=router,
+    )
+
+    assert query.revise_cache is revise_cache
+    assert query.embedding_cache is embedding_cache
+    assert query.router is router
+    query.executor.shutdown(wait=False)
+
+
+def test_async_query_builds_the_same_context_as_query(chroma, monkeypatch):
+    monkeypatch.setattr(query_config, "ADAPTIVE_RETRIEVAL", False)
+    sync = Query(llm=Mock(), chromadb=chroma, neo4j=Mock(), id_selector=Mock())
+    query = AsyncQuery(llm=Mock(), chromadb=chroma, neo4j=Mock(), id_selector=Mock())
+
+    context = asyncio.run(query.context(user_query="flood", collection_name="Vector"))
+
+    assert context == sync.context(user_query="flood", collection_name="Vector")
+    query.executor.shutdown(wait=False)
+    sync.executor.shutdown(wait=False)
+
+
+def test_async_llm_has_only_the_query_methods():
+    assert not hasattr(AsyncLLM, "generate_ontology")
+    assert not hasattr(AsyncLLM, "submit_batch")
+    assert not issubclass(AsyncLLM, LLM)
+    assert AsyncLLM._parse_relevant_ids is LLM._parse_relevant_ids
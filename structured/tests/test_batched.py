@@ -0,0 +1,130 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from query import config as query_config
+from query.async_query import AsyncQuery
+from query.query import Query
+from query.router import BOTH, GRAPH
+from conftest import FakeCollection
+
+QUESTIONS = ["flood", "hurricane gulf"]
+
+
+class FakeLLM:
+    model = "gpt-4o"
+
+    def revise_query(self, query, timeout=None):
+        return json.dumps([query])
+
+
+class FakeAsyncLLM(FakeLLM):
+    async def revise_query(self, query, timeout=None):
+        return json.dumps([query])
+
+
+class FirstChunkSelector:
+    def select(self, records, user_query):
+        return [records[0]["chunk_id"]] if records else []
+
+
+def neighbors_of(nodes):
+    return {
+        node: {"Node": {"content": f"content of {node}", "evidence": "table 1"}}
+        for node in nodes
+    }
+
+
+@pytest.fixture
+def chroma(fake_chroma):
+    fake_chroma.chroma_client.collections = {
+        "Vector": FakeCollection("Vector", ["flood threshold sea level", "hurricane"]),
+        "Graph": FakeCollection("Graph", ["flood model", "authors", "hurricane gulf"]),
+    }
+    return fake_chroma
+
+
+@pytest.fixture(autouse=True)
+def local_selection(monkeypatch):
+    monkeypatch.setattr(query_config, "ADAPTIVE_RETRIEVAL", False)
+    monkeypatch.setattr(query_config, "ID_SELECTION_MODE", "local")
+
+
+def make(cls, llm, chroma, neo4j, router=None):
+    return cls(
+        llm=llm,
+        chromadb=chroma,
+        neo4j=neo4j,
+        id_selector=FirstChunkSelector(),
+        router=router or Mock(),
+    )
+
+
+def test_contexts_many_encodes_once_and_fetches_the_neighbors_once(chroma):
+    neo4j = Mock()
+    neo4j.retrieve_neighbors_batch.side_effect = neighbors_of
+    query = make(Query, FakeLLM(), chroma, neo4j)
+
+    contexts = query.contexts_many(user_queries=QUESTIONS, collection_name="both")
+
+    assert chroma.embedding_model.calls == [QUESTIONS]
+    assert [c.queries for c in chroma.chroma_client.collections.values()] == [1, 1]
+    neo4j.retrieve_neighbors_batch.assert_called_once_with(nodes=["Graph0", "Graph2"])
+    assert "flood threshold sea level" in contexts[0]["Vector"]
+    assert "hurricane" in contexts[1]["Vector"]
+    assert any("content of Graph2" in item for item in contexts[1]["Graph"])
+
+
+def test_async_contexts_many_matches_query(chroma):
+    neo4j = Mock()
+    neo4j.retrieve_neighbors_batch.side_effect = neighbors_of
+    async_neo4j = AsyncMock()
+    async_neo4j.retrieve_neighbors_batch.side_effect = neighbors_of
+    sync = make(Query, FakeLLM(), chroma, neo4j)
+    query = make(AsyncQuery, FakeAsyncLLM(), chroma, async_neo4j)
+
+    expected = sync.contexts_many(user_queries=QUESTIONS, collection_name="both")
+    contexts = asyncio.run(
+        query.contexts_many(user_queries=QUESTIONS, collection_name="both")
+    )
+
+    assert contexts == expected
+
+
+def test_query_many_answers_in_the_order_of_the_questions(chroma):
+    neo4j = Mock()
+    neo4j.retrieve_neighbors_batch.side_effect = neighbors_of
+    llm = FakeLLM()
+    llm.query_with_context = lambda context, query, timeout=None: f"answer {query}"
+    query = make(Query, llm, chroma, neo4j)
+
+    answers = query.query_many(user_queries=QUESTIONS, collection_name="both")
+
+    assert answers == ["answer flood", "answer hurricane gulf"]
+
+
+def test_async_contexts_many_cancels_the_single_contexts_when_batching_fails(chroma):
+    neo4j = AsyncMock()
+
+    async def slow_neighbors(nodes, timeout=None):
+        await asyncio.sleep(10)
+
+    neo4j.retrieve_neighbors.side_effect = slow_neighbors
+    router = Mock()
+    router.route.side_effect = lambda user_query, embedding=None: (
+        GRAPH if user_query == "authors" else BOTH
+    )
+    query = make(AsyncQuery, FakeAsyncLLM(), chroma, neo4j, router=router)
+    query.retrieve_many = Mock(side_effect=RuntimeError("down"))
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await query.contexts_many(
+                user_queries=["authors", "flood"], collection_name="auto"
+            )
+        # the Graph context of the first question does not outlive the call
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
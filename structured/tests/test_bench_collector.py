@@ -0,0 +1,54 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from bench.run import Collector
+from query.async_query import AsyncQuery
+from query.query import submit_in_context
+from utils import add_observer, record_llm_call, remove_observer
+
+USAGE = SimpleNamespace(
+    prompt_tokens=10, completion_tokens=1, prompt_tokens_details=None
+)
+
+
+def call_llm():
+    record_llm_call(method="revise_query", seconds=0.01, usage=USAGE)
+
+
+def test_tokens_of_the_calls_made_in_the_executor_count_for_the_request():
+    collector = Collector()
+    add_observer(collector)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            collector.begin_request()
+            call_llm()
+            submit_in_context(executor, call_llm).result()
+            # a call submitted without the context is only in the totals
+            executor.submit(call_llm).result()
+            tokens = collector.end_request()
+    finally:
+        remove_observer(collector)
+
+    assert tokens == 20
+    assert collector.prompt_tokens == 30
+
+
+def test_the_async_executor_hops_keep_the_request_context():
+    collector = Collector()
+    query = AsyncQuery(
+        llm=Mock(), chromadb=Mock(), neo4j=Mock(), id_selector=Mock(), router=Mock()
+    )
+
+    async def request():
+        collector.begin_request()
+        await query._run_blocking(call_llm)
+        return collector.end_request()
+
+    add_observer(collector)
+    try:
+        assert asyncio.run(request()) == 10
+    finally:
+        remove_observer(collector)
+        query.executor.shutdown(wait=False)
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from serving import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        flight = SingleFlight(enabled=True)
+        results = await asyncio.gather(*(flight.run("key", compute) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(main())
+
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert not flight._calls
+
+
+def test_failure_is_shared_and_not_kept():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    async def main():
+        flight = SingleFlight(enabled=True)
+        results = await asyncio.gather(
+            flight.run("key", fail), flight.run("key", fail), return_exceptions=True
+        )
+        return flight, results
+
+    flight, results = asyncio.run(main())
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert not flight._calls
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        flight = SingleFlight(enabled=True)
+        first = asyncio.ensure_future(flight.run("key", compute))
+        second = asyncio.ensure_future(flight.run("key", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "answer"
+
+
+def test_disabled_runs_every_call():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        flight = SingleFlight(enabled=False)
+        return await asyncio.gather(
+            flight.run("key", compute), flight.run("key", compute)
+        )
+
+    assert sorted(asyncio.run(main())) == [1, 2]
+
+
+def test_late_subscriber_replays_the_stream():
+    async def source():
+        for i in range(3):
+            yield {"token": i}
+            await asyncio.sleep(0.01)
+
+    async def collect(stream):
+        return [event async for event in stream.subscribe()]
+
+    async def main():
+        flight = SingleFlight(enabled=True)
+        stream = flight.start_stream("key", source())
+        first = asyncio.ensure_future(collect(stream))
+        await asyncio.sleep(0.015)
+        joined = flight.stream_in_flight("key")
+        late = await collect(joined)
+        first = await first
+        # the stream leaves the in-flight streams once its pump task is done
+        await stream.task
+        await asyncio.sleep(0)
+        return first, late, flight.stream_in_flight("key")
+
+    first, late, after = asyncio.run(main())
+
+    assert first == late == [{"token": i} for i in range(3)]
+    assert after is None
+
+
+def test_stream_error_reaches_the_subscribers():
+    async def source():
+        yield {"token": 0}
+        raise RuntimeError("broken")
+
+    async def main():
+        stream = SingleFlight(enabled=True).start_stream("key", source())
+        return [event async for event in stream.subscribe()]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
@@ -0,0 +1,111 @@
+from unittest.mock import Mock
+
+from query import config as query_config
+from query.context_packer import (
+    ContextItem,
+    graph_items,
+    pack_context,
+    similarity,
+    vector_items,
+)
+from query.query import Query
+
+
+def item(text, score, source="Vector"):
+    return ContextItem(text=text, source=source, score=score)
+
+
+def test_the_budget_keeps_the_best_items_and_skips_the_ones_that_do_not_fit():
+    packed = pack_context(
+        items=[
+            item("one two three", 0.5),
+            item("one two three four five", 0.9),
+            item("one", 0.1),
+        ],
+        budgets={"Vector": 7},
+    )
+
+    # the 3 token item does not fit after the 5 token one, the 1 token item still does
+    assert packed.context["Vector"] == ["one two three four five", "one"]
+    assert packed.packed_tokens["Vector"] == 6
+    assert packed.dropped_tokens["Vector"] == 3
+
+
+def test_a_source_without_budget_is_not_limited():
+    packed = pack_context(
+        items=[item("a b c", 0.2, "Graph"), item("d e", 0.8, "Graph")],
+        budgets={"Vector": 1},
+    )
+
+    assert packed.context["Graph"] == ["d e", "a b c"]
+    assert packed.dropped_tokens["Graph"] == 0
+
+
+def test_vector_items_are_scored_by_similarity():
+    items = vector_items(
+        [
+            {"text": "flood", "distance": 0.4, "chunk_id": "c1"},
+            {"text": "x", "distance": 3.0},
+        ]
+    )
+
+    assert [i.score for i in items] == [similarity(0.4), 0.0]
+    assert items[0].provenance == ["Vector:c1"]
+
+
+def test_graph_items_decay_from_the_node():
+    neighbors = [
+        {
+            "Node": {"content": "threshold", "evidence": "e"},
+            "Paper": {
+                "paper_id": "P001",
+                "main_theme": "floods",
+                "Key_contributions": "k",
+                "paper_prim_meth": "m",
+            },
+            "Record": [
+                {
+                    "Relationship": None,
+                    "Neighbour": {"Content": "sea level", "Evidence": "e"},
+                }
+            ],
+        }
+    ]
+
+    items = graph_items(
+        neighbors=neighbors,
+        relevant_ids=["P001_EXT_1"],
+        records=[{"extraction_id": "P001_EXT_1", "distance": 0.2, "text": ""}],
+    )
+
+    node, paper, neighbour = items
+    assert node.score == similarity(0.2)
+    assert paper.score == node.score * query_config.GRAPH_PAPER_DECAY
+    assert neighbour.score == node.score * query_config.GRAPH_NEIGHBOR_DECAY
+    assert neighbour.text.startswith("P001_EXT_1 is connected to: sea level")
+
+
+def test_build_context_packs_both_sources_into_their_budgets(monkeypatch):
+    monkeypatch.setattr(query_config, "CONTEXT_PACKING", True)
+    monkeypatch.setattr(query_config, "CONTEXT_DEDUP", False)
+    monkeypatch.setattr(query_config, "CONTEXT_TOKEN_BUDGET", {"Vector": 2, "Graph": 2})
+    query = Query(
+        llm=Mock(model="gpt-4o"),
+        chromadb=Mock(),
+        neo4j=Mock(),
+        id_selector=Mock(),
+        router=Mock(),
+    )
+
+    context = query.build_context(
+        collection_name="both",
+        vector_records=[
+            {"text": "far away chunk", "distance": 1.0},
+            {"text": "close chunk", "distance": 0.1},
+        ],
+    )
+
+    assert context == {"Vector": ["close chunk"], "Graph": []}
+    assert query.build_context(
+        collection_name="Vector", vector_records=[{"text": "a", "distance": 0.1}]
+    ) == ["a"]
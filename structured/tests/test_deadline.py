@@ -0,0 +1,80 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from database.graphdb import cypher_timeout
+from database import config as database_config
+from query.query import Query, query_deadline
+from query import config as query_config
+from utils import Deadline
+
+
+def make_query():
+    return Query(
+        llm=Mock(), chromadb=Mock(), neo4j=Mock(), id_selector=Mock(), router=Mock()
+    )
+
+
+def test_no_deadline_has_no_budget():
+    deadline = Deadline()
+
+    assert deadline.remaining() is None
+    assert deadline.budget(0.5) is None
+    assert not deadline.expired()
+
+
+def test_budget_is_a_fraction_of_the_deadline():
+    deadline = Deadline(10)
+
+    assert deadline.budget(0.25) == pytest.approx(2.5)
+    assert deadline.remaining() <= 10
+
+
+def test_budget_never_goes_past_the_deadline():
+    deadline = Deadline(0.05)
+    time.sleep(0.03)
+
+    assert deadline.budget(1.0) <= 0.02 + 1e-3
+
+
+def test_expired_deadline_has_no_time_left():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+
+    assert deadline.expired()
+    assert deadline.remaining() == 0.0
+    assert deadline.budget(0.5) == 0.0
+
+
+def test_query_deadline():
+    assert query_deadline(None).seconds == query_config.DEADLINE_SECONDS
+    assert query_deadline(0).remaining() is None
+    assert query_deadline(3).seconds == 3
+
+
+def test_cypher_timeout_is_never_zero():
+    assert cypher_timeout(None) is None
+    assert cypher_timeout(0.0) == database_config.CYPHER_MIN_TIMEOUT_SECONDS
+    assert cypher_timeout(2.0) == 2.0
+
+
+def test_graph_context_skips_the_lookups_once_expired():
+    query = make_query()
+    query.select_ids = Mock()
+    query.neighbors = Mock()
+
+    assert query.graph_context(records=[], user_query="q", timeout=0) == ([""], [""])
+    query.select_ids.assert_not_called()
+    query.neighbors.assert_not_called()
+
+
+def test_bounded_graph_context_degrades_when_out_of_budget():
+    query = make_query()
+    query.graph_context = Mock(side_effect=lambda **kwargs: time.sleep(0.5))
+    deadline = Deadline(0.2)
+
+    graph = query.bounded_graph_context(records=[], user_query="q", deadline=deadline)
+
+    assert graph is None
+    assert deadline.degraded
@@ -0,0 +1,56 @@
+from query.context_packer import ContextItem
+from query.dedup import deduplicate
+
+CHUNK = (
+    "the storm surge raised the coastal flood level by two meters in the gulf "
+    "during the hurricane season and the levees of the delta were overtopped"
+)
+
+
+def item(text, score, provenance, source="Vector"):
+    return ContextItem(text=text, source=source, score=score, provenance=provenance)
+
+
+def test_exact_duplicates_keep_the_highest_score_and_merge_provenance():
+    items = [
+        item(CHUNK, 0.4, ["a.md"]),
+        item(CHUNK.upper() + "!", 0.9, ["P001_EXT_001"], source="Graph"),
+    ]
+
+    kept = deduplicate(items)
+
+    assert len(kept) == 1
+    assert kept[0].score == 0.9
+    assert kept[0].provenance == ["P001_EXT_001", "a.md"]
+
+
+def test_distinct_items_are_kept_sorted_by_score():
+    items = [
+        item("groundwater recharge in karst aquifers", 0.2, ["a"]),
+        item("rainfall intensity duration frequency curves", 0.7, ["b"]),
+    ]
+
+    kept = deduplicate(items)
+
+    assert [k.provenance for k in kept] == [["b"], ["a"]]
+
+
+def test_short_fact_inside_a_long_chunk_is_not_a_duplicate():
+    fact = "storm surge raised the coastal flood level"
+    items = [item(fact, 0.9, ["fact"]), item(CHUNK, 0.5, ["chunk"])]
+
+    kept = deduplicate(items)
+
+    assert [k.text for k in kept] == [fact, CHUNK]
+
+
+def test_containment_with_comparable_lengths_keeps_the_longer_copy():
+    longer = CHUNK + " again"
+    items = [item(CHUNK, 0.9, ["short"]), item(longer, 0.5, ["long"], "Graph")]
+
+    kept = deduplicate(items)
+
+    assert len(kept) == 1
+    assert kept[0].text == longer
+    assert kept[0].score == 0.9
+    assert kept[0].provenance == ["short", "long"]
@@ -0,0 +1,120 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from query import config as query_config
+from query.query import Query
+from utils import Deadline
+from conftest import FakeCollection
+
+VECTOR_TEXTS = [
+    "flood threshold sea level",
+    "hurricane gulf",
+    "rainfall runoff model",
+]
+GRAPH_TEXTS = ["flood model", "authors"]
+
+
+@pytest.fixture
+def chroma(fake_chroma):
+    fake_chroma.chroma_client.collections = {
+        "Vector": FakeCollection("Vector", VECTOR_TEXTS),
+        "Graph": FakeCollection("Graph", GRAPH_TEXTS),
+    }
+    return fake_chroma
+
+
+@pytest.fixture
+def query(chroma, monkeypatch):
+    monkeypatch.setattr(query_config, "ADAPTIVE_RETRIEVAL", False)
+    return Query(
+        llm=Mock(), chromadb=chroma, neo4j=Mock(), id_selector=Mock(), router=Mock()
+    )
+
+
+def texts(records):
+    return [r["text"] for r in records]
+
+
+def test_fan_out_encodes_once_and_queries_each_collection_once(chroma):
+    out = chroma.fan_out_retrieve_records(
+        queries=["flood threshold", "hurricane gulf"],
+        collection_names=["Vector", "Graph"],
+        top_k=2,
+    )
+
+    assert chroma.embedding_model.calls == [["flood threshold", "hurricane gulf"]]
+    assert [c.queries for c in chroma.chroma_client.collections.values()] == [1, 1]
+    assert sorted(out) == ["Graph", "Vector"]
+
+
+def test_fan_out_merges_the_queries_sorted_from_the_closest(chroma):
+    out = chroma.fan_out_retrieve_records(
+        queries=["flood threshold", "flood sea level"],
+        collection_names=["Vector"],
+        top_k=2,
+    )
+
+    records = out["Vector"]
+    # both queries retrieve the flood chunk, it is kept once with its closest distance
+    assert texts(records).count("flood threshold sea level") == 1
+    distances = [r["distance"] for r in records]
+    assert distances == sorted(distances)
+    assert records[0]["text"] == "flood threshold sea level"
+
+
+def test_fan_out_applies_per_query_before_merging(chroma):
+    out = chroma.fan_out_retrieve_records(
+        queries=["flood threshold", "hurricane gulf"],
+        collection_names=["Vector"],
+        top_k=3,
+        per_query=lambda records: records[:1],
+    )
+
+    assert texts(out["Vector"]) == ["hurricane gulf", "flood threshold sea level"]
+
+
+def test_fan_out_leaves_the_slow_collection_empty(chroma):
+    chroma.chroma_client.collections["Graph"].delay = 1.0
+    start = time.perf_counter()
+
+    out = chroma.fan_out_retrieve_records(
+        queries=["flood"], collection_names=["Vector", "Graph"], timeout=0.2
+    )
+
+    assert time.perf_counter() - start < 0.8
+    assert out["Graph"] == []
+    assert out["Vector"]
+
+
+def test_fan_out_without_queries(chroma):
+    out = chroma.fan_out_retrieve_records(queries=[], collection_names=["Vector"])
+
+    assert out == {"Vector": []}
+    assert chroma.embedding_model.calls == []
+
+
+def test_retrieve_is_the_same_with_and_without_fan_out(query):
+    queries = ["flood threshold", "rainfall runoff"]
+
+    fanned = query.retrieve(queries, ["Vector", "Graph"], top_k=2, fan_out=True)
+    sequential = query.retrieve(queries, ["Vector", "Graph"], top_k=2, fan_out=False)
+
+    assert fanned == sequential
+
+
+def test_retrieve_without_fan_out_encodes_every_query(query, chroma):
+    query.retrieve(["flood", "gulf"], ["Vector"], fan_out=False)
+
+    assert chroma.embedding_model.calls == [["flood"], ["gulf"]]
+
+
+def test_retrieve_bounds_the_collections_by_the_deadline(query, chroma):
+    chroma.chroma_client.collections["Vector"].delay = 1.0
+    deadline = Deadline(1.0)
+
+    retrieved = query.retrieve(["flood"], ["Vector", "Graph"], deadline=deadline)
+
+    assert retrieved["Vector"] == []
+    assert texts(retrieved["Graph"])[0] == "flood model"
@@ -0,0 +1,77 @@
+from unittest.mock import Mock
+
+from query import config as query_config
+from query.id_selection import IdSelector, record_extraction_id
+from query.query import Query
+
+
+def record(extraction_id, distance, text=""):
+    return {"extraction_id": extraction_id, "distance": distance, "text": text}
+
+
+def test_ids_are_selected_within_the_distance_from_the_closest():
+    selector = IdSelector(max_distance=1.0, max_ids=10, rerank_model="")
+
+    ids = selector.select(
+        records=[
+            record("P001_EXT_2", 0.8),
+            record("P001_EXT_1", 0.3),
+            record("P002_EXT_1", 1.5),
+        ],
+        user_query="flood",
+    )
+
+    assert ids == ["P001_EXT_1", "P001_EXT_2"]
+
+
+def test_ids_are_unique_and_capped():
+    selector = IdSelector(max_distance=1.0, max_ids=2, rerank_model="")
+
+    ids = selector.select(
+        records=[
+            record("P001_EXT_1", 0.1),
+            record("P001_EXT_1", 0.2),
+            record("P001_EXT_2", 0.3),
+            record("P001_EXT_3", 0.4),
+        ],
+        user_query="flood",
+    )
+
+    assert ids == ["P001_EXT_1", "P001_EXT_2"]
+
+
+def test_the_cross_encoder_reorders_the_candidates():
+    selector = IdSelector(max_distance=1.0, max_ids=10, rerank_model="cross-encoder")
+    selector._cross_encoder = Mock(predict=Mock(return_value=[0.1, 0.9]))
+
+    ids = selector.select(
+        records=[record("P001_EXT_1", 0.1), record("P001_EXT_2", 0.2)],
+        user_query="flood",
+    )
+
+    assert ids == ["P001_EXT_2", "P001_EXT_1"]
+
+
+def test_the_extraction_id_is_parsed_from_the_text_of_older_records():
+    assert record_extraction_id({"text": "P012_EXT_7: flood model"}) == "P012_EXT_7"
+    assert record_extraction_id({"text": "no id"}) == ""
+
+
+def test_query_falls_back_to_the_llm_when_nothing_is_selected(monkeypatch):
+    monkeypatch.setattr(query_config, "ID_SELECTION_MODE", "local")
+    monkeypatch.setattr(query_config, "ID_SELECTION_LLM_FALLBACK", True)
+    llm = Mock(extract_relevant_ids=Mock(return_value=["P003_EXT_1"]))
+    query = Query(
+        llm=llm,
+        chromadb=Mock(),
+        neo4j=Mock(),
+        id_selector=IdSelector(max_distance=0.5, rerank_model=""),
+        router=Mock(),
+    )
+
+    far = [record("P001_EXT_1", 0.9, text="flood")]
+    assert query.select_ids(records=far, user_query="flood") == ["P003_EXT_1"]
+
+    monkeypatch.setattr(query_config, "ID_SELECTION_LLM_FALLBACK", False)
+    assert query.select_ids(records=far, user_query="flood") == [""]
+    llm.extract_relevant_ids.assert_called_once()
@@ -0,0 +1,163 @@
+import json
+import os
+
+import pytest
+
+from llm import OntologyRunner, config
+from utils import atomic_write
+
+
+def answer(paper_id):
+    ontology = {"paper_id": paper_id, "extractions": [], "relationships": []}
+    return f"```json\n{json.dumps(ontology)}\n```"
+
+
+class FakeLLM:
+    """
+    Extraction calls of LLM answered locally, batches are answered by self.batches
+    """
+
+    def __init__(self):
+        self.extracted = []
+        self.submitted = []
+        # batch_id -> (status, results)
+        self.batches = {}
+
+    def extract_content(self, file_path):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def extract_ontology(self, system_prompt, file_content, model):
+        self.extracted.append(file_content)
+        return answer(file_content)
+
+    def write_to_output(self, content, file_name, output_folder):
+        atomic_write(
+            os.path.join(output_folder, file_name.split(".")[0] + ".txt"), content
+        )
+        return True
+
+    def ontology_segments(self, file_content):
+        return [file_content]
+
+    def submit_batch(self, requests_path):
+        with open(requests_path, "r", encoding="utf-8") as f:
+            self.submitted.append([json.loads(line)["custom_id"] for line in f])
+        return f"batch_{len(self.submitted)}"
+
+    def wait_for_batch(self, batch_id):
+        return self.batches[batch_id]
+
+
+@pytest.fixture
+def folder(tmp_path):
+    papers = tmp_path / "papers"
+    papers.mkdir()
+    for i in range(3):
+        (papers / f"paper{i}.md").write_text(f"P00{i}")
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("Extract the ontology")
+    return tmp_path
+
+
+def make_runner(llm, folder):
+    return OntologyRunner(
+        llm,
+        system_prompt_path=str(folder / "prompt.txt"),
+        output_folder=str(folder / "out"),
+        output_folder_json=str(folder / "json"),
+    )
+
+
+def state_path(folder):
+    return folder / "out" / config.ONTOLOGY_BATCH_STATE_NAME
+
+
+def test_run_records_every_paper_in_the_manifest(folder):
+    llm = FakeLLM()
+
+    summary = make_runner(llm, folder).run(str(folder / "papers"))
+
+    assert sorted(summary["extracted"]) == ["paper0.md", "paper1.md", "paper2.md"]
+    manifest = json.loads((folder / "out" / config.ONTOLOGY_MANIFEST_NAME).read_text())
+    assert sorted(manifest) == ["paper0.md", "paper1.md", "paper2.md"]
+    assert (
+        json.loads((folder / "json" / "paper1.json").read_text())["paper_id"] == "P001"
+    )
+
+
+def test_rerun_only_extracts_the_changed_papers(folder):
+    make_runner(FakeLLM(), folder).run(str(folder / "papers"))
+    (folder / "papers" / "paper2.md").write_text("P009")
+    llm = FakeLLM()
+
+    summary = make_runner(llm, folder).run(str(folder / "papers"))
+
+    assert summary["extracted"] == ["paper2.md"]
+    assert sorted(summary["skipped"]) == ["paper0.md", "paper1.md"]
+    assert llm.extracted == ["P009"]
+
+
+def test_changed_prompt_extracts_again(folder):
+    make_runner(FakeLLM(), folder).run(str(folder / "papers"))
+    (folder / "prompt.txt").write_text("Extract the ontology, version 2")
+
+    summary = make_runner(FakeLLM(), folder).run(str(folder / "papers"))
+
+    assert len(summary["extracted"]) == 3
+
+
+def test_batch_resumes_after_an_interruption(folder):
+    llm = FakeLLM()
+
+    def interrupted(batch_id):
+        raise KeyboardInterrupt
+
+    llm.wait_for_batch = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        make_runner(llm, folder).run_batch(str(folder / "papers"))
+    assert state_path(folder).exists()
+
+    llm = FakeLLM()
+    llm.batches["batch_1"] = (
+        "completed",
+        {f"paper{i}.md#0": answer(f"P00{i}") for i in range(3)},
+    )
+    summary = make_runner(llm, folder).run_batch(str(folder / "papers"))
+
+    # waited for the batch of the interrupted run instead of submitting again
+    assert llm.submitted == []
+    assert sorted(summary["extracted"]) == ["paper0.md", "paper1.md", "paper2.md"]
+    assert not state_path(folder).exists()
+
+
+def test_resume_after_a_partial_batch_submits_the_missing_papers(folder):
+    llm = FakeLLM()
+    llm.batches["batch_1"] = ("expired", {"paper0.md#0": answer("P000")})
+
+    summary = make_runner(llm, folder).run_batch(str(folder / "papers"))
+
+    assert summary["extracted"] == ["paper0.md"]
+    assert summary["failed"] == ["paper1.md", "paper2.md"]
+    assert json.loads(state_path(folder).read_text())["status"] == "expired"
+
+    llm.batches["batch_2"] = (
+        "completed",
+        {f"paper{i}.md#0": answer(f"P00{i}") for i in (1, 2)},
+    )
+    summary = make_runner(llm, folder).run_batch(str(folder / "papers"))
+
+    assert llm.submitted[1] == ["paper1.md#0", "paper2.md#0"]
+    assert summary["extracted"] == ["paper1.md", "paper2.md"]
+    assert summary["skipped"] == ["paper0.md"]
+    assert not state_path(folder).exists()
+
+
+def test_batch_with_nothing_to_extract_submits_nothing(folder):
+    make_runner(FakeLLM(), folder).run(str(folder / "papers"))
+    llm = FakeLLM()
+
+    summary = make_runner(llm, folder).run_batch(str(folder / "papers"))
+
+    assert llm.submitted == []
+    assert len(summary["skipped"]) == 3
@@ -0,0 +1,111 @@
+import json
+
+from llm.ontology_segments import merge_ontologies, merge_responses, split_sections
+
+
+def extraction(extraction_id, content, keywords, confidence=0.5):
+    return {
+        "extraction_id": extraction_id,
+        "first_level_class": "Methods",
+        "second_level_class": "Model",
+        "extracted_content": content,
+        "keywords": keywords,
+        "confidence_score": confidence,
+    }
+
+
+def relationship(relationship_id, source, target, kind="uses"):
+    return {
+        "relationship_id": relationship_id,
+        "source_extraction_id": source,
+        "target_extraction_id": target,
+        "relationship_type": kind,
+    }
+
+
+SEGMENTS = [
+    {
+        "paper_id": "P007",
+        "paper_summary": {"title": "Floods", "key_contributions": ["a"]},
+        "extractions": [
+            extraction("P007_EXT_001", "HEC-RAS model", ["hec"]),
+            extraction("P007_EXT_002", "Lidar terrain", ["lidar"]),
+        ],
+        "relationships": [relationship("P007_REL_001", "P007_EXT_001", "P007_EXT_002")],
+    },
+    {
+        "paper_id": "P007",
+        "paper_summary": {"key_contributions": ["a", "b"]},
+        "extractions": [
+            # the same node as the first extraction of the first segment
+            extraction("P007_EXT_001", "HEC-RAS  Model", ["ras"], confidence=0.9),
+            extraction("P007_EXT_002", "Gauge records", ["gauge"]),
+        ],
+        "relationships": [
+            relationship("P007_REL_001", "P007_EXT_001", "P007_EXT_002"),
+            relationship("P007_REL_002", "P007_EXT_001", "P007_EXT_001"),
+            relationship("P007_REL_003", "P007_EXT_001", "P007_EXT_009"),
+        ],
+    },
+]
+
+
+def test_merge_renumbers_the_extractions_in_segment_order():
+    merged = merge_ontologies(SEGMENTS)
+
+    assert [e["extraction_id"] for e in merged["extractions"]] == [
+        "P007_EXT_001",
+        "P007_EXT_002",
+        "P007_EXT_003",
+    ]
+    assert merged["extractions"][2]["extracted_content"] == "Gauge records"
+
+
+def test_merge_keeps_a_repeated_node_once():
+    node = merge_ontologies(SEGMENTS)["extractions"][0]
+
+    assert node["keywords"] == ["hec", "ras"]
+    assert node["confidence_score"] == 0.9
+
+
+def test_merge_points_the_relationships_at_the_merged_nodes():
+    relationships = merge_ontologies(SEGMENTS)["relationships"]
+
+    # the self loop and the edge to an unknown node are dropped
+    assert [
+        (r["relationship_id"], r["source_extraction_id"], r["target_extraction_id"])
+        for r in relationships
+    ] == [
+        ("P007_REL_001", "P007_EXT_001", "P007_EXT_002"),
+        ("P007_REL_002", "P007_EXT_001", "P007_EXT_003"),
+    ]
+
+
+def test_merge_combines_the_summaries():
+    summary = merge_ontologies(SEGMENTS)["paper_summary"]
+
+    assert summary == {"title": "Floods", "key_contributions": ["a", "b"]}
+
+
+def test_merge_responses_fails_when_a_segment_has_no_ontology():
+    block = f"```json\n{json.dumps(SEGMENTS[0])}\n```"
+
+    assert merge_responses([block, "no json here"]) == ""
+    assert merge_responses([block]) == block
+
+
+def test_short_paper_is_one_segment():
+    text = "# Title\n\nshort paper"
+
+    assert split_sections(text, max_tokens=1000) == [text]
+
+
+def test_sections_are_split_under_the_limit_with_the_header():
+    sections = [f"## Section {i}\n\n" + "water " * 60 for i in range(4)]
+    text = "Flood paper by Smith\n\n" + "\n\n".join(sections)
+
+    segments = split_sections(text, max_tokens=150)
+
+    assert len(segments) > 1
+    assert all(s.startswith("Flood paper by Smith") for s in segments)
+    assert sum(s.count("## Section") for s in segments) == 4
@@ -0,0 +1,43 @@
+import os
+
+from llm.prompt_registry import PromptRegistry
+
+
+def write(path, content, mtime_ns):
+    path.write_text(content, encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_a_prompt_is_read_once_while_its_file_is_unchanged(tmp_path, monkeypatch):
+    path = tmp_path / "revise_query.txt"
+    write(path, "revise the query", 1_000_000_000)
+    registry = PromptRegistry()
+    assert registry.get(str(path)) == "revise the query"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the prompt was read again")
+
+    monkeypatch.setattr("builtins.open", fail)
+
+    assert registry.get(str(path)) == "revise the query"
+
+
+def test_an_edited_prompt_is_reloaded_with_a_new_hash(tmp_path):
+    path = tmp_path / "revise_query.txt"
+    write(path, "revise the query", 1_000_000_000)
+    registry = PromptRegistry()
+    old_hash = registry.hash(str(path))
+
+    write(path, "revise the question", 2_000_000_000)
+
+    assert registry.get(str(path)) == "revise the question"
+    assert registry.hash(str(path)) != old_hash
+
+
+def test_the_hash_only_depends_on_the_content(tmp_path):
+    first, second = tmp_path / "a.txt", tmp_path / "b.txt"
+    write(first, "same prompt", 1_000_000_000)
+    write(second, "same prompt", 2_000_000_000)
+    registry = PromptRegistry()
+
+    assert registry.hash(str(first)) == registry.hash(str(second))
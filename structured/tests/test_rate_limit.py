@@ -0,0 +1,75 @@
+import email.utils
+import time
+
+import httpx
+import pytest
+from openai import APIConnectionError, APIStatusError
+
+from llm import config
+from llm.rate_limit import RateLimiter, TokenBucket, retry_after, retry_delay
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=REQUEST)
+    return APIStatusError("error", response=response, body=None)
+
+
+def test_bucket_waits_for_the_missing_units():
+    bucket = TokenBucket(per_minute=60)
+
+    assert bucket.wait(1) == 0.0
+    bucket.level = 0
+    assert bucket.wait(1) == pytest.approx(1.0)
+    # more than the bucket holds waits for a full bucket
+    assert bucket.wait(600) == pytest.approx(60.0)
+
+
+def test_bucket_refills_up_to_its_size():
+    bucket = TokenBucket(per_minute=60)
+    bucket.level = 0
+    bucket.refill(bucket.updated_at + 30)
+
+    assert bucket.level == pytest.approx(30)
+    bucket.refill(bucket.updated_at + 600)
+    assert bucket.level == 60
+
+
+def test_unlimited_bucket_never_waits():
+    assert TokenBucket(per_minute=0).wait(10**6) == 0.0
+
+
+def test_reservation_over_max_wait_reserves_nothing():
+    limiter = RateLimiter(rpm=1, tpm=0)
+
+    assert limiter.reserve(tokens=10) == 0.0
+    assert limiter.reserve(tokens=10, max_wait=0.5) is None
+    assert limiter.requests.level == pytest.approx(0, abs=0.01)
+
+
+def test_pause_holds_the_next_calls():
+    limiter = RateLimiter(rpm=0, tpm=0)
+    limiter.pause(5)
+
+    assert limiter.reserve(tokens=1) == pytest.approx(5, abs=0.1)
+
+
+def test_retry_after_headers():
+    assert retry_after(status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(status_error(429, {"retry-after": "7"})) == 7.0
+    assert retry_after(status_error(429, {"retry-after": "soon"})) is None
+    assert retry_after(status_error(429)) is None
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after(status_error(429, {"retry-after": date})) == pytest.approx(
+        30, abs=2
+    )
+
+
+def test_retry_delay():
+    assert retry_delay(status_error(400), attempt=0) is None
+    assert retry_delay(ValueError("bad"), attempt=0) is None
+    assert retry_delay(status_error(429, {"retry-after": "12"}), attempt=0) >= 12
+    backoff = retry_delay(status_error(503), attempt=3)
+    assert 0 <= backoff <= config.OPENAI_BACKOFF_MAX_SECONDS
+    assert retry_delay(APIConnectionError(request=REQUEST), attempt=0) is not None
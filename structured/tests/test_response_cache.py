@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from cache import SQLiteCache
+from llm import AsyncLLM, LLM
+from llm.base import response_caches, response_key
+
+MESSAGES = [{"role": "user", "content": "extract the ids"}]
+
+
+def completion(content):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=3, completion_tokens=1, total_tokens=4),
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLiteCache(
+        namespace="llm:extract_relevant_ids", path=str(tmp_path / "cache.sqlite3")
+    )
+
+
+@pytest.fixture
+def llm(cache):
+    llm = LLM()
+    llm.response_caches = {"extract_relevant_ids": cache}
+    llm.requests = []
+
+    def create(method, timeout, **request):
+        llm.requests.append(request)
+        return completion(f"answer {len(llm.requests)}")
+
+    llm._create = create
+    return llm
+
+
+def test_an_opted_in_method_is_answered_once(llm, cache):
+    first = llm._chat(messages=MESSAGES, method="extract_relevant_ids")
+    second = llm._chat(messages=MESSAGES, method="extract_relevant_ids", timeout=5)
+
+    # the timeout is not part of the key
+    assert first == second == "answer 1"
+    assert len(llm.requests) == 1
+    assert cache.get(response_key(llm.model, MESSAGES, {})) == "answer 1"
+
+
+def test_other_parameters_are_part_of_the_key(llm):
+    llm._chat(messages=MESSAGES, method="extract_relevant_ids")
+    llm._chat(messages=MESSAGES, method="extract_relevant_ids", temperature=0.5)
+
+    assert len(llm.requests) == 2
+
+
+def test_methods_not_opted_in_are_not_cached(llm):
+    llm._chat(messages=MESSAGES, method="query_with_context")
+    llm._chat(messages=MESSAGES, method="query_with_context")
+
+    assert len(llm.requests) == 2
+
+
+def test_a_streamed_call_is_served_from_the_cache(llm):
+    llm._chat(messages=MESSAGES, method="extract_relevant_ids")
+
+    tokens = list(llm._chat_stream(messages=MESSAGES, method="extract_relevant_ids"))
+
+    assert tokens == ["answer 1"]
+    assert len(llm.requests) == 1
+
+
+def test_async_llm_shares_the_cache_of_llm(llm, cache):
+    llm._chat(messages=MESSAGES, method="extract_relevant_ids")
+    async_llm = AsyncLLM()
+    async_llm.response_caches = {"extract_relevant_ids": cache}
+
+    async def create(method, timeout, **request):
+        raise AssertionError("the cached response was requested again")
+
+    async_llm._create = create
+
+    answer = asyncio.run(
+        async_llm._chat(messages=MESSAGES, method="extract_relevant_ids")
+    )
+
+    assert answer == "answer 1"
+
+
+def test_no_response_cache_when_the_persistent_cache_is_disabled():
+    assert response_caches() == {}
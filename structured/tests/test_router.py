@@ -0,0 +1,100 @@
+from unittest.mock import Mock
+
+from query.query import Query
+from query.router import BOTH, GRAPH, METADATA, VECTOR, QueryRouter
+
+EXAMPLES = {VECTOR: ["rainfall"], GRAPH: ["runoff"]}
+
+
+def encode(texts):
+    # one axis per example word, enough for the nearest example classification
+    return [[float("rainfall" in t), float("runoff" in t), 0.1] for t in texts]
+
+
+def make_router(encoder=None):
+    return QueryRouter(
+        encoder=encoder or Mock(side_effect=encode),
+        examples=EXAMPLES,
+        classes=["Study Area", "Metadata"],
+        min_similarity=0.5,
+        margin=0.1,
+    )
+
+
+def test_rules():
+    router = make_router()
+
+    assert router.rule("Who are the AUTHORS of the paper?") == METADATA
+    assert router.rule("When was the paper published?") == METADATA
+    assert router.rule("What is the DOI of the study?") == METADATA
+    assert router.rule("Compare the flood models across the papers") == GRAPH
+    assert router.rule("Summarize the rainfall findings") is None
+
+
+def test_content_questions_are_not_routed_to_metadata():
+    router = make_router()
+
+    assert router.rule("What year did the flood in the study area peak?") != METADATA
+    assert router.rule("What do the published results say about recharge?") is None
+    assert router.rule("Which year had the highest rainfall?") is None
+    assert router.rule("Does the journal paper cite rainfall data?") is None
+
+
+def test_ambiguous_rules_keep_both_paths():
+    router = make_router()
+
+    # a class name or a relation can be answered from the text of the papers too
+    assert router.rule("What is the study area of the paper?") == BOTH
+    assert router.rule("What are the conclusions about the study area?") == BOTH
+    assert router.rule("How does land use affect flooding?") == BOTH
+
+
+def test_rule_routes_without_encoding():
+    router = make_router()
+
+    assert router.route("Which journal published it? doi please") == METADATA
+    router.encoder.assert_not_called()
+
+
+def test_embedding_fallback():
+    router = make_router()
+
+    assert router.route("rainfall totals") == VECTOR
+    assert router.route("runoff volumes") == GRAPH
+    # uncertain questions go to both paths
+    assert router.route("sediment") == BOTH
+
+
+def test_given_embedding_is_not_encoded_again():
+    router = make_router()
+    router.classify([1.0, 0.0, 0.1])
+    router.encoder.reset_mock()
+
+    assert router.route("rainfall totals", embedding=[1.0, 0.0, 0.1]) == VECTOR
+    router.encoder.assert_not_called()
+
+
+def test_resolve_collections_encodes_only_the_unruled_questions_once():
+    query = Query(
+        llm=Mock(), chromadb=Mock(), neo4j=Mock(), id_selector=Mock(), router=None
+    )
+    query.encode = Mock(side_effect=encode)
+    query.router = make_router(encoder=query.encode)
+    query.router.classify([1.0, 0.0, 0.1])
+    query.encode.reset_mock()
+
+    resolved = query.resolve_collections(
+        ["Who wrote it?", "rainfall totals", "runoff volumes"], "auto"
+    )
+
+    assert resolved == [(METADATA, False), ("both", False), ("Graph", True)]
+    query.encode.assert_called_once_with(["rainfall totals", "runoff volumes"])
+
+
+def test_resolve_collections_keeps_an_explicit_collection():
+    query = Query(
+        llm=Mock(), chromadb=Mock(), neo4j=Mock(), id_selector=Mock(), router=Mock()
+    )
+
+    assert query.resolve_collections(["a", "b"], "Vector") == [("Vector", True)] * 2
+    query.router.route.assert_not_called()
@@ -0,0 +1,91 @@
+import pytest
+
+import cache.semantic_cache
+from cache.semantic_cache import SemanticCache, salient_terms
+from conftest import embed
+
+
+class BagOfWordsModel:
+    def encode(self, text):
+        return embed(text)
+
+
+@pytest.fixture
+def semantic_cache():
+    return SemanticCache(
+        embedding_model=BagOfWordsModel(), threshold=0.95, max_entries=2
+    )
+
+
+def ask(semantic_cache, query, collection="both"):
+    return semantic_cache.get(semantic_cache.embed(query), collection, query)
+
+
+def store(semantic_cache, query, answer, collection="both"):
+    semantic_cache.put(semantic_cache.embed(query), collection, answer, query)
+
+
+def test_a_close_question_is_served_from_the_cache(semantic_cache):
+    store(semantic_cache, "what is the flood threshold", "answer")
+
+    assert ask(semantic_cache, "tell me the flood threshold") == "answer"
+    assert semantic_cache.hits == 1
+
+
+def test_a_question_about_another_year_is_not_served(semantic_cache):
+    # the embeddings of the two questions are the same, only the year differs
+    store(semantic_cache, "flood threshold in 2020", "answer for 2020")
+
+    assert ask(semantic_cache, "flood threshold in 2021") is None
+    assert ask(semantic_cache, "flood threshold in 2020") == "answer for 2020"
+
+
+def test_an_answer_is_only_served_for_its_collection(semantic_cache):
+    store(semantic_cache, "flood threshold", "answer", collection="Vector")
+
+    assert ask(semantic_cache, "flood threshold", collection="Graph") is None
+
+
+def test_a_distant_question_misses(semantic_cache):
+    store(semantic_cache, "flood threshold", "answer")
+
+    assert ask(semantic_cache, "hurricane gulf") is None
+    assert semantic_cache.misses == 1
+
+
+def test_the_least_recently_used_entry_gives_its_row_to_the_new_one(semantic_cache):
+    store(semantic_cache, "flood threshold", "flood")
+    store(semantic_cache, "hurricane gulf", "hurricane")
+    ask(semantic_cache, "flood threshold")
+    store(semantic_cache, "rainfall runoff", "rainfall")
+
+    assert semantic_cache.matrix.shape[0] == 2
+    assert ask(semantic_cache, "hurricane gulf") is None
+    assert ask(semantic_cache, "flood threshold") == "flood"
+    assert ask(semantic_cache, "rainfall runoff") == "rainfall"
+
+
+def test_entries_of_an_older_corpus_are_dropped(semantic_cache, monkeypatch):
+    store(semantic_cache, "flood threshold", "answer")
+    monkeypatch.setattr(cache.semantic_cache, "corpus_version", lambda: 1)
+
+    assert ask(semantic_cache, "flood threshold") is None
+    assert not semantic_cache.entries
+    assert len(semantic_cache.free_slots) == 2
+
+
+def test_clear_frees_every_row(semantic_cache):
+    store(semantic_cache, "flood threshold", "answer")
+    semantic_cache.clear()
+
+    assert ask(semantic_cache, "flood threshold") is None
+    assert not semantic_cache.matrix.any()
+
+
+def test_salient_terms_are_the_numbers_and_ids():
+    assert salient_terms("Which of P001_EXT_2 and 3.5 m in 2020?") == {
+        "p001_ext_2",
+        "3",
+        "5",
+        "2020",
+    }
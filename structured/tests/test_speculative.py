@@ -0,0 +1,122 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from query import config as query_config
+from query.async_query import AsyncQuery
+from query.query import Query
+from conftest import FakeCollection
+
+REVISED = ["flood", "hurricane gulf"]
+
+
+class FakeLLM:
+    model = "gpt-4o"
+
+    def __init__(self, revised=REVISED):
+        self.revised = revised
+
+    def revise_query(self, query, timeout=None):
+        return json.dumps(self.revised)
+
+
+class FakeAsyncLLM(FakeLLM):
+    def __init__(self, revised=REVISED, delay=0.0):
+        super().__init__(revised)
+        self.delay = delay
+
+    async def revise_query(self, query, timeout=None):
+        await asyncio.sleep(self.delay)
+        return json.dumps(self.revised)
+
+
+class FirstChunkSelector:
+    def select(self, records, user_query):
+        return [records[0]["chunk_id"]] if records else []
+
+
+@pytest.fixture
+def chroma(fake_chroma):
+    fake_chroma.chroma_client.collections = {
+        "Vector": FakeCollection("Vector", ["flood threshold sea level", "hurricane"]),
+        "Graph": FakeCollection("Graph", ["flood model", "authors", "hurricane gulf"]),
+    }
+    return fake_chroma
+
+
+@pytest.fixture(autouse=True)
+def local_selection(monkeypatch):
+    monkeypatch.setattr(query_config, "ADAPTIVE_RETRIEVAL", False)
+    monkeypatch.setattr(query_config, "ID_SELECTION_MODE", "local")
+
+
+def make(cls, llm, chroma):
+    return cls(
+        llm=llm,
+        chromadb=chroma,
+        neo4j=Mock(),
+        id_selector=FirstChunkSelector(),
+        router=Mock(),
+    )
+
+
+def texts(records):
+    return [r["text"] for r in records]
+
+
+def test_speculative_retrieve_only_retrieves_the_new_revised_queries(chroma):
+    query = make(Query, FakeLLM(), chroma)
+
+    retrieved, relevant_ids = query.speculative_retrieve(
+        user_query="flood", collection_names=["Vector", "Graph"], top_k=1
+    )
+
+    # the user query is retrieved first, only the revision that differs from it after
+    assert chroma.embedding_model.calls == [["flood"], ["hurricane gulf"]]
+    assert sorted(texts(retrieved["Graph"])) == ["flood model", "hurricane gulf"]
+    # ids of the user query records, then of the Graph records the revision added
+    assert relevant_ids == ["Graph0", "Graph2"]
+
+
+def test_speculative_retrieve_without_graph_selects_no_ids(chroma):
+    query = make(Query, FakeLLM(), chroma)
+
+    retrieved, relevant_ids = query.speculative_retrieve(
+        user_query="flood", collection_names=["Vector"], top_k=1
+    )
+
+    assert list(retrieved) == ["Vector"]
+    assert relevant_ids is None
+
+
+def test_async_speculative_retrieve_matches_query(chroma):
+    sync = make(Query, FakeLLM(), chroma)
+    query = make(AsyncQuery, FakeAsyncLLM(), chroma)
+
+    expected = sync.speculative_retrieve(
+        user_query="flood", collection_names=["Vector", "Graph"], top_k=1
+    )
+    result = asyncio.run(
+        query.speculative_retrieve(
+            user_query="flood", collection_names=["Vector", "Graph"], top_k=1
+        )
+    )
+
+    assert result == expected
+
+
+def test_async_speculative_retrieve_cancels_the_revision_when_retrieval_fails(chroma):
+    query = make(AsyncQuery, FakeAsyncLLM(delay=10), chroma)
+    query.chromadb.fan_out_retrieve_records = Mock(side_effect=RuntimeError("down"))
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await query.speculative_retrieve(
+                user_query="flood", collection_names=["Vector", "Graph"]
+            )
+        # the revision still in flight does not outlive the call
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
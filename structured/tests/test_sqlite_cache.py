@@ -0,0 +1,102 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from cache import SQLiteCache
+from query.query import Query
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def test_values_survive_a_new_instance(path):
+    SQLiteCache(namespace="test", path=path).set("key", ["a", 1])
+
+    cache = SQLiteCache(namespace="test", path=path)
+    assert cache.get("key") == ["a", 1]
+    assert cache.get("other") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_namespaces_do_not_collide(path):
+    SQLiteCache(namespace="one", path=path).set("key", "one")
+
+    assert SQLiteCache(namespace="two", path=path).get("key") is None
+
+
+def test_expired_entries_are_misses(path):
+    cache = SQLiteCache(namespace="test", path=path, ttl_seconds=-1)
+    cache.set("key", "value")
+
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_evict_keeps_the_most_recently_used(path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr("cache.sqlite_cache.time.time", lambda: next(clock))
+    cache = SQLiteCache(namespace="test", path=path, max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    cache.get("a")
+
+    cache.evict()
+
+    assert [cache.get(k) for k in ("a", "b", "c")] == ["a", None, "c"]
+
+
+def make_query(path, llm=None, chromadb=None):
+    return Query(
+        llm=llm or Mock(),
+        chromadb=chromadb or Mock(),
+        neo4j=Mock(),
+        id_selector=Mock(),
+        router=Mock(),
+        revise_cache=SQLiteCache(namespace="revise_query", path=path),
+        embedding_cache=SQLiteCache(namespace="query_embeddings", path=path),
+    )
+
+
+def test_revised_queries_are_reused_until_the_prompt_changes(path):
+    llm = Mock(model="gpt-4o")
+    llm.revise_query.return_value = json.dumps(["flood threshold"])
+    llm.prompt_hash.return_value = "v1"
+
+    assert make_query(path, llm=llm).revise("Flood threshold?") == ["flood threshold"]
+    # another process asking the same question with other spacing and case
+    assert make_query(path, llm=llm).revise("flood  THRESHOLD?") == ["flood threshold"]
+    assert llm.revise_query.call_count == 1
+
+    llm.prompt_hash.return_value = "v2"
+    make_query(path, llm=llm).revise("Flood threshold?")
+    assert llm.revise_query.call_count == 2
+
+
+def test_an_unparsed_revision_is_not_stored(path):
+    llm = Mock(model="gpt-4o")
+    llm.revise_query.return_value = "not a list"
+    llm.prompt_hash.return_value = "v1"
+    query = make_query(path, llm=llm)
+
+    assert query.revise("flood") == ["flood"]
+    query.revise("flood")
+    assert llm.revise_query.call_count == 2
+
+
+def test_only_the_queries_missing_from_the_cache_are_encoded(path):
+    chromadb = Mock(embedding_model_name="model")
+    chromadb.encode_queries.side_effect = lambda queries: [
+        [float(len(q))] for q in queries
+    ]
+    make_query(path, chromadb=chromadb).encode(["flood"])
+
+    embeddings = make_query(path, chromadb=chromadb).encode(["flood", "gulf"])
+
+    assert embeddings == [[5.0], [4.0]]
+    assert [c.args[0] for c in chromadb.encode_queries.call_args_list] == [
+        ["flood"],
+        ["gulf"],
+    ]
@@ -1,11 +1,49 @@
 """
-Entry point for the utils package
+Entry point for the utils package. The helpers depending on langchain, markitdown and tiktoken
+are imported on first use so that importing the server does not pay for the ingestion tooling
 """
 
-from .chunking import text_chunking
+from importlib import import_module
+
 from .json_analysis import analysis
-from .txt_to_json import convert_txt_to_json
-from .markdownConverter import markdownConverter
+from .txt_to_json import convert_txt_to_json, extract_json_block
 from .json_to_txt import json_to_txt
 from .logging_config import setup_logging
-from .tokenCount import tokencount_from_text, tokencount_from_file
+from .deadline import Deadline
+from .atomic_write import atomic_write
+from .metrics import (
+    track_stage,
+    record_error,
+    record_llm_call,
+    record_llm_retry,
+    record_chunks,
+    record_cache,
+    record_context,
+    record_graph_expansion,
+    record_degraded,
+    record_route,
+    record_admission,
+    record_coalesced,
+    set_serving_load,
+    metrics_payload,
+    add_observer,
+    remove_observer,
+)
+
+# name -> submodule defining it, imported by __getattr__ on first access
+LAZY_IMPORTS = {
+    "text_chunking": "chunking",
+    "markdownConverter": "markdownConverter",
+    "tokencount_from_text": "tokenCount",
+    "tokencount_from_file": "tokenCount",
+    "count_tokens": "tokenCount",
+}
+
+
+def __getattr__(name: str):
+    if name not in LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{LAZY_IMPORTS[name]}", __name__), name)
+    # importing the submodule binds it on the package, markdownConverter shares its name
+    globals()[name] = value
+    return value
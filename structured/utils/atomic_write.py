@@ -0,0 +1,31 @@
+"""
+Atomic replacement of output files
+"""
+
+import contextlib
+import os
+import tempfile
+
+
+def atomic_write(path: str, content: str) -> None:
+    """
+    Write the content through a temporary file of the same folder renamed over path, so that an
+    interrupted run or a concurrent reader never sees a partially written file
+
+    Args:
+        path(str): file to write, its folder is created if missing
+        content(str): text to write
+    """
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
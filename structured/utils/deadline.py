@@ -0,0 +1,52 @@
+"""
+Deadline of a piece of work, split into the time budgets of its stages
+"""
+
+import time
+from typing import Optional
+
+
+class Deadline:
+    """
+    Point in time by which the work must be done, no deadline when seconds is None
+    """
+
+    def __init__(self, seconds: Optional[float] = None) -> None:
+        """
+        Args:
+            seconds(Optional[float]): time allowed from now, None for no deadline
+        """
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        # set by the stages that were given up on to keep the deadline
+        self.degraded = False
+
+    def remaining(self) -> Optional[float]:
+        """
+        Returns:
+            remaining(Optional[float]): seconds left, never negative, None without deadline
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, fraction: float) -> Optional[float]:
+        """
+        Time budget of a stage allowed a fraction of the deadline, never past the deadline
+
+        Args:
+            fraction(float): share of the whole deadline the stage may take
+
+        Returns:
+            budget(Optional[float]): seconds, None without deadline
+        """
+        if self.expires_at is None:
+            return None
+        return min(self.remaining(), self.seconds * fraction)
+
+    def expired(self) -> bool:
+        """
+        Returns:
+            expired(bool): whether the deadline has passed
+        """
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
@@ -0,0 +1,350 @@
+"""
+Prometheus metrics for the query pipeline and the LLM calls
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2,
+    4,
+    8,
+    16,
+    32,
+    64,
+    128,
+)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+CHUNK_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+STAGE_LATENCY = Histogram(
+    "graphrag_stage_latency_seconds",
+    "Latency of each stage of the query pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "graphrag_stage_errors_total",
+    "Errors raised or swallowed in each stage of the query pipeline",
+    ["stage"],
+)
+LLM_LATENCY = Histogram(
+    "graphrag_llm_latency_seconds",
+    "Latency of the chat completion calls per LLM method",
+    ["method"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_RETRIES = Counter(
+    "graphrag_llm_retries_total",
+    "Chat completion calls retried per LLM method and error status",
+    ["method", "status"],
+)
+LLM_TOKENS = Histogram(
+    "graphrag_llm_tokens",
+    "Tokens used per chat completion call, cached is the part of the prompt served from the prompt cache",
+    ["method", "kind"],
+    buckets=TOKEN_BUCKETS,
+)
+RETRIEVED_CHUNKS = Histogram(
+    "graphrag_retrieved_chunks",
+    "Number of chunks retrieved per collection for a query",
+    ["collection"],
+    buckets=CHUNK_BUCKETS,
+)
+CONTEXT_TOKENS = Histogram(
+    "graphrag_context_tokens",
+    "Tokens of context packed into the prompt or dropped by the budget per source",
+    ["source", "kind"],
+    buckets=TOKEN_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "graphrag_cache_requests_total",
+    "Cache lookups per cache and result",
+    ["cache", "result"],
+)
+ROUTER_DECISIONS = Counter(
+    "graphrag_router_decisions_total",
+    "Retrieval paths picked by the query router and how they were decided",
+    ["route", "method"],
+)
+ADMISSIONS = Counter(
+    "graphrag_admissions_total",
+    "Queries admitted or rejected by the admission control",
+    ["result"],
+)
+COALESCED = Counter(
+    "graphrag_coalesced_requests_total",
+    "Requests that joined the in-flight computation of an identical request",
+    ["kind"],
+)
+IN_FLIGHT = Gauge(
+    "graphrag_in_flight_queries",
+    "Queries being answered",
+    multiprocess_mode="livesum",
+)
+QUEUED = Gauge(
+    "graphrag_queued_queries",
+    "Queries waiting for a free slot",
+    multiprocess_mode="livesum",
+)
+GRAPH_EXPANSIONS = Counter(
+    "graphrag_graph_expansions_total",
+    "Graph expansions run or skipped because the Vector records were sufficient",
+    ["decision"],
+)
+DEGRADED = Counter(
+    "graphrag_degraded_queries_total",
+    "Stages given up on because the query ran out of its deadline",
+    ["stage"],
+)
+
+# Callbacks receiving every stage and LLM call event, used by the benchmarks to collect raw timings
+_observers: List[Callable[[dict], None]] = []
+
+
+def add_observer(observer: Callable[[dict], None]) -> None:
+    """
+    Register a callback receiving every stage and LLM call event.
+    Stage events are {"type": "stage", "stage", "seconds"} and LLM events are
+    {"type": "llm", "method", "seconds", "prompt_tokens", "completion_tokens"}.
+
+    Args:
+        observer(Callable[[dict], None]): callback called with each event
+    """
+    _observers.append(observer)
+
+
+def remove_observer(observer: Callable[[dict], None]) -> None:
+    """
+    Unregister a callback added with add_observer
+
+    Args:
+        observer(Callable[[dict], None]): callback to remove
+    """
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+def _notify(event: dict) -> None:
+    for observer in list(_observers):
+        observer(event)
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """
+    Time the wrapped block as a stage of the query pipeline and count the exceptions raised from it
+
+    Args:
+        stage(str): name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=stage).inc()
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(seconds)
+        if _observers:
+            _notify({"type": "stage", "stage": stage, "seconds": seconds})
+
+
+def record_error(stage: str) -> None:
+    """
+    Count an error that was handled inside the stage instead of being raised
+
+    Args:
+        stage(str): name of the stage
+    """
+    STAGE_ERRORS.labels(stage=stage).inc()
+
+
+def record_llm_call(method: str, seconds: float, usage) -> None:
+    """
+    Record the latency and the token usage of a chat completion call
+
+    Args:
+        method(str): LLM method that made the call
+        seconds(float): latency of the call
+        usage: usage object returned by OpenAI, can be None
+    """
+    LLM_LATENCY.labels(method=method).observe(seconds)
+    if _observers:
+        _notify(
+            {
+                "type": "llm",
+                "method": method,
+                "seconds": seconds,
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+                "cached_tokens": cached_tokens(usage),
+                "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            }
+        )
+    if usage is None:
+        return
+    LLM_TOKENS.labels(method=method, kind="prompt").observe(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(method=method, kind="cached").observe(cached_tokens(usage))
+    LLM_TOKENS.labels(method=method, kind="completion").observe(
+        usage.completion_tokens or 0
+    )
+
+
+def record_llm_retry(method: str, status: str) -> None:
+    """
+    Count a chat completion call retried after an error
+
+    Args:
+        method(str): LLM method that made the call
+        status(str): HTTP status of the error, "connection" when there was no response
+    """
+    LLM_RETRIES.labels(method=method, status=status).inc()
+
+
+def cached_tokens(usage) -> int:
+    """
+    Prompt tokens served from the OpenAI prompt cache
+
+    Args:
+        usage: usage object returned by OpenAI, can be None
+
+    Returns:
+        cached(int): usage.prompt_tokens_details.cached_tokens, 0 when not reported
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def record_chunks(collection: str, count: int) -> None:
+    """
+    Record the number of chunks retrieved from a collection
+
+    Args:
+        collection(str): name of the collection
+        count(int): number of chunks retrieved
+    """
+    RETRIEVED_CHUNKS.labels(collection=collection).observe(count)
+
+
+def record_context(source: str, packed_tokens: int, dropped_tokens: int) -> None:
+    """
+    Record the tokens of context packed into the prompt and dropped by the budget
+
+    Args:
+        source(str): source of the context (Vector, Graph)
+        packed_tokens(int): tokens sent to the LLM
+        dropped_tokens(int): tokens left out because of the budget
+    """
+    CONTEXT_TOKENS.labels(source=source, kind="packed").observe(packed_tokens)
+    CONTEXT_TOKENS.labels(source=source, kind="dropped").observe(dropped_tokens)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """
+    Count a cache lookup
+
+    Args:
+        cache(str): name of the cache
+        hit(bool): True if the lookup was a hit
+    """
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_graph_expansion(expanded: bool) -> None:
+    """
+    Count a graph expansion decision
+
+    Args:
+        expanded(bool): True if the graph expansion ran, False if it was skipped
+    """
+    GRAPH_EXPANSIONS.labels(decision="expanded" if expanded else "skipped").inc()
+
+
+def record_degraded(stage: str) -> None:
+    """
+    Count a stage given up on because of the query deadline
+
+    Args:
+        stage(str): stage that ran out of budget
+    """
+    DEGRADED.labels(stage=stage).inc()
+
+
+def record_route(route: str, method: str) -> None:
+    """
+    Count a query router decision
+
+    Args:
+        route(str): route picked for the query
+        method(str): "rule", "embedding" or "fallback"
+    """
+    ROUTER_DECISIONS.labels(route=route, method=method).inc()
+
+
+def record_admission(result: str) -> None:
+    """
+    Count an admission decision
+
+    Args:
+        result(str): "admitted", "rejected_queue_full" or "rejected_timeout"
+    """
+    ADMISSIONS.labels(result=result).inc()
+
+
+def record_coalesced(kind: str) -> None:
+    """
+    Count a request that joined an identical in-flight request
+
+    Args:
+        kind(str): "query" or "stream"
+    """
+    COALESCED.labels(kind=kind).inc()
+
+
+def set_serving_load(in_flight: int, queued: int) -> None:
+    """
+    Set the number of queries being answered and waiting
+
+    Args:
+        in_flight(int): queries being answered
+        queued(int): queries waiting for a free slot
+    """
+    IN_FLIGHT.set(in_flight)
+    QUEUED.set(queued)
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    """
+    Render the metrics in the Prometheus text format.
+    When PROMETHEUS_MULTIPROC_DIR is set the metrics of all the workers are aggregated.
+
+    Returns:
+        payload(bytes), content_type(str)
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
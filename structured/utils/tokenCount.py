@@ -1,20 +1,54 @@
 import os
+from functools import lru_cache
 import tiktoken
 
 
-def tokencount_from_text(text: str, llm_model: str = "gpt-4o") -> None:
+@lru_cache(maxsize=None)
+def get_encoding(llm_model: str = "gpt-4o") -> tiktoken.Encoding:
+    """
+    Tokenizer of the model, loaded once per process
+
+    Args:
+        llm_model(str): Model for which to calculate the token
+    Returns:
+        encoding(tiktoken.Encoding): tokenizer of the model, o200k_base for unknown models
+    """
+    try:
+        return tiktoken.encoding_for_model(llm_model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, llm_model: str = "gpt-4o") -> int:
+    """
+    Number of tokens in the text
+
+    Args:
+        text(str): text to count the tokens of
+        llm_model(str): Model for which to calculate the token
+    Returns:
+        count(int): number of tokens
+    """
+    return len(get_encoding(llm_model).encode(text, disallowed_special=()))
+
+
+def tokencount_from_text(
+    text: str, llm_model: str = "gpt-4o", verbose: bool = True
+) -> int:
     """
     Prints the number of tokens in each files. Useful to check before sending it to LLMs
 
     Args:
-        source_path(str) : folder to get all the files from
+        text(str) : text to count the tokens of
         llm_model(str): Model for which to calculate the token
+        verbose(bool): print the count
     Returns:
-        None
+        count(int): number of tokens of the text
     """
-    encoding = tiktoken.encoding_for_model(llm_model)
-    tokens = encoding.encode(text)
-    print("Number of token for the provided text is", len(tokens))
+    count = count_tokens(text, llm_model)
+    if verbose:
+        print("Number of token for the provided text is", count)
+    return count
 
 
 def tokencount_from_file(source_path: str, llm_model: str = "gpt-4o") -> None:
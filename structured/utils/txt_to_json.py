@@ -4,15 +4,34 @@ import re
 from typing import Optional
 import logging
 
+from .atomic_write import atomic_write
+
 logger = logging.getLogger(__name__)
 
+JSON_BLOCK_PATTERN = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+
+def extract_json_block(content: str) -> Optional[dict]:
+    """
+    JSON object of the first fenced code block of an LLM answer
+    Args:
+        content(str): answer of the LLM
+
+    Returns:
+        json(Optional[dict]): parsed object, None when there is no JSON block
+    """
+    match = JSON_BLOCK_PATTERN.search(content)
+    if not match:
+        return None
+    return json.loads(match.group(1))
+
 
 def convert_txt_to_json(
     file_name: str = "",
     folder_name: str = "",
     output_folder: str = "ontology_outputs_json/",
     content: Optional[str] = "",
-):
+) -> bool:
     """
     converts provided txt to json
     Args:
@@ -20,6 +39,9 @@ def convert_txt_to_json(
         folder_name(str): name of the folder from where to extract the txt from
         output_folder(str): output folder where the json file should be stored
         content:Optional[str]: you can provide content instead of file_name and folder_name
+
+    Returns:
+        converted(bool): whether the json file was written
     """
     try:
         output_file_name = file_name.split(".")[0] + ".json"
@@ -36,16 +58,16 @@ def convert_txt_to_json(
             with open(file_path, "r") as f:
                 content = f.read()
 
-        match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", content, re.DOTALL)
-        if match:
-            formatted_json = json.loads(match.group(1))
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(formatted_json, f, indent=2)
+        formatted_json = extract_json_block(content)
+        if formatted_json is not None:
+            atomic_write(output_path, json.dumps(formatted_json, indent=2))
             logger.info(f"Output created in {output_path}")
+            return True
         else:
             raise ValueError("No valid JSON block found")
     except Exception as e:
         logger.error(f"Failed to convert {file_name} to json:{e}")
+    return False
 
 
 if __name__ == "__main__":